@@ -0,0 +1,539 @@
+""" CACHE - content-addressed on-disk cache for pipeline products
+    v1.0: 2026-10-18
+"""
+from __future__ import print_function
+
+# Photometry Pipeline
+# Copyright (C) 2016-2018  Michael Mommert, mommermiscience@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import logging
+import numpy as np
+from astropy.table import Table, vstack
+
+# pipeline-specific modules
+import _pp_conf
+
+# setup logging
+logging.basicConfig(filename=_pp_conf.log_filename,
+                    level=_pp_conf.log_level,
+                    format=_pp_conf.log_formatline,
+                    datefmt=_pp_conf.log_datefmt)
+
+
+def hash_file(filename, hasher=None, blocksize=2**20):
+    """feed the content of file `filename` into `hasher` (a hashlib
+    object); a new sha1 object is created if `hasher` is None; the
+    hasher is returned"""
+
+    if hasher is None:
+        hasher = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            hasher.update(block)
+    return hasher
+
+
+class DiskCache(object):
+    """size-bounded, least-recently-used file cache
+
+    Files are stored in `directory` under their key; an sqlite index
+    (``index.db``) keeps track of sizes and access times. The cache is
+    safe to use from several processes at the same time: files are
+    moved into place atomically and index updates are short
+    transactions."""
+
+    index_filename = 'index.db'
+
+    def __init__(self, directory, max_size):
+        """
+        :param directory: cache directory (created if necessary)
+        :param max_size: size budget in bytes; least recently used
+                         entries are evicted beyond this size
+        """
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(key TEXT PRIMARY KEY, size INTEGER, '
+                       'created REAL, accessed REAL, description TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory,
+                                            self.index_filename),
+                               timeout=60)
+
+    def path(self, key):
+        """file path of the cache entry `key`"""
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """return path to cached file `key` or None if `key` is not
+        cached; a hit updates the entry's access time"""
+        filename = self.path(key)
+        with self._connect() as db:
+            if not os.path.exists(filename):
+                db.execute('DELETE FROM entries WHERE key=?', (key,))
+                return None
+            cur = db.execute('UPDATE entries SET accessed=? WHERE key=?',
+                             (time.time(), key))
+            if cur.rowcount == 0:
+                return None
+        return filename
+
+    def put(self, key, filename, description=''):
+        """copy file `filename` into the cache as entry `key`; returns
+        the path of the cached file"""
+        target = self.path(key)
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        # copy to temporary file first, then move into place
+        tmpname = '%s.%d.tmp' % (target, os.getpid())
+        shutil.copyfile(filename, tmpname)
+        os.replace(tmpname, target)
+
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)',
+                       (key, os.path.getsize(target), now, now,
+                        description))
+        self.evict()
+        return target
+
+    def retrieve(self, key, filename):
+        """copy cache entry `key` to `filename`; returns True on a
+        cache hit, False otherwise"""
+        cached = self.get(key)
+        if cached is None:
+            return False
+        try:
+            shutil.copyfile(cached, filename)
+        except (IOError, OSError):
+            # entry was evicted by another process in the meantime
+            return False
+        return True
+
+    def remove(self, key):
+        """remove entry `key` from the cache"""
+        with self._connect() as db:
+            db.execute('DELETE FROM entries WHERE key=?', (key,))
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def entries(self):
+        """list of (key, size, created, accessed, description) tuples,
+        most recently used first"""
+        with self._connect() as db:
+            return db.execute('SELECT key, size, created, accessed, '
+                              'description FROM entries '
+                              'ORDER BY accessed DESC').fetchall()
+
+    def size(self):
+        """total size of all cache entries in bytes"""
+        with self._connect() as db:
+            size = db.execute('SELECT SUM(size) FROM entries').fetchone()[0]
+        return 0 if size is None else size
+
+    def evict(self, max_size=None):
+        """remove least recently used entries until the cache size is
+        below `max_size` (default: the cache's size budget); returns
+        the number of entries removed"""
+        if max_size is None:
+            max_size = self.max_size
+
+        with self._connect() as db:
+            rows = db.execute('SELECT key, size FROM entries '
+                              'ORDER BY accessed DESC').fetchall()
+            total, evicted = 0, []
+            for key, size in rows:
+                total += size
+                if total > max_size:
+                    evicted.append(key)
+            db.executemany('DELETE FROM entries WHERE key=?',
+                           [(key,) for key in evicted])
+
+        for key in evicted:
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+
+        if len(evicted) > 0:
+            logging.info('evicted %d entries from cache %s' %
+                         (len(evicted), self.directory))
+        return len(evicted)
+
+    def purge(self, older_than=None):
+        """remove all entries, or only those that have not been
+        accessed for `older_than` seconds; returns the number of
+        entries removed"""
+        if older_than is None:
+            keys = [e[0] for e in self.entries()]
+        else:
+            keys = [e[0] for e in self.entries()
+                    if e[3] < time.time()-older_than]
+        for key in keys:
+            self.remove(key)
+        logging.info('purged %d entries from cache %s' %
+                     (len(keys), self.directory))
+        return len(keys)
+
+
+class ExtractionCache(DiskCache):
+    """cache for Source Extractor LDAC output files; entries are keyed
+    on the content of the image, mask, configuration and parameter
+    files, as well as the Source Extractor option string"""
+
+    def key(self, filename, configfile, optionstring,
+            mask_file=None, paramfile=None, backend='sex'):
+        """derive the cache key for one Source Extractor run
+
+        :param filename: FITS image filename
+        :param configfile: Source Extractor configuration file
+        :param optionstring: command line options; must not contain
+                             the ``-CATALOG_NAME`` option
+        :param mask_file: weight image filename (optional)
+        :param paramfile: Source Extractor parameter file (optional);
+                          if not provided, the parameter file
+                          referenced in `configfile` is used
+        :param backend: extraction backend identifier
+        :return: hex digest
+        """
+        if paramfile is None:
+            paramfile = self.config_paramfile(configfile)
+
+        hasher = hashlib.sha1()
+        hasher.update(backend.encode('utf-8'))
+        hasher.update((' '.join(optionstring.split())).encode('utf-8'))
+        for name in [filename, configfile, mask_file, paramfile]:
+            hasher.update(b'|')
+            if name is not None:
+                hash_file(os.path.expandvars(name), hasher)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def config_paramfile(configfile):
+        """return the PARAMETERS_NAME entry of a Source Extractor
+        configuration file, or None if not available"""
+        with open(os.path.expandvars(configfile), 'r') as f:
+            for line in f:
+                items = line.split('#')[0].split()
+                if len(items) > 1 and items[0] == 'PARAMETERS_NAME':
+                    paramfile = os.path.expandvars(items[1])
+                    if os.path.exists(paramfile):
+                        return paramfile
+        return None
+
+
+# HEALPix (nested scheme) tiling of the sky; see Gorski et al. 2005,
+# ApJ 622, 759
+
+_jrll = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_jpll = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def _interleave(ix, iy, order):
+    """combine the bits of ix (even bits) and iy (odd bits)"""
+    pix = np.zeros_like(ix)
+    for bit in range(order):
+        pix |= ((ix >> bit) & 1) << (2*bit)
+        pix |= ((iy >> bit) & 1) << (2*bit+1)
+    return pix
+
+
+def _deinterleave(pix, order):
+    """split pixel number into ix (even bits) and iy (odd bits)"""
+    ix, iy = np.zeros_like(pix), np.zeros_like(pix)
+    for bit in range(order):
+        ix |= ((pix >> (2*bit)) & 1) << bit
+        iy |= ((pix >> (2*bit+1)) & 1) << bit
+    return ix, iy
+
+
+def healpix_ang2pix(order, ra_deg, dec_deg):
+    """nested HEALPix pixel numbers of the positions `ra_deg`,
+    `dec_deg` (degrees) for nside=2**order"""
+    nside = 2**order
+    z = np.sin(np.radians(np.atleast_1d(dec_deg).astype(float)))
+    za = np.abs(z)
+    tt = np.mod(np.atleast_1d(ra_deg).astype(float), 360)/90.
+    tt = np.where(tt >= 4, 0, tt)
+
+    face = np.zeros(z.shape, dtype=np.int64)
+    ix = np.zeros(z.shape, dtype=np.int64)
+    iy = np.zeros(z.shape, dtype=np.int64)
+
+    # equatorial region
+    eq = za <= 2./3
+    temp1 = nside*(0.5+tt[eq])
+    temp2 = nside*z[eq]*0.75
+    jp = (temp1-temp2).astype(np.int64)  # ascending edge line
+    jm = (temp1+temp2).astype(np.int64)  # descending edge line
+    ifp, ifm = jp >> order, jm >> order
+    face[eq] = np.where(ifp == ifm, ifp | 4,
+                        np.where(ifp < ifm, ifp, ifm+8))
+    ix[eq] = jm & (nside-1)
+    iy[eq] = nside - (jp & (nside-1)) - 1
+
+    # polar caps
+    pol = ~eq
+    ntt = np.minimum(3, tt[pol].astype(np.int64))
+    tp = tt[pol]-ntt
+    tmp = nside*np.sqrt(3*(1-za[pol]))
+    jp = np.minimum((tp*tmp).astype(np.int64), nside-1)
+    jm = np.minimum(((1-tp)*tmp).astype(np.int64), nside-1)
+    north = z[pol] >= 0
+    face[pol] = np.where(north, ntt, ntt+8)
+    ix[pol] = np.where(north, nside-jm-1, jp)
+    iy[pol] = np.where(north, nside-jp-1, jm)
+
+    return face*nside**2 + _interleave(ix, iy, order)
+
+
+def healpix_pix2ang(order, pix):
+    """center positions (ra, dec in degrees) of nested HEALPix pixels
+    `pix` for nside=2**order"""
+    nside = 2**order
+    pix = np.atleast_1d(pix).astype(np.int64)
+    face = pix >> (2*order)
+    ix, iy = _deinterleave(pix & (nside**2-1), order)
+
+    jr = (_jrll[face] << order) - ix - iy - 1
+    nr = np.where(jr < nside, jr, np.where(jr > 3*nside, 4*nside-jr, nside))
+    z = np.where(jr < nside, 1-nr**2/(3.*nside**2),
+                 np.where(jr > 3*nside, nr**2/(3.*nside**2)-1,
+                          (2*nside-jr)*2./(3*nside)))
+    kshift = np.where((jr >= nside) & (jr <= 3*nside), (jr-nside) & 1, 0)
+
+    jp = (_jpll[face]*nr + ix - iy + 1 + kshift)//2
+    jp = np.where(jp > 4*nside, jp-4*nside, jp)
+    jp = np.where(jp < 1, jp+4*nside, jp)
+    ra = (jp-(kshift+1)*0.5)*90./nr
+    return ra, np.degrees(np.arcsin(z))
+
+
+def healpix_max_radius(order):
+    """maximum angular distance (degrees) between any point in a
+    HEALPix pixel and the pixel center (max_pixrad of the HEALPix
+    library)"""
+    nside = 2**order
+    z = np.array([2/3., 1-(1-1./nside)**2/3])
+    phi = np.array([np.pi/(4*nside), 0])
+    x, y = np.sqrt(1-z**2)*np.cos(phi), np.sqrt(1-z**2)*np.sin(phi)
+    return np.degrees(np.arccos(np.clip(x[0]*x[1]+y[0]*y[1]+z[0]*z[1],
+                                        -1, 1)))
+
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    """angular distance (degrees) between positions in degrees"""
+    ra1, dec1, ra2, dec2 = [np.radians(np.asarray(x, dtype=float))
+                            for x in (ra1, dec1, ra2, dec2)]
+    hav = (np.sin((dec2-dec1)/2)**2 +
+           np.cos(dec1)*np.cos(dec2)*np.sin((ra2-ra1)/2)**2)
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(hav, 0, 1))))
+
+
+class CatalogCache(DiskCache):
+    """cache for reference catalog queries; the sky is partitioned into
+    nested HEALPix tiles of order `order`, each of which is stored as
+    a FITS table of all catalog sources in this tile; a cone query is
+    served by assembling all tiles that overlap with the cone"""
+
+    def __init__(self, directory, max_size, order=7):
+        """
+        :param directory: cache directory (created if necessary)
+        :param max_size: size budget in bytes
+        :param order: HEALPix order (nside=2**order) of the tiles
+        """
+        DiskCache.__init__(self, directory, max_size)
+        self.order = order
+
+    def tile_key(self, query, pixel):
+        """cache key of one tile; `query` is a (catalog, columns,
+        column filters) tuple that identifies the catalog content"""
+        catalog, columns, column_filters = query
+        signature = json.dumps([catalog, list(columns),
+                                sorted((column_filters or {}).items()),
+                                self.order, int(pixel)])
+        return hashlib.sha1(signature.encode('utf-8')).hexdigest()
+
+    def cone_tiles(self, ra_deg, dec_deg, rad_deg):
+        """pixel numbers of all tiles that overlap with a cone; the
+        nested pixel hierarchy is descended from order 0, only the
+        children of overlapping pixels are tested"""
+        pixels = np.arange(12)
+        for order in range(self.order+1):
+            if order > 0:
+                pixels = (4*pixels[:, np.newaxis] + np.arange(4)).ravel()
+            ra, dec = healpix_pix2ang(order, pixels)
+            dist = angular_distance(ra, dec, ra_deg, dec_deg)
+            pixels = pixels[dist <= rad_deg+healpix_max_radius(order)]
+        return pixels
+
+    def tile_cones(self, pixels):
+        """cones that fully cover tiles `pixels`: a single cone around
+        all tiles or one cone per tile, whichever covers the smaller
+        area; returns list of (ra_deg, dec_deg, rad_deg, tiles covered)"""
+        radius = healpix_max_radius(self.order)
+        ra, dec = healpix_pix2ang(self.order, pixels)
+        if len(pixels) == 1:
+            return [(ra[0], dec[0], radius, pixels)]
+
+        # center of the tiles from their mean unit vector
+        ra_rad, dec_rad = np.radians(ra), np.radians(dec)
+        x, y, z = [np.mean(c) for c in (np.cos(dec_rad)*np.cos(ra_rad),
+                                         np.cos(dec_rad)*np.sin(ra_rad),
+                                         np.sin(dec_rad))]
+        center_ra = np.degrees(np.arctan2(y, x)) % 360
+        center_dec = np.degrees(np.arctan2(z, np.hypot(x, y)))
+        bounding = np.max(angular_distance(ra, dec, center_ra,
+                                           center_dec)) + radius
+
+        # cone areas are proportional to 1-cos(radius)
+        if (1-np.cos(np.radians(bounding)) <=
+                len(pixels)*(1-np.cos(np.radians(radius)))):
+            return [(center_ra, center_dec, bounding, pixels)]
+        return [(ra[i], dec[i], radius, pixels[i:i+1])
+                for i in range(len(pixels))]
+
+    def load_tiles(self, query, pixels):
+        """return dictionary of cached tables for `pixels`; tiles that
+        are not cached are missing"""
+        tiles = {}
+        for pixel in pixels:
+            filename = self.get(self.tile_key(query, pixel))
+            if filename is None:
+                continue
+            try:
+                tiles[pixel] = Table.read(filename, format='fits')
+            except (IOError, OSError):
+                # entry was evicted by another process in the meantime
+                continue
+        return tiles
+
+    def store_tiles(self, query, pixels, data, radec):
+        """split table `data` into tiles and store tiles `pixels`; the
+        tiles must be fully covered by the query that provided `data`;
+        `radec` are the names of the coordinate columns; returns the
+        list of tile tables"""
+        data = Table(data, copy=False)
+        data.meta.clear()
+        tile_idx = healpix_ang2pix(self.order,
+                                   np.asarray(data[radec[0]], dtype=float),
+                                   np.asarray(data[radec[1]], dtype=float))
+        catalog = query[0]
+        tiles = []
+        for pixel in pixels:
+            tile = data[tile_idx == pixel]
+            tiles.append(tile)
+            tmpname = os.path.join(self.directory,
+                                   'tile_%d_%d.fits' % (os.getpid(), pixel))
+            try:
+                tile.write(tmpname, format='fits', overwrite=True)
+                self.put(self.tile_key(query, pixel), tmpname,
+                         description='%s order %d tile %d' % (
+                             catalog, self.order, pixel))
+            finally:
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+        return tiles
+
+    def query(self, query, ra_deg, dec_deg, rad_deg, radec, fetch,
+              row_limit=-1, fetch_limit=None, offline=False):
+        """cone query served from cached tiles; only missing tiles are
+        obtained through `fetch` (see tile_cones)
+
+        :param query: (catalog, columns, column filters) tuple
+        :param ra_deg, dec_deg, rad_deg: cone center and radius (deg)
+        :param radec: names of the coordinate columns (deg)
+        :param fetch: function (ra_deg, dec_deg, rad_deg, row_limit)
+                      returning a table of sources in a cone or None if
+                      there are none
+        :param row_limit: maximum number of sources to return (nearest
+                          to the cone center first); -1: no limit
+        :param fetch_limit: row limit used to fetch tiles; if this limit
+                            is reached, the tiles are incomplete and not
+                            cached, and the cone is queried directly
+                            with `row_limit`
+        :param offline: if True, `fetch` is never called and None is
+                        returned if tiles are missing
+        :return: table or None
+        """
+        pixels = self.cone_tiles(ra_deg, dec_deg, rad_deg)
+        tiles = self.load_tiles(query, pixels)
+        missing = np.array([pixel for pixel in pixels
+                            if pixel not in tiles], dtype=int)
+
+        if len(missing) == 0:
+            logging.info('%s query served from %d cached tiles' %
+                         (query[0], len(pixels)))
+        elif offline:
+            logging.error('%s query at %.5f/%+.5f (%.3f deg) not '
+                          'available in offline mode' %
+                          (query[0], ra_deg, dec_deg, rad_deg))
+            return None
+        else:
+            # fetch cones that fully cover the missing tiles
+            complete = True
+            for cone_ra, cone_dec, cone_rad, covered in self.tile_cones(
+                    missing):
+                data = fetch(cone_ra, cone_dec, cone_rad,
+                             -1 if fetch_limit is None else fetch_limit)
+                if data is None:
+                    continue
+                # sharded queries flag incomplete results themselves
+                truncated = data.meta.get(
+                    'truncated',
+                    fetch_limit is not None and len(data) >= fetch_limit)
+                if truncated:
+                    complete = False
+                    continue
+                tiles.update(zip(covered, self.store_tiles(
+                    query, covered, data, radec)))
+            logging.info('%s: %d of %d tiles fetched and cached' %
+                         (query[0], len(tiles) - (len(pixels) -
+                                                  len(missing)),
+                          len(pixels)))
+
+            if not complete:
+                # tiles cannot be stored; query the cone itself
+                logging.warning('%s tile query at %.5f/%+.5f truncated at '
+                                '%d rows; cone is queried directly' %
+                                (query[0], ra_deg, dec_deg, fetch_limit))
+                data = fetch(ra_deg, dec_deg, rad_deg, row_limit)
+                tiles = {0: data} if data is not None else {}
+
+        tiles = [tile for tile in tiles.values() if len(tile) > 0]
+        if len(tiles) == 0:
+            return None
+        data = vstack(tiles, metadata_conflicts='silent')
+        dist = angular_distance(data[radec[0]], data[radec[1]],
+                                ra_deg, dec_deg)
+        sort = np.argsort(dist, kind='stable')
+        sort = sort[dist[sort] <= rad_deg]
+        if row_limit is not None and row_limit >= 0:
+            sort = sort[:row_limit]
+        if len(sort) == 0:
+            return None
+        return data[sort]
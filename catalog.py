@@ -1,5 +1,4 @@
 import _pp_conf
-from pandas import read_sql
 """
 CATALOG - class structure for dealing with astronomical catalogs,
           FITS_LDAC files, and sqlite databases.
@@ -33,11 +32,14 @@ import numpy as np
 import sqlite3 as sql
 import astropy.units as u
 import astropy.coordinates as coord
-from astropy.table import Table, Column
+from astropy.table import Table, Column, MaskedColumn, vstack
+from astropy.utils.metadata import merge as merge_meta
 from astropy import __version__ as astropyversion
 from astropy.io import fits
 import scipy.optimize as optimization
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 warnings.simplefilter("ignore", UserWarning)
 
 
@@ -62,6 +64,8 @@ sql.register_adapter(np.int64, int)
 sql.register_adapter(np.int32, int)
 
 # import pp modules
+from cache import CatalogCache, angular_distance
+from pp_setup import confcatalog
 
 # setup logging
 logging.basicConfig(filename=_pp_conf.log_filename,
@@ -70,6 +74,611 @@ logging.basicConfig(filename=_pp_conf.log_filename,
                     datefmt=_pp_conf.log_datefmt)
 
 
+# sky matching
+
+def unit_vectors(ra_deg, dec_deg):
+    """3-d unit vectors (n, 3) of positions in degrees"""
+    ra = np.radians(np.atleast_1d(np.asarray(ra_deg, dtype=float)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec_deg, dtype=float)))
+    return np.vstack([np.cos(dec)*np.cos(ra),
+                      np.cos(dec)*np.sin(ra),
+                      np.sin(dec)]).T
+
+
+def separation_to_chord(separation):
+    """chord length between unit vectors separated by `separation`
+    (degrees) on the sphere"""
+    return 2*np.sin(np.radians(np.minimum(separation, 180))/2)
+
+
+def chord_to_separation(chord):
+    """angular separation (degrees) for chord length `chord`; infinite
+    chord lengths remain infinite"""
+    chord = np.asarray(chord, dtype=float)
+    finite = np.isfinite(chord)
+    separation = np.full(chord.shape, np.inf)
+    separation[finite] = np.degrees(
+        2*np.arcsin(np.clip(chord[finite]/2, 0, 1)))
+    return separation
+
+
+class SkyIndex(object):
+    """spatial index of sky positions based on a kd-tree of 3-d unit
+    vectors; separations are great-circle distances, which makes
+    matching tolerances independent of declination and RA
+    wrap-around; an index can be built once and used for any number
+    of queries"""
+
+    def __init__(self, ra_deg, dec_deg):
+        """
+        :param ra_deg, dec_deg: positions (degrees) to be indexed
+        """
+        self.size = len(np.atleast_1d(ra_deg))
+        self.tree = spatial.cKDTree(unit_vectors(ra_deg, dec_deg))
+
+    def query(self, ra_deg, dec_deg, k=1, max_separation=None):
+        """find the `k` nearest indexed positions for each query position
+        :param max_separation: only consider indexed positions within
+                               this separation (degrees)
+        :return: separations (degrees) and indices; where no neighbor
+                 is available, separation is inf and index is the index
+                 size
+        """
+        if max_separation is None:
+            bound = np.inf
+        else:
+            bound = np.nextafter(separation_to_chord(max_separation), np.inf)
+        chord, idx = self.tree.query(unit_vectors(ra_deg, dec_deg), k=k,
+                                     distance_upper_bound=bound)
+        return chord_to_separation(chord), idx
+
+    def query_radius(self, ra_deg, dec_deg, radius):
+        """indices of all indexed positions within `radius` (degrees) of
+        each query position; returns list of index lists"""
+        return self.tree.query_ball_point(unit_vectors(ra_deg, dec_deg),
+                                          separation_to_chord(radius))
+
+    def pairs(self, ra_deg, dec_deg, max_separation):
+        """all pairs of query positions and indexed positions within
+        `max_separation` (degrees)
+        :return: query indices and indexed position indices of all pairs
+        """
+        sep, idx = self.query(ra_deg, dec_deg, k=2,
+                              max_separation=max_separation)
+        found = np.isfinite(sep)
+        # positions with two neighbors may have more
+        crowded = found[:, 1]
+        query_idx = np.repeat(np.arange(len(sep)), 2).reshape(-1, 2)
+        query_idx = [query_idx[~crowded][found[~crowded]]]
+        index_idx = [idx[~crowded][found[~crowded]]]
+        if np.any(crowded):
+            crowded = np.where(crowded)[0]
+            neighbors = self.query_radius(np.ma.getdata(ra_deg)[crowded],
+                                          np.ma.getdata(dec_deg)[crowded],
+                                          max_separation)
+            query_idx.append(np.repeat(crowded, [len(n) for n in neighbors]))
+            index_idx.append(np.concatenate(neighbors).astype(int))
+        return np.concatenate(query_idx), np.concatenate(index_idx)
+
+
+# sharded cone queries
+
+def cone_shards(ra_deg, dec_deg, rad_deg, shard_rad_deg):
+    """centers of cones with radius `shard_rad_deg` that fully cover the
+    cone at `ra_deg`, `dec_deg` with radius `rad_deg` (all degrees);
+    shards are laid out on a square grid in the tangent plane (the
+    gnomonic projection does not shrink distances, which makes plane
+    coverage sufficient for sky coverage)
+    return: arrays of shard ra and dec (degrees)"""
+    radius = np.tan(np.radians(min(rad_deg, 89)))
+    step = np.sqrt(2)*np.radians(shard_rad_deg)
+    n = max(int(np.ceil(radius/step-0.5)), 0)
+    x, y = [grid.ravel() for grid in
+            np.meshgrid(np.arange(-n, n+1)*step, np.arange(-n, n+1)*step)]
+
+    # only keep grid cells that overlap with the cone
+    overlap = (np.hypot(np.maximum(np.abs(x)-step/2, 0),
+                        np.maximum(np.abs(y)-step/2, 0)) <= radius)
+    x, y = x[overlap], y[overlap]
+
+    # inverse gnomonic projection
+    ra0, dec0 = np.radians(ra_deg), np.radians(dec_deg)
+    rho = np.hypot(x, y)
+    c = np.arctan(rho)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dec = np.where(rho > 0, np.arcsin(
+            np.cos(c)*np.sin(dec0) + y*np.sin(c)*np.cos(dec0)/rho), dec0)
+    ra = ra0 + np.arctan2(x*np.sin(c), rho*np.cos(dec0)*np.cos(c) -
+                          y*np.sin(dec0)*np.sin(c))
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+
+def fetch_with_retry(fetch, *args, **kwargs):
+    """call `fetch` with the given arguments; retry on errors
+    (ConfCatalog.catalog_query_retries) with increasing delays"""
+    for attempt in range(confcatalog.catalog_query_retries+1):
+        try:
+            return fetch(*args, **kwargs)
+        except Exception as e:
+            if attempt == confcatalog.catalog_query_retries:
+                raise
+            logging.warning('catalog query failed (%s); retry' % str(e))
+            time.sleep(2**attempt)
+
+
+def fetch_sharded(fetch, ra_deg, dec_deg, rad_deg, radec, ident=None,
+                  row_limit=-1, max_depth=3):
+    """
+    cone query split into sub-cones (see ConfCatalog) that are fetched
+    concurrently; sub-cones that reach the row limit are split again
+    (up to `max_depth` times) to obtain complete results
+    input: fetch function (ra_deg, dec_deg, rad_deg, row_limit)
+           returning a table or None, cone center and radius (deg),
+           names of coordinate columns, name of the identifier column
+           used to remove duplicates (default: coordinates), row limit
+           of the merged result (nearest sources first; -1: no limit)
+    return: table or None; table.meta['truncated'] is True if results
+            are incomplete
+    """
+    shard_limit = confcatalog.catalog_cache_fetch_limit
+    truncated = []
+
+    def fetch_shard(ra, dec, rad, depth=0):
+        data = fetch_with_retry(fetch, ra, dec, rad, shard_limit)
+        if data is None or len(data) < shard_limit:
+            return [data]
+        if depth >= max_depth:
+            logging.warning('sub-cone query at %.5f/%+.5f truncated at %d '
+                            'rows' % (ra, dec, len(data)))
+            truncated.append(True)
+            return [data]
+        tables = []
+        for sub_ra, sub_dec in zip(*cone_shards(ra, dec, rad, rad/2)):
+            tables += fetch_shard(sub_ra, sub_dec, rad/2, depth+1)
+        return tables
+
+    shard_ra, shard_dec = cone_shards(ra_deg, dec_deg, rad_deg,
+                                      confcatalog.catalog_shard_radius)
+    logging.info('cone query at %.5f/%+.5f (%.3f deg) split into %d '
+                 'sub-cones' % (ra_deg, dec_deg, rad_deg, len(shard_ra)))
+    pool = ThreadPoolExecutor(
+        max_workers=confcatalog.catalog_shard_workers)
+    try:
+        tables = [table for tables in pool.map(
+            lambda shard: fetch_shard(shard[0], shard[1],
+                                      confcatalog.catalog_shard_radius),
+            zip(shard_ra, shard_dec)) for table in tables
+            if table is not None and len(table) > 0]
+    finally:
+        pool.shutdown(wait=True)
+    if len(tables) == 0:
+        return None
+    data = vstack(tables, metadata_conflicts='silent')
+
+    # remove duplicates from overlapping sub-cones
+    if ident is not None and ident in data.colnames:
+        keys = np.ma.getdata(data[ident])
+    else:
+        keys = np.rec.fromarrays([np.ma.getdata(data[radec[0]]),
+                                  np.ma.getdata(data[radec[1]])])
+    _, first = np.unique(keys, return_index=True)
+
+    # restrict to the requested cone, nearest sources first
+    dist = angular_distance(data[radec[0]][first], data[radec[1]][first],
+                            ra_deg, dec_deg)
+    order = np.argsort(dist, kind='stable')
+    first = first[order[dist[order] <= rad_deg]]
+    if row_limit is not None and 0 <= row_limit < len(first):
+        first = first[:int(row_limit)]
+        truncated.append(True)
+    if len(first) == 0:
+        return None
+    data = data[first]
+    data.meta['truncated'] = len(truncated) > 0
+    return data
+
+
+# table joins
+
+def join_left(left, right, key, right_keys, table_names=('1', '2')):
+    """
+    left join of two tables on integer keys that gathers rows through
+    index arrays instead of copying and sorting `right`; equivalent to
+    astropy.table.join(left, right, keys=key, join_type='left') with
+    the key column of `right` replaced by `right_keys`
+    input: left table, right table, name of the key column in `left`
+           (a column of this name in `right` is ignored), key of each
+           row in `right`, suffixes for columns that appear in both tables
+    return: joined table
+    """
+    left_keys = np.asarray(left[key])
+    right_keys = np.asarray(right_keys)
+
+    # rows with equal keys are ordered as in astropy.table.join, which
+    # sorts the keys of both tables in a single structured array
+    sortable = np.empty(len(left_keys)+len(right_keys),
+                        dtype=[('0', np.result_type(left_keys, right_keys))])
+    sortable['0'][:len(left_keys)] = left_keys
+    sortable['0'][len(left_keys):] = right_keys
+    rank = np.empty(len(sortable), dtype=int)
+    rank[sortable.argsort(order=['0'])] = np.arange(len(sortable))
+
+    # rows in `right` for each row in `left`; the result is sorted by key
+    right_order = np.lexsort((rank[len(left_keys):], right_keys))
+    first = np.searchsorted(right_keys[right_order], left_keys, 'left')
+    n_matches = np.searchsorted(right_keys[right_order], left_keys,
+                                'right') - first
+    left_order = np.lexsort((rank[:len(left_keys)], left_keys))
+    n_rows = np.maximum(n_matches[left_order], 1)
+    left_rows = np.repeat(left_order, n_rows)
+    position = (np.arange(len(left_rows)) -
+                np.repeat(np.cumsum(n_rows)-n_rows, n_rows))
+    matched = np.repeat(n_matches[left_order], n_rows) > 0
+    right_rows = np.full(len(left_rows), -1)
+    right_rows[matched] = right_order[
+        np.repeat(first[left_order], n_rows)[matched] + position[matched]]
+
+    right_names = [name for name in right.colnames if name != key]
+    common = set(left.colnames) & set(right_names)
+
+    joined = Table(meta=merge_meta(left.meta, right.meta,
+                                   metadata_conflicts='silent'))
+    for name in left.colnames:
+        column = left[name][left_rows]
+        if name in common:
+            column.name = name + '_' + table_names[0]
+        joined.add_column(column)
+    gather = np.where(matched, right_rows, 0)
+    for name in right_names:
+        column = right[name]
+        data = np.ma.getdata(column)[gather] if len(column) > 0 else \
+            np.zeros(len(gather), dtype=column.dtype)
+        mask = np.ma.getmaskarray(column)[gather] if len(column) > 0 \
+            else np.ones(len(gather), dtype=bool)
+        mask = mask | ~matched
+        cls = MaskedColumn if np.any(~matched) or isinstance(
+            column, MaskedColumn) else Column
+        kwargs = {'mask': mask} if cls is MaskedColumn else {}
+        joined.add_column(cls(
+            data, name=(name + '_' + table_names[1] if name in common
+                        else name),
+            unit=column.unit, format=column.format,
+            description=column.description, meta=column.meta, **kwargs))
+
+    return joined
+
+
+# filter transformations
+
+def _chonis_gaskell_selection(data):
+    """select sources that meet the requirements by Chonis & Gaskell
+    2008 and reject outliers (>3 sigma) from a linear fit in the
+    r-i/g-r color-color plane"""
+    g, r, i = [np.ma.getdata(data[key]).astype(float)
+               for key in ['gmag', 'rmag', 'imag']]
+    keep = ((r-i > 0.08) & (r-i < 0.5) & (g-r > 0.2) & (g-r < 1.4) &
+            (g >= 14.5) & (g < 19.5) & (r >= 14.5) & (r < 19.5) &
+            (i >= 14.5) & (i < 19.5))
+    if keep.sum() <= 2:
+        return keep
+
+    # derive a linear best fit and remove outliers (>3 sigma) based
+    # on their perpendicular distances from the fitted line
+    ri, gr = (r-i)[keep], (g-r)[keep]
+    param = optimization.curve_fit(lambda x, a, b: a*x + b,
+                                   ri, gr, [1, 0])[0]
+    dist = (gr - (param[0]*ri + param[1]))/np.sqrt(1 + param[0]**2)
+    keep[np.where(keep)[0][np.abs(dist) > 3.*np.std(dist)]] = False
+    return keep
+
+
+def _color(data, keys):
+    """color index from two magnitude fields"""
+    return (np.ma.getdata(data[keys[0]]).astype(float) -
+            np.ma.getdata(data[keys[1]]).astype(float))
+
+
+# Each transformation converts one catalog (identified by substrings
+# of its name and its magnitude system) into a set of bands in a
+# single pass. Transformed magnitudes are
+#
+#   mag + sign * (c0 + c1*color + c2*color**2 + ...)
+#
+# with uncertainties
+#
+#   sqrt(sum((w*e_mag)**2) + (color*color_sigma)**2 + sum(sigma**2))
+#
+# `segments` provide piecewise coefficients for color ranges
+# (exclusive limits); sources outside all segments are rejected.
+# Sources are selected through the transformation's `select`
+# function and the `valid` function of the requested band; selection
+# is skipped if use_all_stars is set. Sources without finite
+# magnitudes in the `finite` band are always rejected.
+
+filter_transformations = [
+    # SDSS to BVRI, Chonis & Gaskell 2008, AJ, 135
+    {'catalogs': ['SDSS'], 'magsystem': None,
+     'select': _chonis_gaskell_selection,
+     'bands': {
+         'B': {'mag': 'gmag', 'color': ('gmag', 'rmag'),
+               'coeffs': (0.216, 0.327),
+               'errors': (('e_gmag', 1+0.327), ('e_rmag', 0.327)),
+               'color_sigma': 0.047, 'sigma': (0.027,)},
+         'V': {'mag': 'gmag', 'color': ('gmag', 'rmag'),
+               'coeffs': (-0.011, -0.587),
+               'errors': (('e_gmag', 1+0.587), ('e_rmag', 0.587)),
+               'color_sigma': 0.022, 'sigma': (0.011,)},
+         'R': {'mag': 'rmag', 'color': ('rmag', 'imag'),
+               'coeffs': (-0.159, -0.272),
+               'errors': (('e_rmag', 1-0.272), ('e_imag', 0.272)),
+               'color_sigma': 0.092, 'sigma': (0.022,)},
+         'I': {'mag': 'imag', 'color': ('rmag', 'imag'),
+               'coeffs': (-0.370, -0.337),
+               'errors': (('e_imag', 1+0.337), ('e_rmag', 0.337)),
+               'color_sigma': 0.191, 'sigma': (0.041,)}},
+     'unit': None, 'history': '{band} (Vega)',
+     'new_magsystem': 'AB (ugriz), Vega ({band})'},
+
+    # APASS/URAT to RI, Chonis & Gaskell 2008, AJ, 135
+    {'catalogs': ['URAT', 'APASS'], 'magsystem': 'Vega',
+     'bands': {
+         'R': {'mag': 'rmag', 'color': ('rmag', 'imag'),
+               'coeffs': (-0.159, -0.272),
+               'errors': (('e_rmag', 1-0.272), ('e_imag', 0.272)),
+               'color_sigma': 0.092, 'sigma': (0.022,),
+               'valid': lambda d: ((_color(d, ('rmag', 'imag')) > 0.08) &
+                                   (_color(d, ('rmag', 'imag')) < 0.5))},
+         'I': {'mag': 'imag', 'color': ('rmag', 'imag'),
+               'coeffs': (-0.370, -0.337),
+               'errors': (('e_imag', 1+0.337), ('e_rmag', 0.337)),
+               'color_sigma': 0.191, 'sigma': (0.041,),
+               'valid': lambda d: ((_color(d, ('rmag', 'imag')) > 0.08) &
+                                   (_color(d, ('rmag', 'imag')) < 0.5))}},
+     'unit': None, 'history': '{band} (Vega)', 'new_magsystem': 'Vega'},
+
+    # 2MASS to UKIRT YZJHK, Hodgkin et al. 2009, MNRAS; faint stars
+    # are rejected based on their Figure 6
+    {'catalogs': ['2MASS'], 'magsystem': 'Vega',
+     'select': lambda d: ((_color(d, ('Jmag', 'Hmag')) >= -0.1) &
+                          (_color(d, ('Jmag', 'Hmag')) <= 1.0) &
+                          (np.ma.getdata(d['Jmag']) <= 18) &
+                          (np.ma.getdata(d['Hmag']) <= 17)),
+     'bands': {
+         # 0.064 (sig: 0.035) is a systematic offset between UKIRT_Z
+         # and SDSS_Z
+         'Z': {'mag': 'Jmag', 'color': ('Jmag', 'Hmag'),
+               'coeffs': (0.064, 0.95), 'errors': (('e_Jmag', 1),),
+               'sigma': (0.035,)},
+         'Y': {'mag': 'Jmag', 'color': ('Jmag', 'Hmag'),
+               'coeffs': (0.08, 0.5), 'errors': (('e_Jmag', 1),)},
+         'H': {'mag': 'Hmag', 'color': ('Jmag', 'Ksmag'),
+               'coeffs': (-0.03, 0.07), 'errors': (('e_Hmag', 1),)},
+         'J': {'mag': 'Jmag', 'color': ('Jmag', 'Hmag'),
+               'coeffs': (0, -0.065), 'errors': (('e_Jmag', 1),)},
+         'K': {'mag': 'Ksmag', 'color': ('Jmag', 'Ksmag'),
+               'coeffs': (0, 0.01), 'errors': (('e_Ksmag', 1),)}},
+     'finite': 'Z', 'unit': None, 'history': 'UKIRT YZJHK (Vega)',
+     'new_magsystem': 'Vega'},
+
+    # PANSTARRS to BVRI, Tonry et al. 2012, ApJ 750
+    {'catalogs': ['PANSTARRS'], 'magsystem': None,
+     'bands': {
+         'B': {'mag': 'gp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (0.212, 0.556, 0.034),
+               'errors': (('e_gp1mag', 1),), 'sigma': (0.032,)},
+         'V': {'mag': 'gp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (0.005, -0.536, 0.011),
+               'errors': (('e_gp1mag', 1),), 'sigma': (0.012,)},
+         'R': {'mag': 'rp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (-0.137, -0.108, -0.029),
+               'errors': (('e_rp1mag', 1),), 'sigma': (0.015,)},
+         'I': {'mag': 'ip1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (-0.366, -0.136, -0.018),
+               'errors': (('e_ip1mag', 1),), 'sigma': (0.017,)}},
+     'unit': u.mag, 'history': '{band} (Vega)', 'new_magsystem': 'Vega'},
+
+    # PANSTARRS to Sloan griz, Tonry et al. 2012, ApJ 750
+    {'catalogs': ['PANSTARRS'], 'magsystem': None,
+     'bands': {
+         'g': {'mag': 'gp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (0.013, 0.145, 0.019),
+               'errors': (('e_gp1mag', 1),), 'sigma': (0.008,)},
+         'r': {'mag': 'rp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (-0.001, 0.004, 0.007),
+               'errors': (('e_rp1mag', 1),), 'sigma': (0.004,)},
+         'i': {'mag': 'ip1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (-0.005, 0.011, 0.010),
+               'errors': (('e_ip1mag', 1),), 'sigma': (0.004,)},
+         'z': {'mag': 'zp1mag', 'color': ('gp1mag', 'rp1mag'),
+               'coeffs': (0.013, -0.039, -0.012),
+               'errors': (('e_zp1mag', 1),), 'sigma': (0.01,)}},
+     'unit': u.mag, 'history': '{band} (AB)', 'new_magsystem': 'AB'},
+
+    # SkyMapper to Sloan griz, linear transformations derived from data
+    # in Wolf et al. 2018, PASA 35; uncertainties from linear fit
+    {'catalogs': ['SkyMapper'], 'magsystem': None,
+     'bands': {
+         'g': {'mag': 'gsmmag', 'color': ('gsmmag', 'ismmag'), 'sign': -1,
+               'errors': (('e_gsmmag', 1),),
+               'segments': ((-np.inf, 1.5, (-0.0598, -0.2366),
+                             (0.0045, 0.0036)),
+                            (1.5, np.inf, (-0.5700, 0.1085),
+                             (0.0148, 0.0399)))},
+         'r': {'mag': 'rsmmag', 'color': ('gsmmag', 'ismmag'), 'sign': -1,
+               'errors': (('e_rsmmag', 1),),
+               'segments': ((-np.inf, 1.5, (0.0011, 0.0318),
+                             (0.0009, 0.0007)),
+                            (1.5, np.inf, (0.1127, -0.0472),
+                             (0.0062, 0.0168)))},
+         'i': {'mag': 'ismmag', 'color': ('gsmmag', 'ismmag'), 'sign': -1,
+               'errors': (('e_ismmag', 1),),
+               'segments': ((-np.inf, 1.1, (0.0137, -0.0389),
+                             (0.0023, 0.0015)),
+                            (1.1, np.inf, (0.0362, -0.0617),
+                             (0.0020, 0.0048)))},
+         'z': {'mag': 'zsmmag', 'color': ('gsmmag', 'ismmag'), 'sign': -1,
+               'errors': (('e_zsmmag', 1),),
+               'segments': ((-np.inf, 2.0, (0.0095, -0.0352),
+                             (0.0017, 0.0018)),
+                            (2.0, np.inf, (0.2115, -0.1209),
+                             (0.0155, 0.0470)))}},
+     'unit': u.mag, 'history': '{band} (AB)', 'new_magsystem': 'AB'},
+
+    # SDSS to UKIRT Z, Hewett et al. 2006, MNRAS (slope is average of
+    # III and V classes)
+    {'catalogs': ['SDSS'], 'magsystem': 'AB',
+     'bands': {
+         'Z_UKIRT': {'mag': 'zmag', 'color': ('imag', 'zmag'),
+                     'coeffs': (-0.01-0.528, 0.06),
+                     'errors': (('e_zmag', 1),)}},
+     'finite': 'Z_UKIRT', 'unit': None, 'history': 'UKIRT Z (Vega)',
+     'new_magsystem': 'AB (ugriz), Z_UKIRT (Vega)'},
+
+    # Gaia DR2+ to Johnson-Cousins VRI, see
+    # http://gea.esac.esa.int/archive/documentation/GDR2/Data_processing/chap_cu5pho/sec_cu5pho_calibr/ssec_cu5pho_PhotTransf.html
+    {'catalogs': ['GAIA'], 'magsystem': None,
+     'select': lambda d: ((_color(d, ('BPmag', 'RPmag')) > -0.5) &
+                          (_color(d, ('BPmag', 'RPmag')) < 2.75)),
+     'bands': {
+         'V': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (-0.0176, -0.00686, -0.1732),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.045858,)},
+         'R': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (-0.003226, 0.3833, -0.1345),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.04840,)},
+         'I': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (0.02085, 0.7419, -0.09531),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.04956,)}},
+     'unit': u.mag, 'history': '{band} (Vega)', 'new_magsystem': 'Vega'},
+
+    # Gaia DR2+ to SDSS, see reference above
+    {'catalogs': ['GAIA'], 'magsystem': None,
+     'bands': {
+         'g': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (0.13518, -0.46245, -0.25171, 0.021349),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.16497,),
+               'valid': lambda d: ((_color(d, ('BPmag', 'RPmag')) > -0.5) &
+                                   (_color(d, ('BPmag', 'RPmag')) < 2.0))},
+         'r': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (-0.12879, 0.24662, -0.027464, -0.049465),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.066739,),
+               'valid': lambda d: ((_color(d, ('BPmag', 'RPmag')) > 0.2) &
+                                   (_color(d, ('BPmag', 'RPmag')) < 2.7))},
+         'i': {'mag': 'Gmag', 'color': ('BPmag', 'RPmag'), 'sign': -1,
+               'coeffs': (-0.29676, 0.64728, -0.10141),
+               'errors': (('e_Gmag', 1),), 'sigma': (0.098957,),
+               'valid': lambda d: ((_color(d, ('BPmag', 'RPmag')) > 0) &
+                                   (_color(d, ('BPmag', 'RPmag')) < 4.5))}},
+     'unit': u.mag, 'history': '{band} (AB)', 'new_magsystem': 'AB'},
+]
+
+
+def find_filter_transformation(catalogname, magsystem, targetfilter):
+    """return the first transformation in filter_transformations that
+    transforms catalog `catalogname` into `targetfilter`; None if there
+    is none"""
+    for transformation in filter_transformations:
+        if (any([name in catalogname
+                 for name in transformation['catalogs']]) and
+            targetfilter in transformation['bands'] and
+            (transformation['magsystem'] is None or
+             transformation['magsystem'] == magsystem)):
+            return transformation
+    return None
+
+
+def apply_band_transformation(data, band):
+    """derive transformed magnitudes and uncertainties for one band
+    declaration (see filter_transformations) from table `data`; the
+    third return value flags sources covered by the color segments"""
+    mag = np.ma.getdata(data[band['mag']]).astype(float)
+    color = _color(data, band['color'])
+    sign = band.get('sign', 1)
+
+    # uncertainties from input magnitudes and the color term
+    variance = np.zeros(len(mag))
+    for key, weight in band.get('errors', ()):
+        variance += (weight*np.ma.getdata(data[key]).astype(float))**2
+    if band.get('color_sigma', 0):
+        variance += (color*band['color_sigma'])**2
+
+    if 'segments' not in band:
+        covered = np.ones(len(mag), dtype=bool)
+        offset = np.polynomial.polynomial.polyval(color, band['coeffs'])
+        variance += np.sum(np.square(band.get('sigma', ())))
+    else:
+        covered = np.zeros(len(mag), dtype=bool)
+        offset = np.zeros(len(mag))
+        for lower, upper, coeffs, sigma in band['segments']:
+            segment = (color > lower) & (color < upper)
+            offset[segment] = np.polynomial.polynomial.polyval(
+                color[segment], coeffs)
+            variance[segment] += np.sum(np.square(sigma))
+            covered |= segment
+
+    return mag + sign*offset, np.sqrt(variance), covered
+
+
+def _sql_type(column):
+    """SQLite column type for array `column`"""
+    if column.dtype.kind == 'f':
+        return 'REAL'
+    if column.dtype.kind in 'iub':
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def _sql_write_table(db, tablename, names, columns):
+    """create table `tablename` with fields `names` using cursor `db`
+    and insert all rows of `columns` (list of arrays) in a single
+    executemany call; masked and NaN values are stored as NULL"""
+    columns = [np.ma.asanyarray(column) for column in columns]
+    db.execute('CREATE TABLE {:s} ({:s})'.format(
+        tablename, ', '.join(['"{:s}" {:s}'.format(name, _sql_type(column))
+                              for name, column in zip(names, columns)])))
+    values = []
+    for column in columns:
+        if np.ma.is_masked(column):
+            values.append([None if masked else value for value, masked in
+                           zip(np.ma.getdata(column).tolist(),
+                               np.ma.getmaskarray(column))])
+        else:
+            values.append(np.ma.getdata(column).tolist())
+    db.executemany('INSERT INTO {:s} VALUES ({:s})'.format(
+        tablename, ', '.join(['?']*len(values))), zip(*values))
+
+
+def _sql_read_table(db, tablename):
+    """read table `tablename` using cursor `db` into an astropy Table;
+    columns are converted to numpy arrays based on their declared
+    types, NULL values in REAL columns become NaN"""
+    types = [(row[1], row[2].upper())
+             for row in db.execute('PRAGMA table_info({:s})'.format(
+                 tablename))]
+    rows = db.execute('SELECT * FROM {:s}'.format(tablename)).fetchall()
+    rows = np.array(rows, dtype=object).reshape(len(rows), len(types))
+
+    columns = []
+    for idx, (name, sqltype) in enumerate(types):
+        values = rows[:, idx]
+        null = sqltype != 'REAL' and np.any(np.equal(values, None))
+        if sqltype == 'REAL' or (sqltype == 'INTEGER' and null):
+            columns.append(np.array(values, dtype=float))
+        elif sqltype == 'INTEGER':
+            columns.append(np.array(values, dtype=np.int64))
+        elif null:
+            columns.append(values)
+        else:
+            columns.append(np.array(values.tolist()))
+    return Table(columns, names=[name for name, sqltype in types],
+                 copy=False)
+
+
+# photometry database file extensions for each format
+# (see Conf.database_format)
+database_extensions = {'sqlite': '.db', 'fits': '.fdb'}
+
+
 class catalog(object):
     def __init__(self, catalogname, display=False):
         self.data = None  # will be an astropy table
@@ -85,22 +694,42 @@ class catalog(object):
 
     # data access functions
 
+    @property
+    def data(self):
+        """
+        return: astropy table holding the catalog data; pending source
+                rejections are applied first (see commit)
+        """
+        self.commit()
+        return self._data
+
+    @data.setter
+    def data(self, table):
+        self._data = table
+        self._keep = None  # rows that survive pending rejections
+        self.rejection_counts = []  # sources rejected by each call
+        self._sky_indices = {}  # cached SkyIndex objects (see sky_index)
+
     @property
     def shape(self):
         """
         return: tuple of number of sources and fields
         """
+        if self._keep is not None:
+            n_sources = int(np.sum(self._keep))
+        else:
+            n_sources = len(self._data)
         try:
-            return (len(self.data), len(self.fields))
+            return (n_sources, len(self.fields))
         except AttributeError:
-            return (len(self.data), len(self.data.columns))
+            return (n_sources, len(self._data.columns))
 
     @property
     def fields(self):
         """
         return: array of all available fields
         """
-        return self.data.columns
+        return self._data.columns
 
     def __getitem__(self, ident):
         """
@@ -110,41 +739,81 @@ class catalog(object):
 
     # data manipulation functions
 
-    def reject_sources_other_than(self, condition):
+    def commit(self):
         """
-        reject sources based on condition
-        input: condition
+        apply pending source rejections in a single compaction of the
+        data table
         return: number of sources left
         """
+        if self._keep is not None:
+            self._data = self._data[self._keep]
+            self._keep = None
+        return len(self._data) if self._data is not None else 0
+
+    def _reject(self, condition, reject_if):
+        """
+        add a source rejection to the pending rejections; sources for
+        which `condition` equals `reject_if` are rejected
+        input: boolean array or callable that derives a boolean array
+               from the data table (including sources that are
+               already pending rejection)
+        return: number of rejected sources
+        """
 
-        n_raw = self.shape[0]
+        if callable(condition):
+            condition = condition(self._data)
+        elif (self._keep is not None and
+              len(condition) != len(self._data)):
+            # condition refers to the compacted table
+            self.commit()
+        condition = np.asarray(condition, dtype=bool)
 
-        self.data = self.data[condition]
+        if reject_if:
+            reject = condition
+        else:
+            reject = ~condition
+        if self._keep is None:
+            self._keep = ~reject
+            n_rejected = int(np.sum(reject))
+        else:
+            n_rejected = int(np.sum(self._keep & reject))
+            self._keep &= ~reject
+        if n_rejected > 0:
+            self._drop_sky_indices()
 
+        self.rejection_counts.append(n_rejected)
         logging.info('{:s}:reject {:d} sources'.format(self.catalogname,
-                                                       n_raw-self.shape[0]))
+                                                       n_rejected))
 
-        return len(self.data)
+        return n_rejected
 
-    def reject_sources_with(self, condition):
+    def reject_sources_other_than(self, condition):
         """
-        reject sources based on condition
-        input: condition
+        reject sources based on condition; rejections are applied when
+        the data are accessed next or through commit
+        input: condition (boolean array or callable, see _reject)
         return: number of sources left
         """
 
-        n_raw = self.shape[0]
-        self.data = self.data[~condition]
+        self._reject(condition, reject_if=False)
 
-        logging.info('{:s}:reject {:d} sources'.format(self.catalogname,
-                                                       n_raw-self.shape[0]))
+        return self.shape[0]
 
-        return n_raw - len(self.data)
+    def reject_sources_with(self, condition):
+        """
+        reject sources based on condition; rejections are applied when
+        the data are accessed next or through commit
+        input: condition (boolean array or callable, see _reject)
+        return: number of rejected sources
+        """
+
+        return self._reject(condition, reject_if=True)
 
     def add_field(self, field_name, field_array, field_type=None):
         """
         single-field wrapper for add_fields
         """
+        self._drop_sky_indices([field_name])
         if field_type is not None:
             return self.data.add_column(Column(field_array, name=field_name,
                                                format=field_type))
@@ -162,6 +831,7 @@ class catalog(object):
 
         if self.data is None:
             self.data = Table()
+        self._drop_sky_indices(field_names)
 
         for i in range(len(field_names)):
             if field_types is None:
@@ -178,11 +848,73 @@ class catalog(object):
 
     # online catalog access
 
+    def _query_vizier(self, vquery, field, rad_deg, catalog, radec):
+        """
+        cone query of Vizier `catalog` using the columns, column filters,
+        and row limit of Vizier object `vquery`; the query is served
+        from the catalog cache (see ConfCatalog in pp_setup.py), if
+        possible
+        input: Vizier object, field center SkyCoord, radius (deg),
+               Vizier catalog identifier, names of coordinate columns
+        return: astropy table; None if no data are available
+        """
+
+        def fetch_cone(ra_deg, dec_deg, rad_deg, row_limit):
+            """query Vizier"""
+            fetcher = Vizier(columns=vquery.columns,
+                             column_filters=vquery.column_filters,
+                             row_limit=row_limit,
+                             timeout=vquery.TIMEOUT)
+            try:
+                return fetcher.query_region(
+                    coord.SkyCoord(ra=ra_deg, dec=dec_deg,
+                                   unit=(u.deg, u.deg), frame='icrs'),
+                    radius=rad_deg*u.deg, catalog=catalog,
+                    cache=False)[0]
+            except IndexError:
+                return None
+
+        def fetch(ra_deg, dec_deg, rad_deg, row_limit=vquery.ROW_LIMIT):
+            """query Vizier; large cones are sharded"""
+            if rad_deg <= confcatalog.catalog_shard_threshold:
+                return fetch_with_retry(fetch_cone, ra_deg, dec_deg,
+                                        rad_deg, row_limit)
+            ident = None
+            if vquery.columns and vquery.columns[0] not in ['all', '*',
+                                                            '**']:
+                ident = vquery.columns[0]
+            return fetch_sharded(fetch_cone, ra_deg, dec_deg, rad_deg,
+                                 radec, ident=ident, row_limit=row_limit)
+
+        cache = None
+        if confcatalog.catalog_cache:
+            try:
+                cache = CatalogCache(confcatalog.catalog_cache_dir,
+                                     confcatalog.catalog_cache_size,
+                                     order=confcatalog.catalog_cache_order)
+            except (IOError, OSError, sql.Error) as e:
+                logging.warning('catalog cache not available: %s' % str(e))
+
+        if cache is None:
+            if confcatalog.catalog_offline:
+                logging.error('{:s} not available in offline mode'.format(
+                    self.catalogname))
+                return None
+            return fetch(field.ra.deg, field.dec.deg, rad_deg)
+
+        fetch_limit = confcatalog.catalog_cache_fetch_limit
+        return cache.query((catalog, vquery.columns, vquery.column_filters),
+                           field.ra.deg, field.dec.deg, rad_deg, radec,
+                           fetch, row_limit=vquery.ROW_LIMIT,
+                           fetch_limit=fetch_limit,
+                           offline=confcatalog.catalog_offline)
+
     def download_catalog(self, ra_deg, dec_deg, rad_deg,
                          max_sources, save_catalog=False,
                          max_mag=21, use_all_stars=False):
         """
-        download existing catalog from VIZIER server using self.catalogname
+        download existing catalog from VIZIER server using self.catalogname;
+        Vizier queries are served from the catalog cache, if possible
         input: ra_deg, dec_deg, rad_deg, max_sources, (display_progress),
                (sort=['ascending', 'descending', None])
         return: number of sources downloaded
@@ -229,12 +961,10 @@ class catalog(object):
                             row_limit=max_sources,
                             timeout=300)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="II/349/ps1",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "II/349/ps1",
+                                           radec=('RAJ2000', 'DEJ2000'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -275,12 +1005,10 @@ class catalog(object):
                             row_limit=max_sources,
                             timeout=300)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="II/358/smss",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "II/358/smss",
+                                           radec=('RAICRS', 'DEICRS'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -341,12 +1069,10 @@ class catalog(object):
                             row_limit=max_sources,
                             timeout=300)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="I/345/gaia2",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "I/345/gaia2",
+                                           radec=('RA_ICRS', 'DE_ICRS'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -381,12 +1107,10 @@ class catalog(object):
                             row_limit=max_sources,
                             timeout=300)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="I/284/out",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "I/284/out",
+                                           radec=('RAJ2000', 'DEJ2000'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -416,12 +1140,10 @@ class catalog(object):
                             row_limit=max_sources,
                             timeout=300)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="I/337/tgas",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "I/337/tgas",
+                                           radec=('RA_ICRS', 'DE_ICRS'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -456,12 +1178,10 @@ class catalog(object):
                                             ("<{:f}".format(max_mag))},
                             row_limit=max_sources)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="II/246/out",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "II/246/out",
+                                           radec=('RAJ2000', 'DEJ2000'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -523,12 +1243,10 @@ class catalog(object):
                                             ("<{:f}".format(max_mag))},
                             row_limit=max_sources)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="I/329/urat1",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "I/329/urat1",
+                                           radec=('RAJ2000', 'DEJ2000'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -564,12 +1282,10 @@ class catalog(object):
                                             ("<{:f}".format(max_mag))},
                             row_limit=max_sources)
 
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="II/336/apass9",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "II/336/apass9",
+                                           radec=('RAJ2000', 'DEJ2000'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -601,12 +1317,10 @@ class catalog(object):
                                             "mode": "1",
                                             "q_mode": "+"},
                             row_limit=max_sources)
-            try:
-                self.data = vquery.query_region(field,
-                                                radius=rad_deg*u.deg,
-                                                catalog="V/139/sdss9",
-                                                cache=False)[0]
-            except IndexError:
+            self.data = self._query_vizier(vquery, field, rad_deg,
+                                           "V/139/sdss9",
+                                           radec=('RA_ICRS', 'DE_ICRS'))
+            if self.data is None:
                 if self.display:
                     print('no data available from {:s}'.format(
                         self.catalogname))
@@ -737,15 +1451,22 @@ class catalog(object):
 
     def read_ldac(self, filename, fits_filename=None, maxflag=None,
                   time_keyword='MIDTIMJD', exptime_keyword='EXPTIME',
-                  object_keyword='OBJECT', telescope_keyword='TEL_KEYW'):
+                  object_keyword='OBJECT', telescope_keyword='TEL_KEYW',
+                  hdulist=None, columns=None, fits_header=None):
         """
-        read in FITS_LDAC file
-        input: LDAC filename
+        read in FITS_LDAC file; the file is memory-mapped and only
+        sources that pass the FLAGS criterion are read from disk
+        input: LDAC filename, LDAC HDUList (optional; if provided, the
+               file is not read), list of LDAC fields to read (optional;
+               default: all fields), image header (optional; if provided,
+               `fits_filename` is not read)
         return: (number of sources, number of fields)
         """
 
         # load LDAC file
-        hdulist = fits.open(filename, ignore_missing_end=True)
+        if hdulist is None:
+            hdulist = fits.open(filename, ignore_missing_end=True,
+                                memmap=True)
 
         if len(hdulist) < 3:
             print(('ERROR: {:s} seems to be empty; check LOG file if ' +
@@ -756,8 +1477,22 @@ class catalog(object):
                                filename))
             return None
 
-        # load data array
-        self.data = Table(hdulist[2].data)
+        # load data array; reject flagged sources (if requested) on
+        # the mapped data before rows are copied into memory
+        ldac = hdulist[2].data
+        if columns is None:
+            columns = ldac.names
+        columns = [name for name in ldac.names if name in columns]
+        if maxflag is not None:
+            # FLAGS <= 3: allow for blending and nearby sources
+            keep = ldac['FLAGS'] <= maxflag
+            self.data = Table([ldac[name][keep] for name in columns],
+                              names=columns, copy=False)
+            logging.info('{:s}:reject {:d} sources'.format(
+                filename, len(keep)-np.sum(keep)))
+        else:
+            self.data = Table([np.array(ldac[name]) for name in columns],
+                              names=columns, copy=False)
 
         # set other properties
         telescope = ''
@@ -771,18 +1506,14 @@ class catalog(object):
             self.origin = '{:s};'.format(telescope.strip())
         self.magsys = 'instrumental'
 
-        # reject flagged sources (if requested)
-        if maxflag is not None:
-            self.reject_sources_other_than(self.data['FLAGS'] <= maxflag)
-            # FLAGS <= 3: allow for blending and nearby sources
-
         # read data from image header, if requested
-        if fits_filename is not None:
-            fitsheader = fits.open(fits_filename,
-                                   ignore_missing_end=True)[0].header
-            self.obstime[0] = float(fitsheader[time_keyword])
-            self.obstime[1] = float(fitsheader[exptime_keyword])
-            self.obj = fitsheader[object_keyword]
+        if fits_header is None and fits_filename is not None:
+            fits_header = fits.getheader(fits_filename,
+                                         ignore_missing_end=True)
+        if fits_header is not None:
+            self.obstime[0] = float(fits_header[time_keyword])
+            self.obstime[1] = float(fits_header[exptime_keyword])
+            self.obj = fits_header[object_keyword]
 
         # rename columns
         if 'XWIN_WORLD' in self.fields:
@@ -791,8 +1522,9 @@ class catalog(object):
             self.data.rename_column('YWIN_WORLD', 'dec_deg')
 
         # force positive RA values
-        flip_idc = np.where(self.data['ra_deg'] < 0)[0]
-        self.data['ra_deg'][flip_idc] += 360
+        if 'ra_deg' in self.fields:
+            flip_idc = np.where(self.data['ra_deg'] < 0)[0]
+            self.data['ra_deg'][flip_idc] += 360
 
         logging.info(('read {:d} sources in {:d} columns '
                       'from LDAC file {:s}').format(
@@ -906,47 +1638,37 @@ class catalog(object):
         # open database file (delete existing ones)
         os.remove(filename) if os.path.exists(filename) else None
         db_conn = sql.connect(filename)
+        # the file is written from scratch in a single transaction;
+        # a rollback journal is not required
+        db_conn.execute('PRAGMA journal_mode = OFF')
+        db_conn.execute('PRAGMA synchronous = OFF')
         db = db_conn.cursor()
 
-        from copy import deepcopy
-        write_table = deepcopy(self.data)
-
-        # rename Johnson filternames to avoid collisions with SDSS
-        for filtername in ['B', 'V', 'R', 'I']:
-            if '_'+filtername+'mag' in list(write_table.columns):
-                write_table.rename_column(
-                    '_{:s}mag'.format(filtername),
-                    '_{:s}Johnsonmag'.format(filtername))
-                write_table.rename_column(
-                    '_e_{:s}mag'.format(filtername),
-                    '_e_{:s}Johnsonmag'.format(filtername))
-            elif filtername+'mag' in list(write_table.columns):
-                write_table.rename_column(
-                    '{:s}mag'.format(filtername),
-                    '{:s}Johnsonmag'.format(filtername))
-                write_table.rename_column(
-                    'e_{:s}mag'.format(filtername),
-                    'e_{:s}Johnsonmag'.format(filtername))
-
         # create header and write to database
-        header = Table([[self.catalogname], [self.origin], [self.history],
-                        [self.magsys], [self.obstime[0]], [self.obstime[1]],
-                        [self.obj], [self.filtername]],
-                       names=['name', 'origin', 'description',
-                              'magsys', 'obstime', 'exptime', 'obj',
-                              'filtername'])
-        header.to_pandas().to_sql('header', db_conn, index=False)
-
-        # write data to database
-        write_table.to_pandas().to_sql('data', db_conn, index=False)
+        _sql_write_table(db, 'header',
+                         ['name', 'origin', 'description', 'magsys',
+                          'obstime', 'exptime', 'obj', 'filtername'],
+                         [[self.catalogname], [self.origin], [self.history],
+                          [self.magsys], [self.obstime[0]],
+                          [self.obstime[1]], [self.obj], [self.filtername]])
+
+        # write data to database; Johnson filternames are only renamed
+        # in the database schema; positions and calibrated magnitudes
+        # are indexed
+        names = self._johnson_names(self.data.colnames, 'mag',
+                                    'Johnsonmag')
+        _sql_write_table(db, 'data', names,
+                         [self.data[name] for name in self.data.colnames])
+        for name in names:
+            if (name in ['ra_deg', 'dec_deg'] or
+                    (name.endswith('mag') and
+                     not name.startswith(('e_', '_')))):
+                db.execute('CREATE INDEX "idx_{:s}" ON data ("{:s}")'.format(
+                    name, name))
 
         db_conn.commit()
 
-        # return number of objects written to database
-        db.execute(
-            "SELECT COUNT(DISTINCT {:s}) FROM data".format(
-                self.fields[0].name))
-        n_obj = db.fetchall()[0][0]
+        n_obj = self.shape[0]
 
         logging.info(('wrote {:d} sources from catalog {:s} '
                       'to database file {:s}'.format(
@@ -974,7 +1696,7 @@ class catalog(object):
             return []
 
         # reader in header information
-        header = read_sql('SELECT * FROM header', db_conn)
+        header = _sql_read_table(db, 'header')
 
         self.catalogname = header['name'][0]
         self.origin = header['origin'][0]
@@ -986,743 +1708,573 @@ class catalog(object):
         self.filtername = header['filtername'][0]
 
         # read in data table
-        self.data = Table.from_pandas(read_sql('SELECT * FROM data',
-                                               db_conn))
+        self.data = self._johnson_renamed(_sql_read_table(db, 'data'),
+                                          'Johnsonmag', 'mag')
 
-        # rename Johnson filternames
-        for filtername in ['B', 'V', 'R', 'I']:
-            if '_'+filtername+'Johnsonmag' in list(self.data.columns):
-                self.data.rename_column(
-                    '_{:s}Johnsonmag'.format(filtername),
-                    '_{:s}mag'.format(filtername))
-                self.data.rename_column(
-                    '_e_{:s}Johnsonmag'.format(filtername),
-                    '_e_{:s}mag'.format(filtername))
-            elif filtername+'Johnsonmag' in list(self.data.columns):
-                self.data.rename_column(
-                    '{:s}Johnsonmag'.format(filtername),
-                    '{:s}mag'.format(filtername))
-                self.data.rename_column(
-                    'e_{:s}Johnsonmag'.format(filtername),
-                    'e_{:s}mag'.format(filtername))
+        db_conn.close()
 
         return self.shape[0]
 
-    # filter transformations
+    @staticmethod
+    def _johnson_names(names, suffix, new_suffix):
+        """
+        rename Johnson filternames (e.g., 'Rmag' to 'RJohnsonmag') to
+        avoid collisions with SDSS filternames in case-insensitive
+        file formats
+        input: list of field names, current and new suffix of magnitude
+               fields
+        return: list of renamed field names
+        """
+        names = list(names)
+        for filtername in ['B', 'V', 'R', 'I']:
+            for prefix in ['_', '']:
+                if prefix+filtername+suffix in names:
+                    for name in [prefix+filtername,
+                                 prefix+'e_'+filtername]:
+                        names[names.index(name+suffix)] = name+new_suffix
+                    break
+        return names
+
+    @classmethod
+    def _johnson_renamed(cls, table, suffix, new_suffix):
+        """
+        rename Johnson filternames (see _johnson_names)
+        input: astropy Table, current and new suffix of magnitude fields
+        return: Table sharing the data of `table` with renamed columns
+        """
+        names = cls._johnson_names(table.colnames, suffix, new_suffix)
+        if names == table.colnames:
+            return table
+        table = Table(table, copy=False)
+        table.rename_columns(table.colnames, names)
+        return table
 
-    def lin_func(self, x, a, b):
-        return a*x + b
+    # columnar FITS interface
 
-    def transform_filters(self, targetfilter, use_all_stars=False):
+    def write_columnar(self, filename):
         """
-        transform a given catalog into a different filter band; crop the
-        resulting catalog to only those sources that have transformed magnitudes
-        transformed magnitudes start with an asterisk
-        input: targetfilter name
-        return: number of transformed magnitudes
+        write catalog object to columnar FITS file; header information
+        and data are stored in binary table extensions HEADER and DATA
+        input: target filename
+        output: number of sources written to file
         """
 
-        # TBD: modify this function to make use of table functionality
+        write_table = self._johnson_renamed(self.data, 'mag',
+                                            'Johnsonmag')
+
+        # unset properties are stored as empty strings and NaN
+        def text(value): return '' if value is None else str(value)
+        def number(value): return np.nan if value is None else float(value)
+        header = Table([[text(self.catalogname)], [text(self.origin)],
+                        [text(self.history)], [text(self.magsys)],
+                        [number(self.obstime[0])],
+                        [number(self.obstime[1])],
+                        [text(self.obj)], [text(self.filtername)]],
+                       names=['name', 'origin', 'description',
+                              'magsys', 'obstime', 'exptime', 'obj',
+                              'filtername'])
 
-        if len(self.data) == 0:
-            return 0
+        headerhdu = fits.table_to_hdu(header)
+        headerhdu.header['EXTNAME'] = 'HEADER'
+        datahdu = fits.table_to_hdu(write_table)
+        datahdu.header['EXTNAME'] = 'DATA'
 
-        # check if this specific transformation has already been done
-        if '_'+targetfilter+'mag' in self.fields:
-            logging.info(targetfilter + ' already available')
-            return self.shape[0]
+        hdulist = fits.HDUList([fits.PrimaryHDU(), headerhdu, datahdu])
+        hdulist.writeto(filename, overwrite=True)
 
-        # SDSS to BVRI
-        # transformations based on Chonis & Gaskell 2008, AJ, 135
-        if ((('SDSS' in self.catalogname) and
-                (targetfilter in {'B', 'V', 'R', 'I'}))):
+        logging.info(('wrote {:d} sources from catalog {:s} '
+                      'to columnar file {:s}'.format(
+                          self.shape[0],
+                          " | ".join([self.catalogname,
+                                      self.origin,
+                                      self.history]),
+                          filename)))
 
-            logging.info(('trying to transform {:d} SDSS sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
+        return self.shape[0]
 
-            mags = np.array([self['gmag'].data, self['rmag'].data,
-                             self['imag'].data,
-                             self['e_gmag'].data,
-                             self['e_rmag'].data,
-                             self['e_imag'].data,
-                             self['umag'].data,
-                             self['e_umag'].data])
+    def read_columnar(self, filename):
+        """
+        read in columnar FITS file (see write_columnar) into catalog;
+        columns are memory-mapped and only read from disk when accessed
+        """
 
-            # sort out sources that do not meet the C&G requirements
-            if not use_all_stars:
-                keep_idc = ((mags[1]-mags[2] > 0.08) & (mags[1]-mags[2] < 0.5) &
-                            (mags[0]-mags[1] > 0.2) & (mags[0]-mags[1] < 1.4) &
-                            (mags[0] >= 14.5) & (mags[0] < 19.5) &
-                            (mags[1] >= 14.5) & (mags[1] < 19.5) &
-                            (mags[2] >= 14.5) & (mags[2] < 19.5))
-                filtered_mags = np.array([mags[i][keep_idc]
-                                          for i in range(len(mags))])
-            else:
-                filtered_mags = mags
-
-            # ... derive a linear best fit and remove outliers (>3 sigma)
-            ri = np.array(filtered_mags[1]) - np.array(filtered_mags[2])
-            gr = np.array(filtered_mags[0]) - np.array(filtered_mags[1])
-            if len(ri) == 0 or len(gr) == 0:
-                logging.warning(('no suitable stars for transformation '
-                                 'to {:s}').format(targetfilter))
-                return 0
+        hdulist = fits.open(filename, memmap=True)
 
-            param = optimization.curve_fit(self.lin_func, ri, gr, [1, 0])[0]
-            resid = np.sqrt(((ri+param[0]*gr-param[0]*param[1]) /
-                             (param[0]**2+1))**2 +
-                            (param[0]*(ri+param[0]*gr-param[0]*param[1]) /
-                             (param[0]**2+1)+param[1]-gr)**2)
-            remove = np.where(np.array(resid) > 3.*np.std(resid))[0]
-
-            keep = [idx for idx in np.arange(len(keep_idc))[keep_idc]
-                    if idx not in set(remove)]
-
-            # transformed magnitudes; uncertainties through Gaussian and C&G2008
-            nmags = np.array([np.empty(len(mags[0])),
-                              np.empty(len(mags[0]))])
-            if targetfilter == 'U':
-                nmags[0] = mags[6] - 0.854
-                nmags[1] = np.sqrt(mags[7]**2 + 0.007**2)
-            elif targetfilter == 'B':
-                nmags[0] = mags[0] + 0.327*(mags[0] - mags[1]) + 0.216
-                nmags[1] = np.sqrt(((1+0.327)*mags[3])**2
-                                   + (0.327*mags[4])**2
-                                   + ((mags[0]-mags[1])*0.047)**2
-                                   + 0.027**2)
-            elif targetfilter == 'V':
-                nmags[0] = mags[0] - 0.587*(mags[0] - mags[1]) - 0.011
-                nmags[1] = np.sqrt(((1+0.587)*mags[3])**2
-                                   + (0.587*mags[4])**2
-                                   + ((mags[0]-mags[1])*0.022)**2
-                                   + 0.011**2)
-            elif targetfilter == 'R':
-                nmags[0] = mags[1] - 0.272*(mags[1] - mags[2]) - 0.159
-                nmags[1] = np.sqrt(((1-0.272)*mags[4])**2
-                                   + (0.272*mags[5])**2
-                                   + ((mags[1]-mags[2])*0.092)**2
-                                   + 0.022**2)
-            elif targetfilter == 'I':
-                nmags[0] = mags[2] - 0.337*(mags[1] - mags[2]) - 0.370
-                nmags[1] = np.sqrt(((1+0.337)*mags[5])**2
-                                   + (0.337*mags[4])**2
-                                   + ((mags[1]-mags[2])*0.191)**2
-                                   + 0.041**2)
-
-            # add new filter and according uncertainty to catalog
-            self.add_field('_'+targetfilter+'mag', nmags[0])
-            self.add_field('_e_'+targetfilter+'mag', nmags[1])
-
-            # get rid of sources that have not been transformed
-            self.data = self.data[keep]
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (Vega)'.format(
-                                self.shape[0], targetfilter)
-                self.magsystem = 'AB (ugriz), Vega ({:s})'.format(
-                    targetfilter)
-
-            logging.info(('{:d} sources sucessfully '
-                          'transformed to {:s}').format(self.shape[0],
-                                                        targetfilter))
+        header = hdulist['HEADER'].data[0]
+        self.catalogname = str(header['name'])
+        self.origin = str(header['origin'])
+        self.history = str(header['description'])
+        self.magsys = str(header['magsys'])
+        self.obstime = [None if np.isnan(header[key]) else
+                        float(header[key]) for key in ['obstime', 'exptime']]
+        self.obj = str(header['obj']) or None
+        self.filtername = str(header['filtername']) or None
 
-            return self.shape[0]
+        # the table shares the memory-mapped buffer of the extension;
+        # integer null values (TNULL) are masked, NaN floats are kept
+        # as such (like NULL values read from SQLite databases)
+        data = Table.read(hdulist['DATA'], mask_invalid=False)
+        self.data = self._johnson_renamed(data, 'Johnsonmag', 'mag')
 
-        # APASS to R/I
-        # todo: include g magnitudes and account for color
-        elif ('URAT' in self.catalogname or
-              'APASS' in self.catalogname and
-              (targetfilter == 'R' or targetfilter == 'I')
-              and self.magsystem == 'Vega'):
-
-            logging.info(('trying to transform {:d} {:s} sources '
-                          'to {:s}'.format(self.shape[0],
-                                           self.catalogname,
-                                           targetfilter)))
-
-            # transformations based on Chonis & Gaskell 2008, AJ, 135
-            mags = np.array([self['rmag'].data,
-                             self['imag'].data,
-                             self['e_rmag'].data,
-                             self['e_imag'].data])
-
-            # sort out sources that do not meet the C&G requirements
-            if not use_all_stars:
-                keep_idc = (mags[0]-mags[1] > 0.08) & (mags[0]-mags[1] < 0.5)
-            else:
-                keep_idc = [True]*len(mags[0])
-
-            # transformed magnitudes; uncertainties through Gaussian and C&G2008
-            nmags = np.array([np.empty(len(mags[0])),
-                              np.empty(len(mags[0]))])
-
-            if targetfilter == 'R':
-                nmags[0] = mags[0] - 0.272*(mags[0] - mags[1]) - 0.159
-                nmags[1] = np.sqrt(((1-0.272)*mags[2])**2
-                                   + (0.272*mags[3])**2
-                                   + ((mags[0]-mags[1])*0.092)**2
-                                   + 0.022**2)
-            elif targetfilter == 'I':
-                nmags[0] = mags[1] - 0.337*(mags[0] - mags[1]) - 0.370
-                nmags[1] = np.sqrt(((1+0.337)*mags[3])**2
-                                   + (0.337*mags[2])**2
-                                   + ((mags[0]-mags[1])*0.191)**2
-                                   + 0.041**2)
-
-            # add new filter and according uncertainty to catalog
-            self.add_field('_'+targetfilter+'mag', nmags[0])
-            self.add_field('_e_'+targetfilter+'mag', nmags[1])
-
-            # get rid of sources that have not been transformed
-            self.data = self.data[keep_idc]
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (Vega)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'Vega'
-
-            logging.info(('{:d} sources sucessfully transformed '
-                          'to {:s}').format(self.shape[0], targetfilter))
+        hdulist.close()
 
-            return self.shape[0]
+        return self.shape[0]
 
-        # 2MASS to UKIRT YZJHK)
-        elif (self.catalogname.find('2MASS') > -1) and \
-            (targetfilter in {'Y', 'Z', 'J',
-                              'H', 'K'}) and \
-                (self.magsystem == 'Vega'):
-
-            logging.info(('trying to transform {:d} 2MASS sources to '
-                          + 'UKIRT YZJHK').format(self.shape[0]))
-
-            # transformations using the recipe by Hodgkin et al. 2009, MNRAS
-            mags = [self['Jmag'].data, self['Hmag'].data,
-                    self['Ksmag'].data, self['e_Jmag'].data,
-                    self['e_Hmag'].data, self['e_Ksmag'].data]
-            lbl = {'_Ymag': 0, '_e_Ymag': 1, '_Zmag': 2, '_e_Zmag': 3,
-                   '_Jmag': 4, '_e_Jmag': 5, '_Hmag': 6, '_e_Hmag': 7,
-                   '_Kmag': 8, '_e_Kmag': 9}
-            nmags = [np.zeros(self.shape[0]) for i in range(len(lbl))]
-
-            for idx in range(self.shape[0]):
-                keep = True
-                # remove objects with extreme J-Ks color index
-                cidx = mags[0][idx]-mags[1][idx]
-                if cidx < -0.1 or cidx > 1.0:
-                    keep = False
-                # reject faint stars based on Figure 6 by Hodgkin et
-                # al. 2009, MNRAS
-                if mags[0][idx] > 18 or mags[1][idx] > 17:
-                    keep = False
-
-                if use_all_stars:
-                    keep = True
-
-                if keep:
-                    # 0.064 (sig: 0.035) is a systematic offset
-                    # between UKIRT_Z and SDSS_Z
-                    nmags[lbl['_Zmag']][idx] = mags[0][idx] \
-                        + 0.95*(mags[0][idx]
-                                - mags[1][idx]) + 0.064
-                    nmags[lbl['_e_Zmag']][idx] = np.sqrt(mags[3][idx]**2
-                                                         + 0.035**2)
-
-                    nmags[lbl['_Ymag']][idx] = mags[0][idx] \
-                        + 0.5*(mags[0][idx]
-                               - mags[1][idx]) + 0.08
-                    nmags[lbl['_e_Ymag']][idx] = mags[3][idx]
-
-                    oldH = mags[1][idx]
-                    nmags[lbl['_Hmag']][idx] = mags[1][idx] \
-                        + 0.07*(mags[0][idx] -
-                                mags[2][idx]) - 0.03
-                    nmags[lbl['_e_Hmag']][idx] = mags[4][idx]
-
-                    nmags[lbl['_Jmag']][idx] = mags[0][idx] \
-                        - 0.065*(mags[0][idx] - oldH)
-                    nmags[lbl['_e_Jmag']][idx] = mags[3][idx]
-
-                    nmags[lbl['_Kmag']][idx] = mags[2][idx] \
-                        + 0.01*(mags[0][idx]
-                                - mags[2][idx])
-                    nmags[lbl['_e_Kmag']][idx] = mags[5][idx]
-
-                else:
-                    for mag in list(lbl.keys()):
-                        nmags[lbl[mag]][idx] = 99
-
-            # append nmags arrays to catalog
-            for key, idx in list(lbl.items()):
-                self.add_field(key, nmags[idx])
-
-            # get rid of sources that have not been transformed
-            self.data = self.data[self['_Zmag'] < 99]
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += (', {:d} transformed to UKIRT YZJHK '
-                                 '(Vega)').format(self.shape[0])
-                self.magsystem = 'Vega'
-
-            logging.info(('{:d} sources sucessfully transformed to '
-                          'UKIRT YZJHK').format(self.shape[0]))
+    def write_photometry(self, filename_root, format='sqlite'):
+        """
+        write catalog object to photometry database file in `format`
+        (see database_extensions)
+        input: target filename without extension, format
+        output: number of sources written to file
+        """
+        filename = filename_root + database_extensions[format]
+        if format == 'fits':
+            return self.write_columnar(filename)
+        return self.write_database(filename)
 
-            return self.shape[0]
+    def read_photometry(self, filename_root, format='sqlite'):
+        """
+        read in photometry database file in `format` (see
+        database_extensions) into catalog
+        input: filename without extension, format
+        """
+        filename = filename_root + database_extensions[format]
+        if format == 'fits':
+            return self.read_columnar(filename)
+        return self.read_database(filename)
 
-        # PANSTARRS to BVRI
-        elif ('PANSTARRS' in self.catalogname and
-              targetfilter in ['B', 'V', 'R', 'I']):
-
-            logging.info(('trying to transform {:d} PANSTARRS sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
-
-            # transform magnitudes to BVRI, Vega system
-            # using Tonry et al. 2012, ApJ 750
-            g = self.data['gp1mag'].data
-            e_g = self.data['e_gp1mag'].data
-            r = self.data['rp1mag'].data
-            e_r = self.data['e_rp1mag'].data
-            i = self.data['ip1mag'].data
-            e_i = self.data['e_ip1mag'].data
-
-            B = (g + 0.212 + 0.556*(g-r) + 0.034*(g-r)**2)
-            Berr = np.sqrt(e_g**2 + 0.032**2)
-            V = (g + 0.005 - 0.536*(g-r) + 0.011*(g-r)**2)
-            Verr = np.sqrt(e_g**2 + 0.012**2)
-            R = (r - 0.137 - 0.108*(g-r) - 0.029*(g-r)**2)
-            Rerr = np.sqrt(e_r**2 + 0.015**2)
-            I = (i - 0.366 - 0.136*(g-r) - 0.018*(g-r)**2)
-            Ierr = np.sqrt(e_i**2 + 0.017**2)
-
-            self.data.add_column(Column(data=B, name='_Bmag', unit=u.mag))
-            self.data.add_column(Column(data=Berr, name='_e_Bmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=V, name='_Vmag', unit=u.mag))
-            self.data.add_column(Column(data=Verr, name='_e_Vmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=R, name='_Rmag', unit=u.mag))
-            self.data.add_column(Column(data=Rerr, name='_e_Rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=I, name='_Imag', unit=u.mag))
-            self.data.add_column(Column(data=Ierr, name='_e_Imag',
-                                        unit=u.mag))
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (Vega)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'Vega'
-
-            logging.info(('{:d} sources sucessfully transformed '
-                          'to {:s}').format(self.shape[0], targetfilter))
+    # filter transformations
 
-            return self.shape[0]
+    def lin_func(self, x, a, b):
+        return a*x + b
 
-        # PANSTARRS to Sloan griz
-        elif ('PANSTARRS' in self.catalogname and
-              targetfilter in ['g', 'r', 'i', 'z']):
-
-            logging.info(('trying to transform {:d} PANSTARRS sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
-
-            # transform magnitudes to SDSS AB system
-            # using Tonry et al. 2012, ApJ 750
-
-            g = self.data['gp1mag'].data
-            e_g = self.data['e_gp1mag'].data
-            r = self.data['rp1mag'].data
-            e_r = self.data['e_rp1mag'].data
-            i = self.data['ip1mag'].data
-            e_i = self.data['e_ip1mag'].data
-            z = self.data['zp1mag'].data
-            e_z = self.data['e_zp1mag'].data
-
-            g_sdss = (g + 0.013 + 0.145*(g-r) + 0.019*(g-r)**2)
-            gerr_sdss = np.sqrt(e_g**2 + 0.008**2)
-            r_sdss = (r - 0.001 + 0.004*(g-r) + 0.007*(g-r)**2)
-            rerr_sdss = np.sqrt(e_r**2 + 0.004**2)
-            i_sdss = (i - 0.005 + 0.011*(g-r) + 0.010*(g-r)**2)
-            ierr_sdss = np.sqrt(e_i**2 + 0.004**2)
-            z_sdss = (z + 0.013 - 0.039*(g-r) - 0.012*(g-r)**2)
-            zerr_sdss = np.sqrt(e_z**2 + 0.01**2)
-            
-
-            self.data.add_column(Column(data=g_sdss, name='_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=gerr_sdss, name='_e_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=r_sdss, name='_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=rerr_sdss, name='_e_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=i_sdss, name='_imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=ierr_sdss, name='_e_imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=z_sdss, name='_zmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=zerr_sdss, name='_e_zmag',
-                                        unit=u.mag))
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (AB)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'AB'
-
-            logging.info(('{:d} sources sucessfully transformed '
-                          'to {:s}').format(self.shape[0], targetfilter))
+    def transform_filters(self, targetfilter, use_all_stars=False):
+        """
+        transform a given catalog into a different filter band; crop the
+        resulting catalog to only those sources that have transformed magnitudes
+        transformed magnitudes start with an underscore; all bands
+        provided by the same transformation (see
+        filter_transformations) are derived at the same time, later
+        calls for these bands do not require any computation
+        input: targetfilter name
+        return: number of transformed magnitudes
+        """
 
-            return self.shape[0]
-        
-
-        # SkyMapper to Sloan griz
-        elif ('SkyMapper' in self.catalogname and
-              targetfilter in ['g', 'r', 'i', 'z']):
-
-            logging.info(('trying to transform {:d} SkyMapper sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
-
-            # transform magnitudes to SDSS AB system
-            # using linear transformation equations derived from data in Wolf et al. 2018 PASA Vol 35
-            # uncertainties from linear fit 
-
-            g = self.data['gsmmag'].data
-            e_g = self.data['e_gsmmag'].data
-            r = self.data['rsmmag'].data
-            e_r = self.data['e_rsmmag'].data
-            i = self.data['ismmag'].data
-            e_i = self.data['e_ismmag'].data
-            z = self.data['zsmmag'].data
-            e_z = self.data['e_zsmmag'].data
-            
-            
-            #g mag
-            g_sdss = np.zeros(g.shape[0])
-            gerr_sdss = np.zeros(g.shape[0])
-            
-            for ism in range(g.shape[0]):
-                if (g[ism]-i[ism]) <  1.5:
-                    g_sdss[ism] = g[ism] - (-0.2366)*(g[ism]-i[ism]) - (-0.0598)
-                    gerr_sdss[ism] = np.sqrt(e_g[ism]**2 + 0.0045**2 + 0.0036**2)
-                elif (g[ism]-i[ism]) > 1.5:
-                    g_sdss[ism] = g[ism] - (0.1085)*(g[ism]-i[ism]) - (-0.5700)
-                    gerr_sdss[ism] = np.sqrt(e_g[ism]**2 + 0.0148**2 + 0.0399**2)
-            
-            
-            #r mag
-            r_sdss = np.zeros(r.shape[0])
-            rerr_sdss = np.zeros(r.shape[0])
-            
-            for ism in range(r.shape[0]):
-                if (g[ism]-i[ism]) <  1.5:
-                    r_sdss[ism] = r[ism] - (0.0318)*(g[ism]-i[ism]) - (0.0011)
-                    rerr_sdss[ism] = np.sqrt(e_r[ism]**2 + 0.0009**2 + 0.0007**2)
-                elif (g[ism]-i[ism]) > 1.5:
-                    r_sdss[ism] = r[ism] - (-0.0472)*(g[ism]-i[ism]) - (0.1127)
-                    rerr_sdss[ism] = np.sqrt(e_r[ism]**2 + 0.0062**2 + 0.0168**2) 
-            
-
-            #i mag
-            i_sdss = np.zeros(i.shape[0])
-            ierr_sdss = np.zeros(i.shape[0])
-            
-            for ism in range(i.shape[0]):
-                if (g[ism]-i[ism]) <  1.1:
-                    i_sdss[ism] = i[ism] - (-0.0389)*(g[ism]-i[ism]) - (0.0137)
-                    ierr_sdss[ism] = np.sqrt(e_i[ism]**2 + 0.0023**2 + 0.0015**2)
-                elif (g[ism]-i[ism]) > 1.1:
-                    i_sdss[ism] = i[ism] - (-0.0617)*(g[ism]-i[ism]) - (0.0362)
-                    ierr_sdss[ism] = np.sqrt(e_i[ism]**2 + 0.0020**2 + 0.0048**2)
-            
-            
-            #z mag
-            z_sdss = np.zeros(z.shape[0])
-            zerr_sdss = np.zeros(z.shape[0])
-            
-            for ism in range(z.shape[0]):
-                if (g[ism]-i[ism]) <  2.0:
-                    z_sdss[ism] = z[ism] - (-0.0352)*(g[ism]-i[ism]) - (0.0095)
-                    zerr_sdss[ism] = np.sqrt(e_z[ism]**2 + 0.0017**2 + 0.0018**2)
-                elif (g[ism]-i[ism]) > 2.0:
-                    z_sdss[ism] = z[ism] - (-0.1209)*(g[ism]-i[ism]) - (0.2115)
-                    zerr_sdss[ism] = np.sqrt(e_z[ism]**2 + 0.0155**2 + 0.0470**2)
-            
-
-            self.data.add_column(Column(data=g_sdss, name='_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=gerr_sdss, name='_e_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=r_sdss, name='_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=rerr_sdss, name='_e_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=i_sdss, name='_imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=ierr_sdss, name='_e_imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=z_sdss, name='_zmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=zerr_sdss, name='_e_zmag',
-                                        unit=u.mag))
-            
-            
-            # get rid of sources with no information from catalog
-            self.data = self.data[self['_gmag'] != 0]
-            self.data = self.data[self['_e_gmag'] != 0]
-            self.data = self.data[self['_rmag'] != 0]
-            self.data = self.data[self['_e_rmag'] != 0]
-            self.data = self.data[self['_imag'] != 0]
-            self.data = self.data[self['_e_imag'] != 0]
-            self.data = self.data[self['_zmag'] != 0]
-            self.data = self.data[self['_e_zmag'] != 0]
-            
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (AB)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'AB'
-
-            logging.info(('{:d} sources sucessfully transformed '
-                          'to {:s}').format(self.shape[0], targetfilter))
-            
+        if len(self.data) == 0:
+            return 0
 
+        # check if this specific transformation has already been done
+        if '_'+targetfilter+'mag' in self.fields:
+            logging.info(targetfilter + ' already available')
             return self.shape[0]
-        
-        
-
-        # SDSS to UKIRT Z
-        elif (self.catalogname.find('SDSS') > -1) and \
-                targetfilter == 'Z_UKIRT' and \
-                self.catalogname == 'AB':
-
-            logging.info(('trying to transform {:d} SDSS sources to '
-                          + 'UKIRT Z').format(self.shape[0]))
-
-            # transformations using the recipe by Hodgkin et al. 2009, MNRAS
-            # select sources for input catalog
-            mags = [self['zmag'].data, self['imag'].data,
-                    self['e_zmag'].data]
-            lbl = {'_Zmag': 0, '_e_Zmag': 1}
-            nmags = [np.zeros(self.shape[0]) for i in range(len(lbl))]
-
-            for idx in range(self.shape[0]):
-                # transformations according to Hewett et al. 2006, MNRAS
-                # (slope is average of III and V classes)
-                nmags[lbl['_Zmag']][idx] = mags[0][idx] - 0.01 + 0.06 * \
-                    (mags[1][idx]-mags[0][idx])-0.528
-                nmags[lbl['_e_Zmag']][idx] = mags[2][idx]
-
-            # append nmags arrays to catalog
-            for key, idx in list(lbl.items()):
-                self.add_field(key, nmags[idx])
-
-            # get rid of sources that have not been transformed
-            self.data = self.data[self['_Zmag'] < 99]
 
-            self.catalogname += '_transformed'
-            self.history += ', {:d} transformed to UKIRT Z (Vega)'.format(
-                self.shape[0])
-            self.magsystem = 'AB (ugriz), Z_UKIRT (Vega)'
-
-            logging.info(('{:d} sources sucessfully transformed to '
-                          'UKIRT Z').format(self.shape[0]))
+        transformation = find_filter_transformation(
+            self.catalogname, getattr(self, 'magsystem', None), targetfilter)
 
-            return self.shape[0]
+        if transformation is None:
+            if self.display:
+                print(('ERROR: no transformation from {:s} to '
+                       '{:s} available').format(self.catalogname,
+                                                targetfilter))
+            return 0
 
-        # Gaia DR2+ to Johnson Cousins VRI
-        elif ('GAIA' in self.catalogname and
-              targetfilter in ['V', 'R', 'I']):
+        logging.info(('trying to transform {:d} {:s} sources to '
+                      '{:s}').format(self.shape[0], self.catalogname,
+                                     targetfilter))
+
+        # select sources that meet the requirements of the
+        # transformation and the target band
+        keep = np.ones(self.shape[0], dtype=bool)
+        if not use_all_stars:
+            if 'select' in transformation:
+                keep &= transformation['select'](self.data)
+            if 'valid' in transformation['bands'][targetfilter]:
+                keep &= transformation['bands'][targetfilter]['valid'](
+                    self.data)
+        if not np.any(keep):
+            logging.warning(('no suitable stars for transformation '
+                             'to {:s}').format(targetfilter))
+            return 0
 
-            logging.info(('trying to transform {:d} GAIA sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
+        # derive all bands in one pass
+        for band, declaration in transformation['bands'].items():
+            mag, err, covered = apply_band_transformation(self.data,
+                                                          declaration)
+            keep &= covered
+            self.data.add_column(Column(data=mag, name='_'+band+'mag',
+                                        unit=transformation['unit']))
+            self.data.add_column(Column(data=err, name='_e_'+band+'mag',
+                                        unit=transformation['unit']))
 
-            # transform magnitudes to Johnson-Cousins, Vega system
-            # using http://gea.esac.esa.int/archive/documentation/GDR2/Data_processing/chap_cu5pho/sec_cu5pho_calibr/ssec_cu5pho_PhotTransf.html
+        if 'finite' in transformation:
+            keep &= np.isfinite(self['_'+transformation['finite']+'mag'])
 
-            if not use_all_stars:
-                colormask = ((self.data['BPmag']-self.data['RPmag'] > -0.5) &
-                             (self.data['BPmag']-self.data['RPmag'] < 2.75))
-                self.data = self.data[colormask]
-
-            g = self.data['Gmag'].data
-            e_g = self.data['e_Gmag'].data
-            bp = self.data['BPmag'].data
-            rp = self.data['RPmag'].data
-
-            V = g - (-0.0176 - 0.00686*(bp-rp) - 0.1732*(bp-rp)**2)
-            e_V = np.sqrt(e_g**2 + 0.045858**2)
-            R = g - (-0.003226 + 0.3833*(bp-rp) - 0.1345*(bp-rp)**2)
-            e_R = np.sqrt(e_g**2 + 0.04840**2)
-            I = g - (0.02085 + 0.7419*(bp-rp) - 0.09531*(bp-rp)**2)
-            e_I = np.sqrt(e_g**2 + 0.04956**2)
-
-            self.data.add_column(Column(data=V, name='_Vmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_V, name='_e_Vmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=R, name='_Rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_R, name='_e_Rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=I, name='_Imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_I, name='_e_Imag',
-                                        unit=u.mag))
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (Vega)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'Vega'
-
-            logging.info(
-                '{:d} sources sucessfully transformed to {:s}'.format(
-                    self.shape[0], targetfilter))
+        # get rid of sources that have not been transformed
+        self.data = self.data[keep]
 
-            return self.shape[0]
+        if '_transformed' not in self.catalogname:
+            self.catalogname += '_transformed'
+            self.history += ', {:d} transformed to {:s}'.format(
+                self.shape[0],
+                transformation['history'].format(band=targetfilter))
+            self.magsystem = transformation['new_magsystem'].format(
+                band=targetfilter)
 
-        # Gaia DR2+ to SDSS
-        elif ('GAIA' in self.catalogname and
-              targetfilter in ['g', 'r', 'i']):
+        logging.info(('{:d} sources sucessfully '
+                      'transformed to {:s}').format(self.shape[0],
+                                                    targetfilter))
 
-            logging.info(('trying to transform {:d} GAIA sources to '
-                          + '{:s}').format(self.shape[0], targetfilter))
+        return self.shape[0]
 
-            # transform magnitudes to Johnson-Cousins, Vega system
-            # using http://gea.esac.esa.int/archive/documentation/GDR2/Data_processing/chap_cu5pho/sec_cu5pho_calibr/ssec_cu5pho_PhotTransf.html
+    # catalog operations
 
-            if not use_all_stars:
-                if targetfilter == 'g':
-                    colormask = ((self.data['BPmag']-self.data['RPmag'] > -0.5) &
-                                 (self.data['BPmag']-self.data['RPmag'] < 2.0))
-                elif targetfilter == 'r':
-                    colormask = ((self.data['BPmag']-self.data['RPmag'] > 0.2) &
-                                 (self.data['BPmag']-self.data['RPmag'] < 2.7))
-                elif targetfilter == 'i':
-                    colormask = ((self.data['BPmag']-self.data['RPmag'] > 0) &
-                                 (self.data['BPmag']-self.data['RPmag'] < 4.5))
-
-                self.data = self.data[colormask]
-
-            g = self.data['Gmag'].data
-            e_g = self.data['e_Gmag'].data
-            bp = self.data['BPmag'].data
-            rp = self.data['RPmag'].data
-
-            g_sdss = g - (0.13518 - 0.46245*(bp-rp) -
-                          0.25171*(bp-rp)**2 + 0.021349*(bp-rp)**3)
-            e_g_sdss = np.sqrt(e_g**2 + 0.16497**2)
-            r_sdss = g - (-0.12879 + 0.24662*(bp-rp) -
-                          0.027464*(bp-rp)**2 - 0.049465*(bp-rp)**3)
-            e_r_sdss = np.sqrt(e_g**2 + 0.066739**2)
-            i_sdss = g - (-0.29676 + 0.64728*(bp-rp) - 0.10141*(bp-rp)**2)
-            e_i_sdss = np.sqrt(e_g**2 + 0.098957**2)
-
-            self.data.add_column(Column(data=g_sdss, name='_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_g_sdss, name='_e_gmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=r_sdss, name='_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_r_sdss, name='_e_rmag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=i_sdss, name='_imag',
-                                        unit=u.mag))
-            self.data.add_column(Column(data=e_i_sdss, name='_e_imag',
-                                        unit=u.mag))
-
-            if '_transformed' not in self.catalogname:
-                self.catalogname += '_transformed'
-                self.history += ', {:d} transformed to {:s} (AB)'.format(
-                    self.shape[0], targetfilter)
-                self.magsystem = 'AB'
-
-            logging.info(
-                '{:d} sources sucessfully transformed to {:s}'.format(
-                    self.shape[0], targetfilter))
+    def sky_index(self, keys=('ra_deg', 'dec_deg')):
+        """
+        SkyIndex of the positions in fields `keys`; the index is built
+        once and reused until the data are replaced, sources are
+        rejected, or fields `keys` are added
+        return: SkyIndex
+        """
+        keys = tuple(keys[:2])
+        if keys not in self._sky_indices:
+            self._sky_indices[keys] = SkyIndex(self[keys[0]], self[keys[1]])
+        return self._sky_indices[keys]
 
-            return self.shape[0]
+    def cached_sky_index(self, keys=('ra_deg', 'dec_deg')):
+        """
+        return: SkyIndex of the positions in fields `keys`, if it has
+                already been built, otherwise None
+        """
+        return self._sky_indices.get(tuple(keys[:2]))
 
+    def _drop_sky_indices(self, fields=None):
+        """drop cached sky indices (that involve any of `fields`)"""
+        if fields is None:
+            self._sky_indices = {}
         else:
-            if self.display:
-                print(('ERROR: no transformation from {:s} to '
-                       '{:s} available').format(self.catalogname,
-                                                targetfilter))
-            return 0
-
-    # catalog operations
+            self._sky_indices = {keys: index for keys, index
+                                 in self._sky_indices.items()
+                                 if not set(keys) & set(fields)}
 
     def match_with(self, catalog,
                    match_keys_this_catalog=['ra_deg', 'dec_deg'],
                    match_keys_other_catalog=['ra_deg', 'dec_deg'],
                    extract_this_catalog=['ra_deg', 'dec_deg'],
                    extract_other_catalog=['ra_deg', 'dec_deg'],
-                   tolerance=0.5/3600):
-        """ match sources from different catalogs based on two fields
-            (e.g., postions)
+                   tolerance=0.5/3600, this_index=None, other_index=None):
+        """ match sources from different catalogs based on their sky
+            positions; the first two match keys are RA and Dec (degrees),
+            the tolerance is a great-circle distance (degrees)
+            this_index, other_index: precomputed SkyIndex of this/the
+                                     other catalog (optional; by default,
+                                     the cached indices are used, see
+                                     sky_index)
             return: requested fields for matched sources
             note: will only match exclusive pairs
-
-            TBD: replace this routine with something that uses
-                 astropy.table functionality; how about astropy.coord matching?
         """
 
-        this_tree = spatial.KDTree(
-            list(zip(self[match_keys_this_catalog[0]].data,
-                     self[match_keys_this_catalog[1]].data)))
+        this_ra, this_dec = [self[key] for key in match_keys_this_catalog[:2]]
+        other_ra, other_dec = [catalog[key]
+                               for key in match_keys_other_catalog[:2]]
+
+        if this_index is None:
+            this_index = self.sky_index(match_keys_this_catalog)
 
         # kd-tree matching
         if tolerance is not None:
-            other_tree = spatial.KDTree(
-                list(zip(catalog[match_keys_other_catalog[0]].data,
-                         catalog[match_keys_other_catalog[1]].data)))
-
-            match = this_tree.query_ball_tree(other_tree, tolerance)
-
-            indices_this_catalog = [x for x in range(
-                len(match)) if len(match[x]) == 1]
-            indices_other_catalog = [x[0] for x in list(
-                filter((lambda x: len(x) == 1), match))]
+            # sources in this catalog with exactly one counterpart
+            # within the tolerance
+            idx_other, idx_this = this_index.pairs(other_ra, other_dec,
+                                                   tolerance)
+            n_counterparts = np.bincount(idx_this, minlength=this_index.size)
+            exclusive = n_counterparts[idx_this] == 1
+            order = np.argsort(idx_this[exclusive])
+            indices_this_catalog = idx_this[exclusive][order]
+            indices_other_catalog = idx_other[exclusive][order]
 
         else:
             # will find the closest match for each target in this catalog
-            other_cat = list(zip(catalog[match_keys_other_catalog[0]].data,
-                                 catalog[match_keys_other_catalog[1]].data))
+            if other_index is None:
+                other_index = catalog.cached_sky_index(
+                    match_keys_other_catalog)
+
+            if other_index is None:
+                dist, idx = this_index.query(other_ra, other_dec)
+
+                # closest source in the other catalog for each target
+                order = np.lexsort((dist, idx))
+                first = np.ones(len(order), dtype=bool)
+                first[1:] = idx[order][1:] != idx[order][:-1]
+                indices_this_catalog = idx[order][first]
+                indices_other_catalog = order[first]
+            else:
+                # closest source for each target among the nearest
+                # sources that have no closer target
+                (indices_this_catalog,
+                 indices_other_catalog) = self._closest_sources(
+                     this_index, other_index, this_ra, this_dec,
+                     np.ma.getdata(other_ra), np.ma.getdata(other_dec))
 
-            match = this_tree.query(other_cat)
+        # match outputs based on indices provided and require
+        # extract_fields to be filled (i.e., not nan)
+        assert len(indices_this_catalog) == len(indices_other_catalog)
+        valid = np.ones(len(indices_this_catalog), dtype=bool)
+        for cat, keys, indices in [
+                (self, extract_this_catalog, indices_this_catalog),
+                (catalog, extract_other_catalog, indices_other_catalog)]:
+            for key in keys:
+                values = np.ma.getdata(cat[key])
+                if values.dtype.kind == 'f':
+                    valid &= ~np.isnan(values[indices])
+        indices_this_catalog = indices_this_catalog[valid]
+        indices_other_catalog = indices_other_catalog[valid]
+
+        output_this_catalog = [self[key][indices_this_catalog]
+                               for key in extract_this_catalog]
+        output_other_catalog = [catalog[key][indices_other_catalog]
+                                for key in extract_other_catalog]
 
-            indices_this_catalog, indices_other_catalog = [], []
+        return [output_this_catalog, output_other_catalog]
 
-            for target_idx in range(self.shape[0]):
-                other_cat_indices = np.where(match[1] == target_idx)[0]
-                if len(other_cat_indices) > 0:
-                    # find closest match
-                    min_idx = other_cat_indices[np.argmin(
-                        [match[0][i] for i in other_cat_indices])]
+    @staticmethod
+    def _closest_sources(this_index, other_index, this_ra, this_dec,
+                         other_ra, other_dec):
+        """
+        for each position in this_index, find the closest position in
+        other_index for which it is the closest position in this_index
+        input: indices and positions of both catalogs
+        return: indices of matched positions in this and other index
+        """
+        targets = np.arange(this_index.size)
+        indices_this, indices_other = [], []
+        k = 8
+        while len(targets) > 0 and other_index.size > 0:
+            k = min(k, other_index.size)
+            _, candidates = other_index.query(
+                np.ma.getdata(this_ra)[targets],
+                np.ma.getdata(this_dec)[targets], k=k)
+            candidates = candidates.reshape(len(targets), k)
+            _, closest = this_index.query(other_ra[candidates.ravel()],
+                                          other_dec[candidates.ravel()])
+            own = closest.reshape(len(targets), k) == targets[:, None]
+            found = np.any(own, axis=1)
+            indices_this.append(targets[found])
+            indices_other.append(
+                candidates[found, np.argmax(own[found], axis=1)])
+            if k == other_index.size:
+                break
+            targets, k = targets[~found], 2*k
+        if len(indices_this) == 0:
+            return np.array([], dtype=int), np.array([], dtype=int)
+        indices_this = np.concatenate(indices_this)
+        indices_other = np.concatenate(indices_other)
+        order = np.argsort(indices_this)
+        return indices_this[order], indices_other[order]
+
+
+class MultiFrameCatalog(object):
+    """
+    source catalogs of multiple frames stacked into a single table;
+    field `frame` holds the frame index of each source, sources of
+    frame i are rows offsets[i]:offsets[i+1]; per-frame properties
+    (catalogname, origin, obstime, ...) are kept in `frames`
+    """
+
+    frame_properties = ('catalogname', 'origin', 'history', 'magsys',
+                        'obstime', 'obj', 'filtername')
+
+    def __init__(self, catalogs, fields=None):
+        """
+        input: list of catalog objects, list of fields to stack
+               (default: fields that are available in all catalogs)
+        """
+        if fields is None:
+            fields = [name for name in catalogs[0].fields.keys()
+                      if all([name in cat.fields for cat in catalogs[1:]])]
+
+        self.frames = [{key: getattr(cat, key)
+                        for key in self.frame_properties}
+                       for cat in catalogs]
+        n_sources = [cat.shape[0] for cat in catalogs]
+        self.offsets = np.concatenate([[0], np.cumsum(n_sources)]).astype(
+            int)
+
+        columns = []
+        for name in fields:
+            parts = [cat[name] for cat in catalogs]
+            if any([np.ma.is_masked(part) for part in parts]):
+                columns.append(np.ma.concatenate(parts))
+            else:
+                columns.append(np.concatenate([np.ma.getdata(part)
+                                               for part in parts]))
+        columns.append(np.repeat(np.arange(len(catalogs), dtype=np.int32),
+                                 n_sources))
+        self.data = Table(columns, names=list(fields)+['frame'], copy=False)
+        for name in fields:
+            self.data[name].unit = catalogs[0][name].unit
+
+    @classmethod
+    def from_extraction(cls, extraction, maxflag=None, columns=None):
+        """
+        build from extract_multiframe output; LDAC files are read with
+        column projection (see catalog.read_ldac)
+        input: list of extraction results, maximum FLAGS value,
+               list of LDAC fields to read
+        return: MultiFrameCatalog
+        """
+        catalogs = []
+        for frame in extraction:
+            cat = catalog(frame['ldac_filename'])
+            cat.read_ldac(frame['ldac_filename'], maxflag=maxflag,
+                          columns=columns)
+            cat.origin += frame['fits_filename']
+            cat.obstime[0] = frame.get('time')
+            catalogs.append(cat)
+        return cls(catalogs)
+
+    @classmethod
+    def from_databases(cls, filenames, format='sqlite', fields=None):
+        """
+        build from photometry database files (see
+        catalog.read_photometry)
+        input: list of filenames without extension, database format,
+               list of fields to stack
+        return: MultiFrameCatalog
+        """
+        catalogs = []
+        for filename in filenames:
+            cat = catalog(filename)
+            cat.read_photometry(filename, format)
+            catalogs.append(cat)
+        return cls(catalogs, fields=fields)
 
-                    indices_this_catalog.append(target_idx)
-                    indices_other_catalog.append(min_idx)
+    # data access functions
 
-        # match outputs based on indices provided and require
-        # extract_fields to be filled
-        assert len(indices_this_catalog) == len(indices_other_catalog)
-        indices = list(zip(indices_this_catalog, indices_other_catalog))
-        # check if element is either not nan or not a float
+    def __len__(self):
+        return len(self.data)
 
-        def check_not_nan(x): return not np.isnan(x) if \
-            (type(x) is np.float_) else True
+    def __getitem__(self, ident):
+        """
+        return: source or field
+        """
+        return self.data[ident]
 
-        indices = [i for i in indices if all([check_not_nan(self[i[0]][key])
-                                              for key in extract_this_catalog]
-                                             + [check_not_nan(catalog[i[1]][key])
-                                                for key in extract_other_catalog])]
-        output_this_catalog = [self[key][[i[0] for i in indices]]
-                               for key in extract_this_catalog]
-        output_other_catalog = [catalog[key][[i[1] for i in indices]]
-                                for key in extract_other_catalog]
+    @property
+    def n_frames(self):
+        """
+        return: number of frames
+        """
+        return len(self.frames)
 
-        return [output_this_catalog, output_other_catalog]
+    @property
+    def n_sources(self):
+        """
+        return: array of the number of sources in each frame
+        """
+        return np.diff(self.offsets)
+
+    def frame_catalog(self, frame_idx):
+        """
+        return: catalog object for frame `frame_idx`; its data share
+                memory with this table
+        """
+        properties = self.frames[frame_idx]
+        cat = catalog(properties['catalogname'])
+        for key in self.frame_properties:
+            setattr(cat, key, properties[key])
+        cat.obstime = list(properties['obstime'])
+        cat.data = self.data[self.offsets[frame_idx]:
+                             self.offsets[frame_idx+1]]
+        cat.data.remove_column('frame')
+        return cat
+
+    def catalogs(self):
+        """
+        return: list of catalog objects, one for each frame
+        """
+        return [self.frame_catalog(idx) for idx in range(self.n_frames)]
+
+    # group-by-frame operations
+
+    def group_reduce(self, field, ufunc=np.add):
+        """
+        reduce field values of each frame using a numpy ufunc
+        input: field name, ufunc (e.g., np.add, np.minimum)
+        return: array with one value per frame (NaN for frames without
+                sources)
+        """
+        values = np.ma.getdata(self.data[field]).astype(float)
+        result = np.full(self.n_frames, np.nan)
+        populated = self.n_sources > 0
+        if len(values) > 0:
+            result[populated] = ufunc.reduceat(
+                values, self.offsets[:-1][populated])
+        return result
+
+    def group_mean(self, field):
+        """
+        return: array of the mean field value of each frame
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.group_reduce(field, np.add)/self.n_sources
+
+    def group_percentile(self, field, q):
+        """
+        percentile of field values in each frame (linear interpolation
+        as in numpy.percentile)
+        input: field name, percentile (0-100)
+        return: array with one value per frame (NaN for frames without
+                sources or with NaN values)
+        """
+        values = np.ma.getdata(self.data[field]).astype(float)
+        frame = self.data['frame']
+        n = self.n_sources
+        result = np.full(self.n_frames, np.nan)
+        if len(values) == 0:
+            return result
+
+        # sort by value within frames; NaN values are sorted last
+        values = values[np.lexsort((values, frame))]
+
+        populated = n > 0
+        pos = q/100.*(n[populated]-1)
+        lower = np.floor(pos).astype(int)
+        upper = np.minimum(lower+1, n[populated]-1)
+        offsets = self.offsets[:-1][populated]
+        v_lower, v_upper = values[offsets+lower], values[offsets+upper]
+        result[populated] = v_lower + (pos-lower)*(v_upper-v_lower)
+
+        # frames with NaN values
+        nan_frames = np.unique(frame[np.isnan(values)])
+        result[nan_frames] = np.nan
+        return result
+
+    def apply_zeropoints(self, field, zeropoints, target_field,
+                         error_field=None, zeropoint_errors=None,
+                         target_error_field=None):
+        """
+        add field `target_field` with field values offset by the
+        zeropoint of the respective frame; uncertainties are combined
+        in quadrature, if requested
+        input: field name, array of zeropoints (one per frame), target
+               field name, uncertainty field name, array of zeropoint
+               uncertainties, target uncertainty field name
+        """
+        zeropoints = np.asarray(zeropoints, dtype=float)
+        frame = self.data['frame']
+        self.data[target_field] = (np.ma.getdata(self.data[field]) +
+                                   zeropoints[frame])
+        if error_field is not None:
+            zeropoint_errors = np.asarray(zeropoint_errors, dtype=float)
+            self.data[target_error_field] = np.sqrt(
+                np.ma.getdata(self.data[error_field])**2 +
+                zeropoint_errors[frame]**2)
+
+    # cross-frame operations
+
+    def sky_index(self, keys=('ra_deg', 'dec_deg')):
+        """
+        return: SkyIndex of the positions of all sources in all frames;
+                the frame of each indexed source is self['frame'][idx]
+        """
+        return SkyIndex(self.data[keys[0]], self.data[keys[1]])
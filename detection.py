@@ -0,0 +1,523 @@
+""" DETECTION - source detection and photometry using NumPy/SciPy as an
+              in-process alternative to Source Extractor
+    v1.0: 2026-10-18
+"""
+from __future__ import print_function
+
+# Photometry Pipeline
+# Copyright (C) 2016-2018  Michael Mommert, mommermiscience@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+import warnings
+import numpy as np
+from scipy import ndimage
+from scipy.interpolate import RectBivariateSpline
+from astropy.io import fits
+from astropy import wcs
+
+# pipeline-specific modules
+import _pp_conf
+
+# setup logging
+logging.basicConfig(filename=_pp_conf.log_filename,
+                    level=_pp_conf.log_level,
+                    format=_pp_conf.log_formatline,
+                    datefmt=_pp_conf.log_datefmt)
+
+# This module reproduces the subset of Source Extractor functionality
+# used by the pipeline: background mesh estimation, thresholding,
+# segmentation (no deblending and no detection filter), isophotal
+# moments, windowed centroids, and aperture and Kron photometry. Output
+# columns follow Source Extractor conventions (pixel coordinates are
+# 1-based, magnitudes use a zeropoint of 0, flux errors are in
+# counts); the output is written into a FITS_LDAC file that can be
+# used in SCAMP and catalog.read_ldac.
+
+# LDAC column formats; all other columns are written as floats
+column_formats = {'NUMBER': 'J', 'EXT_NUMBER': 'I', 'FLAGS': 'I',
+                  'ISOAREA_IMAGE': 'J', 'X_IMAGE': 'D', 'Y_IMAGE': 'D',
+                  'XWIN_IMAGE': 'D', 'YWIN_IMAGE': 'D',
+                  'XWIN_WORLD': 'D', 'YWIN_WORLD': 'D',
+                  'ALPHA_J2000': 'D', 'DELTA_J2000': 'D'}
+
+# Source Extractor flags
+FLAG_NEIGHBORS = 1
+FLAG_SATURATED = 4
+FLAG_TRUNCATED = 8
+FLAG_APERTURE_INCOMPLETE = 16
+
+
+def read_sex_config(filename):
+    """read Source Extractor configuration file into dictionary of
+    strings"""
+    config = {}
+    with open(os.path.expandvars(filename), 'r') as f:
+        for line in f:
+            items = line.split('#')[0].split(None, 1)
+            if len(items) == 2:
+                config[items[0]] = items[1].strip()
+    return config
+
+
+def read_sex_params(filename):
+    """read Source Extractor parameter file; returns list of
+    (column name, vector length or None) tuples"""
+    params = []
+    with open(os.path.expandvars(filename), 'r') as f:
+        for line in f:
+            items = line.split('#')[0].split()
+            if len(items) == 0:
+                continue
+            name = items[0]
+            size = None
+            if '(' in name:
+                name, size = name[:-1].split('(')
+                size = int(size)
+            params.append((name, size))
+    return params
+
+
+def background_mesh(data, valid, meshsize=64, filtersize=3):
+    """derive background and background rms maps
+
+    The image is divided into meshes of `meshsize` pixels; in each mesh
+    the background is estimated from sigma-clipped pixel values
+    (mode estimator as in Source Extractor). The mesh values are
+    median-filtered and interpolated with a bicubic spline.
+
+    :param data: image array
+    :param valid: boolean array, False for masked pixels
+    :return: background map, rms map
+    """
+    ny, nx = data.shape
+    my, mx = int(np.ceil(ny/meshsize)), int(np.ceil(nx/meshsize))
+
+    padded = np.full((my*meshsize, mx*meshsize), np.nan)
+    padded[:ny, :nx] = np.where(valid, data, np.nan)
+    meshes = padded.reshape(my, meshsize, mx, meshsize).swapaxes(
+        1, 2).reshape(my, mx, meshsize**2)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for i in range(3):
+            med = np.nanmedian(meshes, axis=2)
+            std = np.nanstd(meshes, axis=2)
+            meshes = np.where(np.abs(meshes-med[:, :, None]) >
+                              3*std[:, :, None], np.nan, meshes)
+        med = np.nanmedian(meshes, axis=2)
+        mean = np.nanmean(meshes, axis=2)
+        std = np.nanstd(meshes, axis=2)
+
+    # mode estimate for uncrowded meshes
+    mode = np.where(np.abs(mean-med) < 0.3*std, 2.5*med-1.5*mean, med)
+
+    # fill empty meshes
+    empty = ~np.isfinite(mode) | ~np.isfinite(std)
+    if np.all(empty):
+        return np.zeros(data.shape), np.ones(data.shape)
+    mode[empty] = np.median(mode[~empty])
+    std[empty] = np.median(std[~empty])
+
+    if filtersize > 1:
+        mode = ndimage.median_filter(mode, size=filtersize, mode='nearest')
+        std = ndimage.median_filter(std, size=filtersize, mode='nearest')
+
+    # interpolate to full resolution
+    if my == 1 and mx == 1:
+        return (np.full(data.shape, mode[0, 0]),
+                np.full(data.shape, std[0, 0]))
+    yc = (np.arange(my)+0.5)*meshsize - 0.5
+    xc = (np.arange(mx)+0.5)*meshsize - 0.5
+    maps = []
+    for values in [mode, std]:
+        # spline interpolation requires at least two meshes per axis
+        y, x, v = yc, xc, values
+        if my == 1:
+            y, v = np.array([yc[0]-1, yc[0]+1]), np.vstack([v, v])
+        if mx == 1:
+            x, v = np.array([xc[0]-1, xc[0]+1]), np.hstack([v, v])
+        spline = RectBivariateSpline(y, x, v, kx=min(3, len(y)-1),
+                                     ky=min(3, len(x)-1))
+        maps.append(spline(np.arange(ny), np.arange(nx)))
+
+    return maps[0], np.clip(maps[1], 1e-30, None)
+
+
+def segment(image, threshold, valid, minarea):
+    """identify connected pixel groups above `threshold`
+
+    :return: segmentation map (0: background, 1..n: sources), number of
+             sources
+    """
+    labels, n = ndimage.label((image > threshold) & valid,
+                              structure=np.ones((3, 3)))
+    if n == 0:
+        return labels, 0
+
+    # reject sources with insufficient area and relabel
+    area = np.bincount(labels.ravel(), minlength=n+1)
+    keep = area >= minarea
+    keep[0] = False
+    lookup = np.zeros(n+1, dtype=labels.dtype)
+    lookup[keep] = np.arange(1, keep.sum()+1)
+    return lookup[labels], int(keep.sum())
+
+
+def isophotal_properties(image, labels, n):
+    """isophotal fluxes, barycenters and second moments using all
+    pixels of each segment; pixel coordinates are 0-based"""
+    sel = labels > 0
+    idx = labels[sel]
+    yy, xx = np.nonzero(sel)
+    v = image[sel]
+
+    def total(weights):
+        return np.bincount(idx, weights=weights, minlength=n+1)[1:]
+
+    area = np.bincount(idx, minlength=n+1)[1:]
+    flux = total(v)
+    norm = np.where(flux > 0, flux, 1)
+    x = total(v*xx)/norm
+    y = total(v*yy)/norm
+    x2 = total(v*xx**2)/norm - x**2
+    y2 = total(v*yy**2)/norm - y**2
+    xy = total(v*xx*yy)/norm - x*y
+
+    # handle singular cases
+    x2 = np.clip(x2, 1/12., None)
+    y2 = np.clip(y2, 1/12., None)
+
+    return {'area': area, 'flux': flux, 'x': x, 'y': y,
+            'x2': x2, 'y2': y2, 'xy': xy}
+
+
+def moments_to_ellipse(x2, y2, xy):
+    """convert second moments into semi-major axis, semi-minor axis and
+    position angle (deg)"""
+    mean = (x2+y2)/2.
+    diff = np.sqrt(((x2-y2)/2.)**2 + xy**2)
+    a = np.sqrt(np.clip(mean+diff, 0, None))
+    b = np.sqrt(np.clip(mean-diff, 0, None))
+    theta = np.degrees(0.5*np.arctan2(2*xy, x2-y2))
+    return a, b, theta
+
+
+def gather_stamps(array, y, x, radius, fill=0):
+    """extract square stamps of size 2*radius+1 centered on integer
+    pixel coordinates `y`, `x` from `array`; pixels outside the array
+    are set to `fill`"""
+    padded = np.pad(array, radius, mode='constant', constant_values=fill)
+    offsets = np.arange(-radius, radius+1)
+    rows = (y+radius)[:, None, None] + offsets[None, :, None]
+    cols = (x+radius)[:, None, None] + offsets[None, None, :]
+    return padded[rows, cols]
+
+
+def circular_fraction(dist, radius):
+    """approximate fraction of each pixel inside a circle of `radius`
+    for pixel center distances `dist`"""
+    return np.clip(radius + 0.5 - dist, 0, 1)
+
+
+def ldac_imhead(header):
+    """build the LDAC_IMHEAD extension that holds the image `header`"""
+    cards = [card.image for card in header.cards] + ['END'.ljust(80)]
+    hdrcol = fits.Column(name='Field Header Card',
+                         format='%dA' % (80*len(cards)),
+                         array=np.array([''.join(cards)]))
+    hdrhdu = fits.BinTableHDU.from_columns([hdrcol])
+    hdrhdu.header['EXTNAME'] = 'LDAC_IMHEAD'
+    hdrhdu.header['TDIM1'] = '(80, %d)' % len(cards)
+    return hdrhdu
+
+
+def extract(filename, param, ldacname):
+    """
+    detect sources in a FITS frame and measure their properties; the
+    resulting catalog is written into `ldacname` as FITS_LDAC file
+
+    input: FITS filename, pp_extract parameter dictionary, LDAC filename
+    return: LDAC HDUList, FITS header
+    """
+
+    obsparam = param['obsparam']
+    config = read_sex_config(obsparam['sex-config-file'])
+
+    if 'paramfile' in param:
+        paramfile = param['paramfile']
+    else:
+        paramfile = config['PARAMETERS_NAME']
+    columns = read_sex_params(paramfile)
+
+    hdulist = fits.open(filename, ignore_missing_end=True)
+    header = hdulist[0].header
+    raw = hdulist[0].data.astype(np.float64)
+    hdulist.close()
+
+    valid = np.isfinite(raw)
+    if 'mask_file' in param:
+        weight = fits.getdata(os.path.expandvars(param['mask_file']))
+        if weight.shape == raw.shape:
+            valid &= weight > 0
+        else:
+            logging.warning('mask %s does not match image dimensions' %
+                            param['mask_file'])
+    raw = np.where(valid, raw, 0)
+
+    # detector properties
+    gain = float(config.get('GAIN', 0))
+    if config.get('GAIN_KEY', 'GAIN') in header:
+        gain = float(header[config.get('GAIN_KEY', 'GAIN')])
+    satur = float(config.get('SATUR_LEVEL', 50000))
+    if config.get('SATUR_KEY', 'SATURATE') in header:
+        satur = float(header[config.get('SATUR_KEY', 'SATURATE')])
+    if param.get('ignore_saturation', False):
+        satur = np.inf
+
+    if 'aperture_diam' in param and param['aperture_diam'] is not None:
+        diameters = str(param['aperture_diam'])
+    else:
+        diameters = config.get('PHOT_APERTURES', '5')
+    apradii = np.array([float(d)/2. for d in diameters.split(',')])
+    local_background = not param.get('global_background', False) and \
+        config.get('BACKPHOTO_TYPE', 'GLOBAL') == 'LOCAL'
+
+    # background and detection
+    bkg, rms = background_mesh(raw, valid,
+                               int(config.get('BACK_SIZE', '64').split(',')[0]),
+                               int(config.get('BACK_FILTERSIZE',
+                                              '3').split(',')[0]))
+    image = np.where(valid, raw-bkg, 0)
+    labels, n = segment(image, param['sex_snr']*rms, valid,
+                        param['source_minarea'])
+
+    logging.info('%d sources detected in frame %s' % (n, filename))
+
+    iso = isophotal_properties(image, labels, n)
+    a_img, b_img, theta_img = moments_to_ellipse(iso['x2'], iso['y2'],
+                                                 iso['xy'])
+    fwhm = 2.3548*np.sqrt((a_img**2+b_img**2)/2.)
+    flux_max = ndimage.maximum(image, labels, np.arange(1, n+1)) \
+        if n > 0 else np.zeros(0)
+    raw_max = ndimage.maximum(raw, labels, np.arange(1, n+1)) \
+        if n > 0 else np.zeros(0)
+
+    flags = np.zeros(n, dtype=np.int16)
+    flags[raw_max >= satur] |= FLAG_SATURATED
+    border = np.unique(np.hstack([labels[0, :], labels[-1, :],
+                                  labels[:, 0], labels[:, -1]]))
+    border = border[border > 0]
+    flags[border-1] |= FLAG_TRUNCATED
+
+    # stamp-based measurements, processed in chunks of sources
+    sigma = np.clip(fwhm/2.3548, 0.5, None)
+    radius = int(np.ceil(max(apradii.max(), 4*np.median(sigma)
+                             if n > 0 else 0))) + 2
+    if local_background:
+        radius += 6
+    radius = min(radius, 100)
+    offsets = np.arange(-radius, radius+1)
+    chunksize = max(64, int(2e6/(2*radius+1)**2))
+
+    xwin, ywin = iso['x'].copy(), iso['y'].copy()
+    winerr = np.zeros((n, 3))
+    apflux = np.zeros((n, len(apradii)))
+    aparea = np.zeros((n, len(apradii)))
+    autoflux = np.zeros(n)
+    autoarea = np.zeros(n)
+    fluxradius = np.zeros(n)
+    localbkg = np.zeros(n)
+    growthstep = 0.5
+    growthradii = np.arange(1, 2*radius+1)*growthstep
+    growthradii = growthradii[growthradii < radius]
+
+    for start in range(0, n, chunksize):
+        sl = slice(start, min(start+chunksize, n))
+        yc = np.round(iso['y'][sl]).astype(int)
+        xc = np.round(iso['x'][sl]).astype(int)
+        stamp = gather_stamps(image, yc, xc, radius)
+        stampvalid = gather_stamps(valid, yc, xc, radius, fill=False)
+        stampseg = gather_stamps(labels, yc, xc, radius)
+        own = np.arange(sl.start+1, sl.stop+1)[:, None, None]
+        xcen, ycen = iso['x'][sl], iso['y'][sl]
+
+        # windowed centroids (Gaussian window, Source Extractor style)
+        sig = sigma[sl][:, None, None]
+        for i in range(16):
+            dy = offsets[None, :, None] + (yc - ycen)[:, None, None]
+            dx = offsets[None, None, :] + (xc - xcen)[:, None, None]
+            r2 = dx**2 + dy**2
+            w = np.exp(-r2/(2*sig**2))*(r2 < (4*sig)**2)*stampvalid
+            wsum = np.sum(w*stamp, axis=(1, 2))
+            wsum = np.where(wsum > 0, wsum, np.nan)
+            shift_x = 2*np.sum(w*stamp*dx, axis=(1, 2))/wsum
+            shift_y = 2*np.sum(w*stamp*dy, axis=(1, 2))/wsum
+            shift_x = np.nan_to_num(np.clip(shift_x, -1, 1))
+            shift_y = np.nan_to_num(np.clip(shift_y, -1, 1))
+            xcen = xcen + shift_x
+            ycen = ycen + shift_y
+            if np.all(shift_x**2+shift_y**2 < 4e-8):
+                break
+        xwin[sl], ywin[sl] = xcen, ycen
+        dy = offsets[None, :, None] + (yc - ycen)[:, None, None]
+        dx = offsets[None, None, :] + (xc - xcen)[:, None, None]
+
+        # windowed centroid error ellipse
+        var = (rms[yc, xc]**2)[:, None, None] + \
+            (np.clip(stamp, 0, None)/gain if gain > 0 else 0)
+        wsum2 = np.nan_to_num(wsum)**2
+        wsum2 = np.where(wsum2 > 0, wsum2, np.inf)
+        winerr[sl, 0] = 4*np.sum(w**2*var*dx**2, axis=(1, 2))/wsum2
+        winerr[sl, 1] = 4*np.sum(w**2*var*dy**2, axis=(1, 2))/wsum2
+        winerr[sl, 2] = 4*np.sum(w**2*var*dx*dy, axis=(1, 2))/wsum2
+
+        dist = np.sqrt(dx**2+dy**2)
+
+        # local background from annulus outside all apertures
+        if local_background:
+            annulus = (stampvalid & (stampseg == 0) &
+                       (dist > apradii.max()+1))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                localbkg[sl] = np.nan_to_num(np.nanmedian(
+                    np.where(annulus, stamp, np.nan), axis=(1, 2)))
+            stamp = stamp - localbkg[sl][:, None, None]
+
+        # aperture photometry
+        others = (stampseg > 0) & (stampseg != own)
+        for j, apradius in enumerate(apradii):
+            frac = circular_fraction(dist, apradius)
+            apflux[sl, j] = np.sum(frac*stamp*stampvalid, axis=(1, 2))
+            aparea[sl, j] = np.sum(frac*stampvalid, axis=(1, 2))
+            incomplete = np.any((frac > 0) & ~stampvalid, axis=(1, 2))
+            incomplete |= (apradius > radius-1)
+            flags[sl][incomplete] |= FLAG_APERTURE_INCOMPLETE
+        neighbors = np.any(others & (dist < apradii.max()), axis=(1, 2))
+        flags[sl][neighbors] |= FLAG_NEIGHBORS
+
+        # Kron photometry
+        r1_region = dist < np.clip(6*np.sqrt(a_img[sl]*b_img[sl]),
+                                   1, radius)[:, None, None]
+        pos = np.clip(stamp, 0, None)*stampvalid*r1_region
+        r1 = np.sum(pos*dist, axis=(1, 2)) / \
+            np.clip(np.sum(pos, axis=(1, 2)), 1e-30, None)
+        kronradius = np.clip(np.maximum(2.5*r1, 3.5*np.sqrt(
+            a_img[sl]*b_img[sl])), 1, radius-1)
+        frac = circular_fraction(dist, kronradius[:, None, None])
+        autoflux[sl] = np.sum(frac*stamp*stampvalid, axis=(1, 2))
+        autoarea[sl] = np.sum(frac*stampvalid, axis=(1, 2))
+
+        # half-light radius from curve of growth
+        growth = np.array([np.sum(circular_fraction(dist, r)*stamp *
+                                  stampvalid, axis=(1, 2))
+                           for r in growthradii]).T
+        half = 0.5*autoflux[sl][:, None]
+        above = np.argmax(growth >= half, axis=1)
+        lower = np.clip(above-1, 0, None)
+        g0 = growth[np.arange(len(above)), lower]
+        g1 = growth[np.arange(len(above)), above]
+        t = np.where(g1 > g0, (half[:, 0]-g0)/np.where(g1 > g0, g1-g0, 1),
+                     0)
+        fluxradius[sl] = np.where(
+            above > 0, growthradii[lower] + t*growthstep,
+            growthradii[0]*np.clip(half[:, 0]/np.where(g1 != 0, g1, 1),
+                                   0, 1))
+
+    def error(flux, area):
+        noise = area*rms[np.round(ywin).astype(int).clip(0, raw.shape[0]-1),
+                         np.round(xwin).astype(int).clip(0, raw.shape[1]-1)
+                         ].reshape(-1, *([1]*(flux.ndim-1)))**2
+        if gain > 0:
+            noise = noise + np.clip(flux, 0, None)/gain
+        return np.sqrt(noise)
+
+    def magnitude(flux, fluxerr):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mag = np.where(flux > 0, -2.5*np.log10(flux), 99.)
+            magerr = np.where(flux > 0, 1.0857*fluxerr/flux, 99.)
+        return mag, magerr
+
+    # world coordinates
+    w = wcs.WCS(header)
+    if n > 0 and w.has_celestial:
+        world = w.all_pix2world(np.vstack([xwin+1, ywin+1]).T, 1)
+        pixscale = np.mean(wcs.utils.proj_plane_pixel_scales(
+            w.celestial))
+    else:
+        world = np.zeros((n, 2))
+        pixscale = 0.
+
+    erra, errb, errtheta = moments_to_ellipse(winerr[:, 0], winerr[:, 1],
+                                              winerr[:, 2])
+
+    isoerr = error(iso['flux'], iso['area'])
+    aperr = error(apflux, aparea)
+    autoerr = error(autoflux, autoarea)
+
+    values = {'NUMBER': np.arange(1, n+1),
+              'EXT_NUMBER': np.ones(n),
+              'FLUX_ISO': iso['flux'], 'FLUXERR_ISO': isoerr,
+              'FLUX_ISOCOR': iso['flux'], 'FLUXERR_ISOCOR': isoerr,
+              'FLUX_APER': apflux, 'FLUXERR_APER': aperr,
+              'FLUX_AUTO': autoflux, 'FLUXERR_AUTO': autoerr,
+              'FLUX_MAX': flux_max,
+              'ISOAREA_IMAGE': iso['area'],
+              'X_IMAGE': iso['x']+1, 'Y_IMAGE': iso['y']+1,
+              'A_IMAGE': a_img, 'B_IMAGE': b_img, 'THETA_IMAGE': theta_img,
+              'XWIN_IMAGE': xwin+1, 'YWIN_IMAGE': ywin+1,
+              'XWIN_WORLD': world[:, 0], 'YWIN_WORLD': world[:, 1],
+              'ALPHA_J2000': world[:, 0], 'DELTA_J2000': world[:, 1],
+              'ERRAWIN_IMAGE': erra, 'ERRBWIN_IMAGE': errb,
+              'ERRTHETAWIN_IMAGE': errtheta,
+              'ERRAWIN_WORLD': erra*pixscale, 'ERRBWIN_WORLD': errb*pixscale,
+              'FLAGS': flags,
+              'FWHM_IMAGE': fwhm, 'FWHM_WORLD': fwhm*pixscale,
+              'FLUX_RADIUS': fluxradius,
+              'FLUX_GROWTH': autoflux, 'FLUX_GROWTHSTEP': np.full(
+                  n, growthstep),
+              'BACKGROUND': bkg[np.round(ywin).astype(int).clip(
+                  0, raw.shape[0]-1), np.round(xwin).astype(int).clip(
+                      0, raw.shape[1]-1)] + localbkg}
+    for name in ['ISO', 'ISOCOR', 'APER', 'AUTO']:
+        values['MAG_'+name], values['MAGERR_'+name] = magnitude(
+            values['FLUX_'+name], values['FLUXERR_'+name])
+
+    # build LDAC file
+    cols = []
+    for name, size in columns:
+        if name not in values:
+            logging.warning('column %s not supported by numpy extraction '
+                            'backend; filled with zeros' % name)
+            values[name] = np.zeros(n)
+        array = values[name]
+        fmt = column_formats.get(name, 'E')
+        if array.ndim == 2 and array.shape[1] > 1:
+            fmt = '%d%s' % (array.shape[1], fmt)
+        elif array.ndim == 2:
+            array = array[:, 0]
+        cols.append(fits.Column(name=name, format=fmt, array=array))
+
+    hdrhdu = ldac_imhead(header)
+
+    datahdu = fits.BinTableHDU.from_columns(cols)
+    datahdu.header['EXTNAME'] = 'LDAC_OBJECTS'
+
+    ldac = fits.HDUList([fits.PrimaryHDU(), hdrhdu, datahdu])
+    ldac.writeto(ldacname, overwrite=True)
+
+    return ldac, header
@@ -0,0 +1,261 @@
+""" EPHEMERIS - batched and cached target ephemerides from JPL Horizons
+    v1.0: 2026-10-18
+"""
+from __future__ import print_function
+
+# Photometry Pipeline
+# Copyright (C) 2016-2018  Michael Mommert, mommermiscience@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import sqlite3
+import logging
+import numpy as np
+from astropy.table import Table
+from astroquery.jplhorizons import Horizons
+
+# pipeline-specific modules
+import _pp_conf
+from pp_setup import confephemeris as conf
+
+# setup logging
+logging.basicConfig(filename=_pp_conf.log_filename,
+                    level=_pp_conf.log_level,
+                    format=_pp_conf.log_formatline,
+                    datefmt=_pp_conf.log_datefmt)
+
+# epochs (JD) closer than this are considered identical
+epoch_tolerance = 1e-8
+
+
+class HorizonsBackend(object):
+    """queries ephemerides from JPL Horizons through astroquery"""
+
+    def ephemerides(self, target, epochs, location, id_type=None):
+        """
+        query ephemerides of `target` for a list of `epochs`
+        input: target name, epochs (JD), observatory code, Horizons
+               id_type (None: astroquery default)
+        return: Table with (at least) columns datetime_jd, targetname,
+                RA, DEC; raises ValueError if the target is unknown
+        """
+        kwargs = {} if id_type is None else {'id_type': id_type}
+        obj = Horizons(target, epochs=list(epochs), location=location,
+                       **kwargs)
+        try:
+            return obj.ephemerides()
+        finally:
+            logging.info('HORIZONS call: %s' % obj.uri)
+
+
+# ephemeris backend; replace with an object that provides the
+# HorizonsBackend interface to use other sources (e.g., for testing)
+backend = HorizonsBackend()
+
+
+class EphemerisCache(object):
+    """sqlite cache of target positions; entries are keyed on target
+    name, Horizons id_type, observatory code, and epoch, and carry the
+    time they were queried at, so that positions based on outdated
+    orbit solutions can be expired"""
+
+    def __init__(self, filename):
+        """
+        :param filename: sqlite database file (created if necessary)
+        """
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        if not os.path.exists(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        with self._connect() as db:
+            # caches of earlier versions lack query times
+            columns = [row[1] for row in db.execute(
+                'PRAGMA table_info(ephemerides)').fetchall()]
+            if len(columns) > 0 and 'queried' not in columns:
+                db.execute('DROP TABLE ephemerides')
+            db.execute('CREATE TABLE IF NOT EXISTS ephemerides '
+                       '(target TEXT, id_type TEXT, location TEXT, '
+                       'epoch REAL, targetname TEXT, ra REAL, dec REAL, '
+                       'queried REAL, '
+                       'PRIMARY KEY (target, id_type, location, epoch))')
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    def get(self, key, epochs, gap=0, max_age=None):
+        """
+        positions of target `key` (target, id_type, location) at
+        `epochs`; epochs that are not cached are interpolated linearly
+        between cached epochs that are at most `gap` (d) apart; entries
+        queried more than `max_age` (d) ago are ignored (None: no limit)
+        return: target names, RA, DEC (deg; NaN if not available)
+        """
+        epochs = np.asarray(epochs, dtype=float)
+        names = np.full(len(epochs), '', dtype=object)
+        ra, dec = np.full(len(epochs), np.nan), np.full(len(epochs), np.nan)
+        if len(epochs) == 0:
+            return names, ra, dec
+
+        queried = -np.inf if max_age is None else time.time()-max_age*86400
+        with self._connect() as db:
+            rows = db.execute(
+                'SELECT epoch, targetname, ra, dec FROM ephemerides '
+                'WHERE target=? AND id_type=? AND location=? AND '
+                'epoch BETWEEN ? AND ? AND queried >= ? ORDER BY epoch',
+                tuple(key) + (epochs.min()-gap-epoch_tolerance,
+                              epochs.max()+gap+epoch_tolerance,
+                              queried)).fetchall()
+        if len(rows) == 0:
+            return names, ra, dec
+
+        cached = np.array([row[0] for row in rows])
+        cached_names = np.array([row[1] for row in rows], dtype=object)
+        cached_ra = np.array([row[2] for row in rows])
+        cached_dec = np.array([row[3] for row in rows])
+
+        # cached epochs left and right of each epoch
+        idx = np.searchsorted(cached, epochs)
+        left = np.clip(idx-1, 0, len(cached)-1)
+        right = np.clip(idx, 0, len(cached)-1)
+        for nearest in [left, right]:
+            exact = (np.abs(cached[nearest]-epochs) <= epoch_tolerance)
+            names[exact] = cached_names[nearest[exact]]
+            ra[exact] = cached_ra[nearest[exact]]
+            dec[exact] = cached_dec[nearest[exact]]
+
+        interpolate = (np.isnan(ra) & (idx > 0) & (idx < len(cached)) &
+                       (cached[right]-cached[left] <= gap))
+        if np.any(interpolate):
+            lo, hi = left[interpolate], right[interpolate]
+            step = (epochs[interpolate]-cached[lo])/(cached[hi]-cached[lo])
+            # RA differences across 0/360 deg
+            dra = (cached_ra[hi]-cached_ra[lo]+180) % 360 - 180
+            names[interpolate] = cached_names[lo]
+            ra[interpolate] = (cached_ra[lo] + step*dra) % 360
+            dec[interpolate] = (cached_dec[lo] +
+                                step*(cached_dec[hi]-cached_dec[lo]))
+
+        return names, ra, dec
+
+    def put(self, key, epochs, names, ra, dec):
+        """store positions of target `key` (target, id_type, location)
+        queried now"""
+        queried = time.time()
+        with self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO ephemerides VALUES '
+                           '(?,?,?,?,?,?,?,?)',
+                           [tuple(key) + (float(epoch), str(name),
+                                          float(r), float(d), queried)
+                            for epoch, name, r, d in
+                            zip(epochs, names, ra, dec)])
+
+    def purge(self, target=None, older_than=None):
+        """remove all entries, or only those of `target`; with
+        `older_than` (s), only entries queried more than this ago are
+        removed; returns the number of entries removed"""
+        query, args = 'DELETE FROM ephemerides WHERE 1', ()
+        if target is not None:
+            query, args = query + ' AND target=?', args + (target,)
+        if older_than is not None:
+            query += ' AND queried < ?'
+            args += (time.time()-older_than,)
+        with self._connect() as db:
+            cur = db.execute(query, args)
+        return cur.rowcount
+
+
+def default_cache():
+    """ephemeris cache as defined in ConfEphemeris (None if disabled)"""
+    if not conf.ephemeris_cache:
+        return None
+    return EphemerisCache(conf.ephemeris_cache_file)
+
+
+def ephemerides(target, epochs, location, id_type=None, cache=None,
+                refresh=False):
+    """
+    positions of `target` as seen from `location` at `epochs`; cached
+    and interpolated positions (see EphemerisCache.get) that are not
+    older than ConfEphemeris.ephemeris_cache_expiry are taken from the
+    cache, all other epochs are queried from the backend at once (in
+    batches of ConfEphemeris.ephemeris_batch_size epochs); with
+    `refresh`, all epochs are queried and the cache is updated
+    input: target name, list of epochs (JD), observatory code, Horizons
+           id_type, EphemerisCache (default: default_cache()), refresh
+    return: Table with columns epoch, targetname, RA, DEC (deg) for each
+            epoch (RA and DEC are NaN if not available); None if the
+            target is unknown
+    """
+    if cache is None:
+        cache = default_cache()
+
+    epochs = np.atleast_1d(np.asarray(epochs, dtype=float))
+    key = (target, '' if id_type is None else str(id_type), str(location))
+
+    if cache is not None and not refresh:
+        names, ra, dec = cache.get(key, epochs,
+                                   conf.ephemeris_interpolation_gap,
+                                   max_age=conf.ephemeris_cache_expiry)
+    else:
+        names = np.full(len(epochs), '', dtype=object)
+        ra, dec = np.full(len(epochs), np.nan), np.full(len(epochs), np.nan)
+    n_cached = np.sum(~np.isnan(ra))
+
+    missing = np.unique(epochs[np.isnan(ra)])
+    queried = ([], [], [], [])
+    for start in range(0, len(missing), conf.ephemeris_batch_size):
+        batch = missing[start:start+conf.ephemeris_batch_size]
+        try:
+            eph = backend.ephemerides(target, batch, location, id_type)
+        except ValueError:
+            logging.warning('no ephemerides for %s available' % target)
+            if n_cached == 0:
+                return None
+            break
+
+        # assign returned rows to the nearest requested epochs
+        eph_epochs = np.array(eph['datetime_jd'], dtype=float)
+        if len(eph_epochs) == 0:
+            continue
+        nearest = np.argmin(np.abs(eph_epochs[:, np.newaxis] -
+                                   batch[np.newaxis, :]), axis=1)
+        for row, epoch in zip(eph, batch[nearest]):
+            if abs(float(row['datetime_jd'])-epoch) > 1e-5:
+                continue
+            queried[0].append(epoch)
+            queried[1].append(str(row['targetname']))
+            queried[2].append(float(row['RA']))
+            queried[3].append(float(row['DEC']))
+
+    if len(queried[0]) > 0:
+        if cache is not None:
+            cache.put(key, *queried)
+        # epochs are unique, as are the queried epochs
+        lookup = dict(zip(queried[0], range(len(queried[0]))))
+        for i, epoch in enumerate(epochs):
+            if epoch in lookup:
+                j = lookup[epoch]
+                names[i] = queried[1][j]
+                ra[i], dec[i] = queried[2][j], queried[3][j]
+
+    logging.info(('ephemerides for %s: %d epochs from cache, %d queried, '
+                  '%d not available') %
+                  (target, n_cached, len(queried[0]),
+                   np.sum(np.isnan(ra))))
+
+    return Table([epochs, names.astype(str), ra, dec],
+                 names=['epoch', 'targetname', 'RA', 'DEC'])
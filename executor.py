@@ -0,0 +1,209 @@
+""" EXECUTOR - persistent worker pool shared by all pipeline tasks
+    v1.0: 2026-10-18
+"""
+from __future__ import print_function
+
+# Photometry Pipeline
+# Copyright (C) 2016-2018  Michael Mommert, mommermiscience@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import atexit
+import logging
+import functools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from astropy.io import fits
+
+# pipeline-specific modules
+import _pp_conf
+from pp_setup import conf
+
+# setup logging
+logging.basicConfig(filename=_pp_conf.log_filename,
+                    level=_pp_conf.log_level,
+                    format=_pp_conf.log_formatline,
+                    datefmt=_pp_conf.log_datefmt)
+
+
+def available_memory():
+    """return available system memory in bytes or None if it cannot be
+    determined"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def frame_memory(filename):
+    """estimate the memory footprint (bytes) of processing FITS file
+    `filename` based on the image dimensions in all its headers"""
+    size = 0
+    try:
+        hdulist = fits.open(filename, ignore_missing_end=True,
+                            memmap=True)
+        for hdu in hdulist:
+            header = hdu.header
+            naxis = header.get('NAXIS', 0)
+            if naxis == 0:
+                continue
+            npix = 1
+            for i in range(1, naxis+1):
+                npix *= header.get('NAXIS%d' % i, 0)
+            size += npix*abs(header.get('BITPIX', 32))//8
+        hdulist.close()
+    except (IOError, OSError):
+        size = os.path.getsize(filename)
+    return int(size*conf.frame_memory_factor)
+
+
+class PipelineExecutor(object):
+    """persistent process pool with a bounded number of workers and a
+    memory-aware admission policy: tasks are only submitted if their
+    memory estimate fits into the memory budget together with all
+    tasks that are currently running"""
+
+    def __init__(self, n_workers=None, memory_limit=None):
+        """
+        :param n_workers: number of worker processes (default: number of
+                          cpus)
+        :param memory_limit: memory budget (bytes) for all running tasks
+                             (default: fraction of available memory as
+                             defined in pp_setup)
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = max(1, int(n_workers))
+
+        if memory_limit is None:
+            memory = available_memory()
+            if memory is not None:
+                memory_limit = memory*conf.worker_memory_fraction
+        self.memory_limit = memory_limit
+
+        self._pool = None
+
+    @property
+    def pool(self):
+        """the underlying worker pool; started on first use"""
+        if self._pool is None:
+            logging.info('start executor with %d workers (memory limit: %s '
+                         'bytes)' % (self.n_workers, str(self.memory_limit)))
+            self._pool = ProcessPoolExecutor(max_workers=self.n_workers)
+        return self._pool
+
+    def submit(self, func, *args, **kwargs):
+        """submit a single task; returns a future"""
+        return self.pool.submit(func, *args, **kwargs)
+
+    def map(self, func, items, sizes=None):
+        """apply `func` to all `items` in parallel and return results in
+        the same order as `items`
+
+        :param func: picklable function
+        :param items: list of arguments to `func`
+        :param sizes: list of memory estimates (bytes) for each item; if
+                      provided, tasks are admitted such that the sum of
+                      estimates of running tasks stays within the
+                      memory budget; at least one task is always
+                      running
+        """
+        items = list(items)
+        if sizes is None or self.memory_limit is None:
+            return list(self.pool.map(func, items))
+
+        results = [None]*len(items)
+        for idx, result in self.imap_unordered(func, items, sizes):
+            results[idx] = result
+        return results
+
+    def imap_unordered(self, func, items, sizes=None):
+        """apply `func` to all `items` in parallel; yields (index,
+        result) tuples as soon as each task finishes, where index
+        refers to the position in `items`; see map for `sizes`"""
+        items = list(items)
+        if sizes is None or self.memory_limit is None:
+            sizes = [0]*len(items)
+            memory_limit = 0
+        else:
+            memory_limit = self.memory_limit
+
+        running = {}
+        inflight = 0
+        queue = list(range(len(items)))
+
+        while len(queue) > 0 or len(running) > 0:
+            # admit as many tasks as the budget allows
+            while (len(queue) > 0 and len(running) < self.n_workers and
+                   (len(running) == 0 or
+                    inflight + sizes[queue[0]] <= memory_limit)):
+                idx = queue.pop(0)
+                running[self.pool.submit(func, items[idx])] = idx
+                inflight += sizes[idx]
+
+            done, _ = wait(list(running.keys()),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = running.pop(future)
+                inflight -= sizes[idx]
+                yield idx, future.result()
+
+    def shutdown(self, wait=True):
+        """shut down worker processes"""
+        if self._pool is not None:
+            logging.info('shut down executor')
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+_executor = None
+
+
+def get_executor():
+    """return the pipeline-wide executor; it is created on first use"""
+    global _executor
+    if _executor is None:
+        _executor = PipelineExecutor(n_workers=conf.n_workers)
+    return _executor
+
+
+def shutdown_executor():
+    """shut down the pipeline-wide executor, if it is running"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def shutdown_after(func):
+    """decorator: shut down the pipeline-wide executor once `func`
+    returns or raises"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            shutdown_executor()
+    return wrapper
+
+
+atexit.register(shutdown_executor)
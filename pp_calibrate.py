@@ -5,6 +5,7 @@ from toolbox import *
 from catalog import *
 from diagnostics import calibration as diag
 from pp_setup import confcalibrate as conf
+from executor import get_executor
 import _pp_conf
 """ PP_CALIBRATE - match image databases against photometry catalogs
                    and derive magnitude zeropoint
@@ -29,14 +30,17 @@ import _pp_conf
 # <http://www.gnu.org/licenses/>.
 
 
-from copy import deepcopy
+import os
 import sys
 import numpy as np
 import argparse
 import logging
 from astropy.io import fits
-from scipy.optimize import minimize
-from astropy.table import join
+from astropy.table import vstack
+from astropy.table.np_utils import TableMergeError
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+from concurrent.futures import ThreadPoolExecutor
 
 # only import if Python3 is used
 if sys.version_info > (3, 0):
@@ -54,22 +58,78 @@ logging.basicConfig(filename=_pp_conf.log_filename,
 # photometric fitting routines
 
 
-def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
-                             preferred_catalogs,
-                             min_sources=_pp_conf.min_sources_photometric_catalog,
-                             max_sources=1e4, mag_accuracy=0.1,
-                             solar=False, use_all_stars=False,
-                             display=False):
-    """create a photometric catalog of the field of view"""
+def download_catalogs(ra_deg, dec_deg, rad_deg, catalognames, max_sources,
+                      use_all_stars=False, display=False, prefetch=False):
+    """download photometric catalogs; yields (catalogname, catalog,
+    number of sources) in the order of `catalognames`; with
+    `prefetch`, all downloads are issued concurrently in a thread
+    pool; when the generator is closed, downloads that have not started
+    yet are cancelled and running downloads are waited for (they fill
+    the catalog cache), so that no download threads are left"""
 
-    for catalogname in preferred_catalogs:
+    def download(catalogname):
         cat = catalog(catalogname, display)
-
-        # load catalog
         n_sources = cat.download_catalog(ra_deg, dec_deg, rad_deg,
                                          max_sources,
                                          use_all_stars=use_all_stars,
                                          save_catalog=True)
+        return catalogname, cat, n_sources
+
+    if not prefetch or len(catalognames) < 2:
+        for catalogname in catalognames:
+            yield download(catalogname)
+        return
+
+    n_workers = conf.prefetch_workers or len(catalognames)
+    logging.info('prefetch photometric catalogs: %s' %
+                 ', '.join(catalognames))
+    pool = ThreadPoolExecutor(max_workers=n_workers)
+    futures = [pool.submit(download, catalogname)
+               for catalogname in catalognames]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
+                             preferred_catalogs,
+                             min_sources=_pp_conf.min_sources_photometric_catalog,
+                             max_sources=1e4, mag_accuracy=0.1,
+                             solar=False, use_all_stars=False,
+                             display=False, prefetch=False):
+    """create a photometric catalog of the field of view; with
+    `prefetch`, all preferred catalogs are downloaded concurrently and
+    pending downloads are cancelled once a catalog is accepted; returns
+    after all running downloads have finished"""
+
+    downloads = download_catalogs(ra_deg, dec_deg, rad_deg,
+                                  preferred_catalogs, max_sources,
+                                  use_all_stars=use_all_stars,
+                                  display=display, prefetch=prefetch)
+    try:
+        return select_photometrycatalog(downloads, filtername,
+                                        min_sources=min_sources,
+                                        mag_accuracy=mag_accuracy,
+                                        solar=solar,
+                                        use_all_stars=use_all_stars,
+                                        display=display)
+    finally:
+        downloads.close()
+
+
+def select_photometrycatalog(downloads, filtername, min_sources,
+                             mag_accuracy=0.1, solar=False,
+                             use_all_stars=False, display=False):
+    """select the first catalog from `downloads` (see
+    download_catalogs) that provides at least `min_sources` sources
+    in `filtername` (transformed, if necessary); returns catalog or
+    None"""
+
+    for catalogname, cat, n_sources in downloads:
 
         if display:
             print(n_sources, 'sources downloaded from', catalogname)
@@ -93,49 +153,49 @@ def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
             if ('SDSS' in cat.catalogname or
                     'APASS' in cat.catalogname):
                 n_rejected += cat.reject_sources_with(
-                    (cat['gmag']-cat['rmag']) < sol_gr-_pp_conf.solcol)
+                    lambda d: d['gmag']-d['rmag'] < sol_gr-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['gmag']-cat['rmag']) > sol_gr+_pp_conf.solcol)
+                    lambda d: d['gmag']-d['rmag'] > sol_gr+_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['rmag']-cat['imag']) < sol_ri-_pp_conf.solcol)
+                    lambda d: d['rmag']-d['imag'] < sol_ri-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['rmag']-cat['imag']) > sol_ri+_pp_conf.solcol)
+                    lambda d: d['rmag']-d['imag'] > sol_ri+_pp_conf.solcol)
             elif 'SkyMapper' in cat.catalogname:
                 cat.transform_filters('g')  # derive Sloan griz
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) < sol_gr-_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] < sol_gr-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) > sol_gr+_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] > sol_gr+_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) < sol_ri-_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] < sol_ri-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) > sol_ri+_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] > sol_ri+_pp_conf.solcol)
             elif 'PANSTARRS' in cat.catalogname:
                 cat.transform_filters('g')
                 # derive Sloan griz
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) < sol_gr-_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] < sol_gr-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) > sol_gr+_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] > sol_gr+_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) < sol_ri-_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] < sol_ri-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) > sol_ri+_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] > sol_ri+_pp_conf.solcol)
             elif 'GAIA' in cat.catalogname:
                 cat.transform_filters('g')  # derive Sloan gri
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) < sol_gr-_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] < sol_gr-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_gmag']-cat['_rmag']) > sol_gr+_pp_conf.solcol)
+                    lambda d: d['_gmag']-d['_rmag'] > sol_gr+_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) < sol_ri-_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] < sol_ri-_pp_conf.solcol)
                 n_rejected += cat.reject_sources_with(
-                    (cat['_rmag']-cat['_imag']) > sol_ri+_pp_conf.solcol)
+                    lambda d: d['_rmag']-d['_imag'] > sol_ri+_pp_conf.solcol)
             elif '2MASS' in cat.catalogname:
                 # derive UKIRT ZJHK (Casagrande et al. 2012)
                 cat.transform_filters('K')
                 n_rejected += cat.reject_sources_with(
-                    (cat['_Jmag']-cat['_Hmag']) < sol_JH-_pp_conf.solcol)
+                    lambda d: d['_Jmag']-d['_Hmag'] < sol_JH-_pp_conf.solcol)
             else:
                 if display:
                     print('Warning: solar colors not supported for catalog',
@@ -178,7 +238,7 @@ def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
                     cat.catalogname, filtername) +
                     '; refer to LOG file for details'))
             n_transformed -= cat.reject_sources_with(
-                cat['_e_'+filtername+'mag'] > mag_accuracy)
+                lambda d: d['_e_'+filtername+'mag'] > mag_accuracy)
 
             if display and n_transformed > 0:
                 print('%s transformed to %s-band: %d sources' %
@@ -193,9 +253,9 @@ def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
             logging.info('rejecting sources with no magnitude information')
 
             n_sources = n_sources - cat.reject_sources_with(
-                np.isnan(cat[filtername+'mag'])) \
+                lambda d: np.isnan(d[filtername+'mag'])) \
                 - cat.reject_sources_with(
-                cat['e_'+filtername+'mag'] > mag_accuracy)
+                lambda d: d['e_'+filtername+'mag'] > mag_accuracy)
 
             if display:
                 logging.info('%d sources with accurate magnitudes in %s band' %
@@ -221,246 +281,876 @@ def create_photometrycatalog(ra_deg, dec_deg, rad_deg, filtername,
     return None
 
 
-def derive_zeropoints(ref_cat, catalogs, filtername, minstars_external,
-                      use_all_stars=False,
-                      display=False, diagnostics=False):
-    """derive zeropoint for a number of catalogs based on a reference catalog"""
+def derive_clipping_steps(residuals, residuals_sig):
+    """
+    iterative clipping of zeropoint residuals: the zeropoint (weighted
+    mean of the residuals) is derived and the most significant outliers
+    are rejected (one per 50 stars) until fewer than 3 stars are left
+
+    as outliers are always rejected from either end of the sorted
+    residuals, the remaining stars form a contiguous range of sorted
+    residuals and every clipping step is derived from cumulative sums
+
+    input: residuals (reference - instrumental magnitudes), squared
+           uncertainties of residuals
+    return: list of clipping steps [zeropoint, sigma, reduced chi2,
+            indices of remaining stars]
+    """
+    residuals = np.asarray(residuals, dtype=float)
+    residuals_sig = np.asarray(residuals_sig, dtype=float)
+
+    order = np.argsort(residuals, kind='stable')
+    # subtract median to avoid numerical cancellation in chi2
+    offset = np.median(residuals)
+    shifted = residuals[order]-offset
+    weights = 1/residuals_sig[order]
+
+    def cumsum(x): return np.concatenate([[0], np.cumsum(x)])
+    sum_w = cumsum(weights)
+    sum_wr = cumsum(weights*shifted)
+    sum_wrr = cumsum(weights*shifted**2)
+    sum_sig = cumsum(residuals_sig[order])
+
+    clipping_steps = []
+    lo, hi = 0, len(residuals)  # remaining stars: order[lo:hi]
+    while hi-lo >= 3:
+        n = hi-lo
+        w = sum_w[hi]-sum_w[lo]
+        wr = sum_wr[hi]-sum_wr[lo]
+        mean = wr/w
+        # chi2 at its minimum, the weighted mean
+        chi2 = max(sum_wrr[hi]-sum_wrr[lo]-mean*wr, 0)
+        # reduced chi2: chi2/(N-observations-N_fit_variables-1)
+        red_chi2 = chi2/(n-2)
+        # weighted std + rms of individual sigmas
+        # residuals_sig is already squared!
+        sigma = np.sqrt(chi2/w + (sum_sig[hi]-sum_sig[lo])/n)
+
+        clipping_steps.append([offset+mean, sigma, red_chi2,
+                               np.sort(order[lo:hi])])
+
+        # identify most significant outliers (not weighted) and remove them
+        for repeat in range(max([1, int(n/50)])):
+            lo_dist, hi_dist = mean-shifted[lo], shifted[hi-1]-mean
+            if (hi_dist > lo_dist or
+                    (hi_dist == lo_dist and order[hi-1] < order[lo])):
+                hi -= 1
+            else:
+                lo += 1
+
+    return clipping_steps
+
+
+def reference_keys(ref_cat, filtername):
+    """names of the magnitude and uncertainty fields in ref_cat"""
+    filterkey = filtername+'mag' if filtername+'mag' \
+        in ref_cat.fields else '_'+filtername+'mag'
+    efilterkey = 'e_'+filtername+'mag' if 'e_'+filtername+'mag' \
+                 in ref_cat.fields else '_e_'+filtername+'mag'
+    return filterkey, efilterkey
+
+
+def match_reference(ref_cat, cat, filtername):
+    """match a catalog with a reference catalog (requires an `idx` field
+    in ref_cat); returns catalog and match array"""
+
+    logging.info('derive zeropoint for catalog: %s based on %s' %
+                 (" | ".join([cat.catalogname, cat.origin, cat.history]),
+                  " | ".join([ref_cat.catalogname, ref_cat.origin,
+                              ref_cat.history])))
+
+    filterkey, efilterkey = reference_keys(ref_cat, filtername)
+
+    # reject sources with MAG_APER/MAGERR_APER = 99 or nan
+
+    # read this: if there is a
+    # ValueError: boolean index array should have 1 dimension
+    # or
+    # IndexError: too many indices for array
+    # pointing here, the problem is that pp_extract has not been
+    # properly run using a single aperture
+    # currently it seems like pp_photometry (maybe callhorizons)
+    # has not finished properly
+
+    cat.reject_sources_other_than(
+        lambda d: d['MAG_'+_pp_conf.photmode] != 99)
+    cat.reject_sources_other_than(
+        lambda d: d['MAGERR_'+_pp_conf.photmode] != 99)
+    cat.reject_sources_with(
+        lambda d: np.isnan(d['MAG_'+_pp_conf.photmode]))
+    cat.reject_sources_with(
+        lambda d: np.isnan(d['MAGERR_'+_pp_conf.photmode]))
+
+    # add idx column to catalog (see derive_zeropoints for ref_cat)
+    if 'idx' not in cat.fields:
+        cat.add_field('idx', list(range(cat.shape[0])),
+                      field_type=int)
+
+    match = ref_cat.match_with(
+        cat,
+        match_keys_this_catalog=[
+            'ra_deg', 'dec_deg'],
+        match_keys_other_catalog=[
+            'ra_deg', 'dec_deg'],
+        extract_this_catalog=[filterkey,
+                              efilterkey,
+                              'ident',
+                              'ra_deg',
+                              'dec_deg',
+                              'idx'],
+        extract_other_catalog=['MAG_'+_pp_conf.photmode,
+                               'MAGERR_' +
+                               _pp_conf.photmode,
+                               'idx'],
+        tolerance=_pp_conf.pos_epsilon/3600.)
+
+    logging.info('{:d} sources matched within {:.2f} arcsec'.format(
+        len(match[0][0]), _pp_conf.pos_epsilon))
+
+    # artificially blow up incredibly small ref_cat uncertainties
+    for i in np.where(match[0][1] < 0.01):
+        match[0][1][i] = 0.01
+
+    return cat, match
+
+
+def calibration_data(ref_cat, cat, match, usedstars):
+    """reference catalog data and instrumental magnitudes of the stars
+    in `match`; column `fit` indicates whether a star has been used to
+    derive the zeropoint (indices `usedstars`); returns Table"""
+    matched_ref_cat = ref_cat[match[0][5].data]
+    # build `fit` column that indicates whether star is used in fit
+    used_in_fit = np.zeros(len(matched_ref_cat), dtype=int)
+    used_in_fit[usedstars] = 1
+    matched_ref_cat.add_column(Column(used_in_fit, 'fit'))
+    matched_ref_cat.remove_column('idx')
+    # add instrumental magnitudes
+    matched_ref_cat.add_column(
+        cat['MAG_'+_pp_conf.photmode][match[1][2]])
+    matched_ref_cat.add_column(
+        cat['MAGERR_'+_pp_conf.photmode][match[1][2]])
+
+    if conf.save_caldata_usedonly:
+        matched_ref_cat = matched_ref_cat[used_in_fit == 1]
+
+    return matched_ref_cat
+
+
+class CalibrationArchive(object):
+    """
+    calibration data (see calibration_data) of all frames in a single
+    FITS file; rows are appended in place to binary table extension
+    CALDATA as frames are calibrated; column `frame` holds the catalog
+    name, column `block` the archive row at which the rows of this
+    frame start; if a frame has been calibrated more than once, only
+    its latest rows are used; if the calibration data of a frame do
+    not fit into the table (additional columns or longer strings), the
+    table is rewritten with all existing rows
+    """
 
-    output = {'filtername': filtername, 'minstars': minstars_external,
-              'zeropoints': [], 'clipping_steps': []}
+    extname = 'CALDATA'
 
-    # match catalogs based on coordinates
-    for cat in catalogs:
+    def __init__(self, filename):
+        self.filename = filename
+        # structure and file size after the last append
+        self._appended = None
 
-        logging.info('derive zeropoint for catalog: %s based on %s' %
-                     (" | ".join([cat.catalogname, cat.origin, cat.history]),
-                      " | ".join([ref_cat.catalogname, ref_cat.origin,
-                                  ref_cat.history])))
+    def _structure(self, cached=False):
+        """header, file information, and record dtype of CALDATA, or
+        None if the archive does not exist or cannot be appended to;
+        if `cached`, the structure after the last append is used unless
+        the file size has changed since"""
+        if not os.path.exists(self.filename):
+            return None
+        if (cached and self._appended is not None and
+                os.path.getsize(self.filename) == self._appended[1]):
+            return self._appended[0]
+        try:
+            with fits.open(self.filename) as hdulist:
+                hdu = hdulist[-1]
+                if (len(hdulist) < 2 or hdu.name != self.extname or
+                        hdu.header['PCOUNT'] != 0):
+                    return None
+                # FITS records are big-endian
+                dtype = np.dtype([(name, hdu.columns.dtype[name].newbyteorder(
+                    '>')) for name in hdu.columns.dtype.names])
+                if dtype.itemsize != hdu.header['NAXIS1']:
+                    return None
+                return (hdu.header.copy(),
+                        hdulist.fileinfo(len(hdulist)-1), dtype)
+        except OSError:
+            return None
 
-        if display:
-            print('zeropoint for %s:' % cat.catalogname, end=' ')
-
-        filterkey = filtername+'mag' if filtername+'mag' \
-            in ref_cat.fields else '_'+filtername+'mag'
-        efilterkey = 'e_'+filtername+'mag' if 'e_'+filtername+'mag' \
-                     in ref_cat.fields else '_e_'+filtername+'mag'
-
-        # reject sources with MAG_APER/MAGERR_APER = 99 or nan
-
-        # read this: if there is a
-        # ValueError: boolean index array should have 1 dimension
-        # or
-        # IndexError: too many indices for array
-        # pointing here, the problem is that pp_extract has not been
-        # properly run using a single aperture
-        # currently it seems like pp_photometry (maybe callhorizons)
-        # has not finished properly
-
-        cat.reject_sources_other_than(cat.data['MAG_'+_pp_conf.photmode] != 99)
-        cat.reject_sources_other_than(cat.data['MAGERR_'
-                                               + _pp_conf.photmode] != 99)
-        cat.reject_sources_with(np.isnan(
-            cat.data['MAG_'+_pp_conf.photmode]))
-        cat.reject_sources_with(np.isnan(cat.data['MAGERR_' +
-                                                  _pp_conf.photmode]))
-
-        # add idx columns to both catalogs
-        if 'idx' not in ref_cat.fields:
-            ref_cat.add_field('idx',
-                              list(range(ref_cat.shape[0])),
-                              field_type=np.int)
-        if 'idx' not in cat.fields:
-            cat.add_field('idx', list(range(cat.shape[0])),
-                          field_type=np.int)
-
-        match = ref_cat.match_with(
-            cat,
-            match_keys_this_catalog=[
-                'ra_deg', 'dec_deg'],
-            match_keys_other_catalog=[
-                'ra_deg', 'dec_deg'],
-            extract_this_catalog=[filterkey,
-                                  efilterkey,
-                                  'ident',
-                                  'ra_deg',
-                                  'dec_deg',
-                                  'idx'],
-            extract_other_catalog=['MAG_'+_pp_conf.photmode,
-                                   'MAGERR_' +
-                                   _pp_conf.photmode,
-                                   'idx'],
-            tolerance=_pp_conf.pos_epsilon/3600.)
-
-        logging.info('{:d} sources matched within {:.2f} arcsec'.format(
-            len(match[0][0]), _pp_conf.pos_epsilon))
-
-        # artificially blow up incredibly small ref_cat uncertainties
-        for i in np.where(match[0][1] < 0.01):
-            match[0][1][i] = 0.01
-
-        residuals = match[0][0]-match[1][0]  # ref - instr
-        residuals_sig = match[0][1]**2+match[1][1]**2
-        m_idc = list(range(len(match[0][0])))
-
-        clipping_steps = []
-        #  [zeropoint, sigma, chi2, source indices in match array, match]
-
-        # fewer than 3 reference stars -> skip this catalog
-        if len(residuals) < 3:
-            if display:
-                print(('Warning: {:d} stars left after source matching '
-                       'for frame {:s}; report instrumental magnitudes').
-                      format(len(residuals), cat.catalogname))
-                logging.warning(
-                    ('Warning: {:d} stars left after source matching '
-                     'for frame {:s}; report instrumental magnitudes').
-                    format(len(residuals), cat.catalogname))
-                clipping_steps = [[0, 0, 1e-10, [], [[], []]]]
-
-                output['zeropoints'].append({'filename': cat.catalogname,
-                                             'zp': np.nan,
-                                             'zp_sig': np.nan,
-                                             'zp_nstars': 0,
-                                             'zp_usedstars': 0,
-                                             'obstime': cat.obstime,
-                                             'match': match,
-                                             'clipping_steps': clipping_steps,
-                                             'zp_idx': np.nan,
-                                             'success': False})
+    @staticmethod
+    def _filled(column):
+        """`column` with masked values filled (NaN for floats, the
+        default fill value otherwise); booleans and unsigned integers
+        are converted to integers"""
+        if isinstance(column, MaskedColumn):
+            column = column.filled(np.nan if column.dtype.kind == 'f'
+                                   else None)
+        if column.dtype.kind in 'bu':
+            column = column.astype(int)
+        return column
+
+    @staticmethod
+    def _records(table, dtype):
+        """FITS records of `table` with record dtype `dtype`, or None if
+        the columns of `table` do not fit the records; fields that are
+        not in `table` are filled (see _filled)"""
+        if not set(table.colnames) <= set(dtype.names):
+            return None
+        records = np.zeros(len(table), dtype=dtype)
+        for name in dtype.names:
+            field = dtype[name]
+            if name not in table.colnames:
+                records[name] = (np.nan if field.kind == 'f' else
+                                 np.ma.default_fill_value(field))
                 continue
+            values = np.asarray(table[name])
+            if field.kind == 'S' and values.dtype.kind in 'US':
+                if values.dtype.kind == 'U':
+                    values = np.char.encode(values, 'ascii')
+                if values.dtype.itemsize > field.itemsize:
+                    return None
+            elif (field.kind != values.dtype.kind or
+                  field.itemsize != values.dtype.itemsize):
+                return None
+            records[name] = values
+        return records
+
+    def append(self, frame, data):
+        """
+        append calibration data of a frame; a new archive is created if
+        the file does not exist; the archive is rewritten (keeping all
+        rows) if `data` do not fit into its table
+        input: catalog name, calibration data Table
+        return: number of rows written
+        """
+        existing = self._structure(cached=True)
+        block = existing[0]['NAXIS2'] if existing is not None else 0
+
+        # masked values are stored as NaN (floats) or fill values;
+        # booleans and unsigned integers as integers
+        columns = [Column(np.full(len(data), frame), 'frame'),
+                   Column(np.full(len(data), block, dtype=int), 'block')]
+        columns += [self._filled(column) for column in data.itercols()]
+        table = Table(columns, copy=False)
+
+        records = None
+        if existing is not None:
+            records = self._records(table, existing[2])
+        if records is None:
+            self._write(table)
+            return len(data)
+
+        # rows are written first; NAXIS2 is updated once they are on disk
+        header, info, dtype = existing
+        end = info['datLoc'] + header['NAXIS1']*header['NAXIS2']
+        size = end + records.nbytes - info['hdrLoc']
+        with open(self.filename, 'r+b') as f:
+            f.seek(end)
+            f.write(records.tobytes())
+            f.write(b'\0'*(-size % 2880))
+            f.truncate()
+            f.flush()
+            f.seek(info['hdrLoc'])
+            cards = f.read(info['datLoc']-info['hdrLoc'])
+            position = [cards[i:i+8] for i in range(0, len(cards), 80)].index(
+                b'NAXIS2  ')*80
+            f.seek(info['hdrLoc']+position)
+            f.write(fits.Card('NAXIS2', header['NAXIS2']+len(data)
+                              ).image.encode('ascii'))
+
+        header['NAXIS2'] += len(data)
+        self._appended = ((header, info, dtype),
+                          os.path.getsize(self.filename))
+
+        return len(data)
+
+    def _write(self, table):
+        """write a new archive with the rows of the existing archive
+        (if any) followed by `table`; columns that are missing in either
+        are filled (see _filled), string columns are widened; raises
+        ValueError if columns of the same name have incompatible types"""
+        records, header = self._records_memmap()
+        if records is not None and len(records) > 0:
+            logging.info(('rewrite calibration archive {:s} with {:d} '
+                          'rows to add columns {:s}').format(
+                              self.filename, len(records),
+                              ', '.join(table.colnames)))
+            existing = self._table(records, header)
+            del records
+            try:
+                table = vstack([existing, table], join_type='outer',
+                               metadata_conflicts='silent')
+            except TableMergeError as error:
+                raise ValueError(
+                    ('calibration data do not fit into calibration '
+                     'archive {:s} ({:s}); use a different '
+                     'save_caldata_archive').format(self.filename,
+                                                    str(error)))
+            table = Table([self._filled(column)
+                           for column in table.itercols()], copy=False)
+
+        # frame names of later appends are expected to be similar
+        table.replace_column('frame', Column(
+            table['frame'], dtype='U%d' % max(
+                64, np.char.str_len(np.asarray(table['frame'],
+                                               dtype=str)).max())))
+        hdu = fits.table_to_hdu(table)
+        hdu.header['EXTNAME'] = self.extname
+
+        # the archive is replaced once the new file is complete
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(
+            self.filename+'.tmp', overwrite=True)
+        os.replace(self.filename+'.tmp', self.filename)
+        self._appended = None
+
+    @staticmethod
+    def _table(records, header):
+        """Table of CALDATA `records` with units from `header`"""
+        data = Table(records.astype(records.dtype.newbyteorder('=')))
+        data.convert_bytestring_to_unicode()
+        for i, name in enumerate(data.colnames):
+            if 'TUNIT%d' % (i+1) in header:
+                data[name].unit = header['TUNIT%d' % (i+1)]
+        return data
+
+    def _records_memmap(self):
+        """memory-mapped CALDATA records and header (None, None if the
+        archive does not exist)"""
+        existing = self._structure()
+        if existing is None:
+            return None, None
+        header, info, dtype = existing
+        if header['NAXIS2'] == 0:
+            return np.zeros(0, dtype=dtype), header
+        return np.memmap(self.filename, dtype=dtype, mode='r',
+                         offset=info['datLoc'],
+                         shape=(header['NAXIS2'],)), header
+
+    def read(self, frame=None, ident=None):
+        """
+        read calibration data (latest rows of each frame) from archive;
+        only the selected rows are read from disk
+        input: catalog name (None: all frames), reference star identifier
+               (None: all stars)
+        return: Table or None if the archive does not exist
+        """
+        records, header = self._records_memmap()
+        if records is None:
+            return None
 
-        # if minstars is a fraction, use minstars*len(match[0][0])
-        if minstars_external < 1:
-            minstars = int(minstars_external*len(match[0][0]))
-        else:
-            minstars = int(minstars_external)
-
-        # max 100 minstars
-        if minstars > 100:
-            minstars = 100
-
-        # perform clipping to reject one outlier at a time
-        zeropoint = 25  # initialize zeropoint
-        popped_idc = []  # list of 'match' indices of rejected stars
-        while len(residuals) >= 3:
-            def fchi2(zp): return np.sum([(zp-residuals)**2/residuals_sig])
-            # fchi2 = lambda zp: np.sum((zp-residuals)**2) # unweighted
-
-            minchi2 = minimize(fchi2, zeropoint, method='Nelder-Mead')
-            red_chi2 = minchi2.fun/(len(residuals)-2)
-            # reduced chi2: chi2/(N-observations-N_fit_variables-1)
-            zeropoint = minchi2.x[0]
-
-            # derive weighted standard deviation
-            var = np.average((residuals-zeropoint)**2,
-                             weights=1/residuals_sig)
-            # sigma = np.sqrt(var/(len(residuals)-1)) # weighted std of mean
-            # weighted std + rms of individual sigmas
-            # residuals_sig is already squared!
-            sigma = np.sqrt(var + np.mean(residuals_sig))
-            # sigma = np.std(residuals-zeropoint)
-
-            clipping_steps.append([zeropoint, sigma, red_chi2, m_idc,
-                                   match])
-
-            # identify most significant outliers (not weighted) and remove them
-            for repeat in range(max([1, int(len(residuals)/50)])):
-                popidx = np.argmax(np.absolute(residuals
-                                               - zeropoint))
-                residuals = np.delete(residuals, popidx)
-                residuals_sig = np.delete(residuals_sig, popidx)
-                popped_idc.append(m_idc[popidx])
-                m_idc = np.delete(m_idc, popidx)
-
-        # select best-fit zeropoint based on minimum chi2
-        idx = np.nanargmin([step[2] for step in clipping_steps])
-        # # select best-fit zeropoint based on minimum sigma
-        # idx = np.nanargmin([step[1] for step in clipping_steps])
-
-        # reduce/increase idx to increase the number of sources until
-        # minstars is met
-        if len(clipping_steps[idx][3]) < minstars:
-            while len(clipping_steps[idx][3]) < minstars and idx > 0:
-                idx -= 1
-        else:
-            while len(clipping_steps[idx][3]) < minstars and idx > 0:
-                idx += 1
-
-        output['zeropoints'].append({'filename': cat.catalogname,
-                                     'zp': clipping_steps[idx][0],
-                                     'zp_sig': clipping_steps[idx][1],
-                                     'zp_nstars': len(clipping_steps[idx][3]),
-                                     'zp_usedstars': clipping_steps[idx][3],
-                                     'obstime': cat.obstime,
-                                     'match': match,
-                                     'clipping_steps': clipping_steps,
-                                     'zp_idx': idx,
-                                     'success': True})
+        index = self._index(records)
+        if frame is not None:
+            index = {frame: index[frame]} if frame in index else {}
+        rows = np.concatenate([np.arange(start, stop, dtype=int) for
+                               start, stop in index.values()] +
+                              [np.array([], dtype=int)])
+        if ident is not None:
+            idents = records['ident'][rows]
+            if idents.dtype.kind == 'S' and isinstance(ident, str):
+                ident = ident.encode('ascii')
+            rows = rows[idents == ident]
+
+        return self._table(records[rows], header)
+
+    def index(self):
+        """
+        rows of the latest calibration data of each frame
+        return: dictionary {catalog name: (first row, last row + 1)}
+        """
+        records, header = self._records_memmap()
+        if records is None:
+            return {}
+        return self._index(records)
+
+    @staticmethod
+    def _index(records):
+        """see index; `records` are the CALDATA records"""
+        blocks = records['block']
+        starts = np.flatnonzero(np.diff(blocks, prepend=-1) != 0)
+        stops = np.append(starts[1:], len(blocks))
+        frames = records['frame'][starts]
+
+        # later rows of a frame replace earlier rows
+        return dict((frame.decode('ascii'), (start, stop))
+                    for frame, start, stop in zip(frames, starts, stops))
+
+
+def apply_zeropoint(ref_cat, cat, filtername, match, zp, zp_sig,
+                    usedstars):
+    """write calibration data and add calibrated magnitudes to a
+    catalog; `usedstars` are the indices of the stars in `match` that
+    have been used to derive zeropoint `zp` and its uncertainty `zp_sig`;
+    returns calibrated catalog"""
+
+    filterkey, efilterkey = reference_keys(ref_cat, filtername)
+
+    # write calibration catalog to file; the calibration archive is
+    # written by derive_zeropoints
+    if conf.save_caldata and conf.save_caldata_mode == 'frame':
+        caldata_filename = cat.catalogname[:-5]+conf.save_caldata_suffix
+        calibration_data(ref_cat, cat, match, usedstars).write(
+            caldata_filename, format=conf.save_caldata_format,
+            overwrite=True)
+
+    # append calibrated magnitudes to catalog
+    if filterkey[0] != '_':
+        filterkey = '_' + filterkey
+        efilterkey = '_' + efilterkey
+
+    # add calibration data to catalog, so that it ends up in database
+    if conf.caldata_in_db:
+        # ref_cat rows are joined on an `idx` that points to cat
+        cat_idc = np.ones(ref_cat.shape[0], dtype=int)*-1
+        cat_idc[np.array(match[0][5], dtype=int)] = match[1][2]
+        cat.data = join_left(cat.data, ref_cat.data, 'idx', cat_idc)
+        # remove unnecessary fields
+        cat.data.remove_columns(['idx', 'ra_deg_2', 'dec_deg_2'])
+        cat.data.rename_column('ra_deg_1', 'ra_deg')
+        cat.data.rename_column('dec_deg_1', 'dec_deg')
+
+    # remove columns for filterkey for matched sources
+    if filterkey in cat.fields:
+        cat.data.remove_column(filterkey)
+        cat.data.remove_column(efilterkey)
+
+    cat.add_fields([filterkey, efilterkey],
+                   [cat['MAG_'+_pp_conf.photmode] + zp,
+                    np.sqrt(cat['MAGERR_'+_pp_conf.photmode]**2 +
+                            zp_sig**2)],
+                   ['F', 'F'])
+
+    # add ref_cat identifier to catalog
+    cat.origin = cat.origin.strip() + ";" + ref_cat.catalogname + ";"\
+        + filtername
+    cat.history += 'calibrated using ' + ref_cat.history
+
+    return cat
+
+
+def derive_zeropoint(ref_cat, cat, filtername, minstars_external,
+                     display=False):
+    """derive zeropoint for a single catalog based on a reference
+    catalog (requires an `idx` field in ref_cat); returns calibrated
+    catalog and zeropoint data (see derive_zeropoints)"""
 
+    if display:
+        print('zeropoint for %s:' % cat.catalogname, end=' ')
+
+    cat, match = match_reference(ref_cat, cat, filtername)
+
+    residuals = match[0][0]-match[1][0]  # ref - instr
+    residuals_sig = match[0][1]**2+match[1][1]**2
+
+    clipping_steps = []
+    #  [zeropoint, sigma, chi2, source indices in match array, match]
+
+    # fewer than 3 reference stars -> skip this catalog
+    if len(residuals) < 3:
         if display:
-            print('%6.3f+-%.3f (%d/%d reference stars)' %
-                  (clipping_steps[idx][0], clipping_steps[idx][1],
-                   len(clipping_steps[idx][3]), len(clipping_steps[0][3])))
-
-        # write calibration catalog to file
-        if conf.save_caldata:
-            caldata_filename = cat.catalogname[:-5]+conf.save_caldata_suffix
-            matched_ref_cat = ref_cat[match[0][5].data]
-            # build `fit` column that indicates whether star is used in fit
-            used_in_fit = np.zeros(len(matched_ref_cat), dtype=np.int)
-            used_in_fit[clipping_steps[idx][3]] = 1
-            matched_ref_cat.add_column(Column(used_in_fit, 'fit'))
-            matched_ref_cat.remove_column('idx')
-            # add instrumental magnitudes
-            matched_ref_cat.add_column(
-                cat['MAG_'+_pp_conf.photmode][match[1][2]])
-            matched_ref_cat.add_column(
-                cat['MAGERR_'+_pp_conf.photmode][match[1][2]])
-
-            if conf.save_caldata_usedonly:
-                matched_ref_cat = matched_ref_cat[used_in_fit == 1]
-            matched_ref_cat.write(caldata_filename,
-                                  format=conf.save_caldata_format,
-                                  overwrite=True)
-
-        # append calibrated magnitudes to catalog
-        if filterkey[0] != '_':
-            filterkey = '_' + filterkey
-            efilterkey = '_' + efilterkey
-
-        # add calibration data to catalog, so that it ends up in database
-        if conf.caldata_in_db:
-            db_ref_cat = deepcopy(ref_cat)
-            # replace `idx` column in ref_cat with one that points to cat
-            db_ref_cat.data.remove_column('idx')
-            cat_idc = np.ones(ref_cat.shape[0], dtype=int)*-1
-            for i in range(len(match[0][0])):
-                cat_idc[match[0][5][i]] = match[1][2][i]
-            db_ref_cat.add_field('idx', cat_idc)
-            cat.data = join(cat.data, db_ref_cat.data,
-                            keys='idx',
-                            join_type='left')
-            # remove unnecessary fields
-            cat.data.remove_columns(['idx', 'ra_deg_2', 'dec_deg_2'])
-            cat.data.rename_column('ra_deg_1', 'ra_deg')
-            cat.data.rename_column('dec_deg_1', 'dec_deg')
-
-        # remove columns for filterkey for matched sources
-        if filterkey in cat.fields:
-            cat.data.remove_column(filterkey)
-            cat.data.remove_column(efilterkey)
-
-        cat.add_fields([filterkey, efilterkey],
-                       [cat['MAG_'+_pp_conf.photmode] +
-                        clipping_steps[idx][0],
-                        np.sqrt(cat['MAGERR_'+_pp_conf.photmode]**2 +
-                                clipping_steps[idx][1]**2)],
-                       ['F', 'F'])
-
-        # add ref_cat identifier to catalog
-        cat.origin = cat.origin.strip() + ";" + ref_cat.catalogname + ";"\
-            + filtername
-        cat.history += 'calibrated using ' + ref_cat.history
+            print(('Warning: {:d} stars left after source matching '
+                   'for frame {:s}; report instrumental magnitudes').
+                  format(len(residuals), cat.catalogname))
+            logging.warning(
+                ('Warning: {:d} stars left after source matching '
+                 'for frame {:s}; report instrumental magnitudes').
+                format(len(residuals), cat.catalogname))
+            clipping_steps = [[0, 0, 1e-10, [], [[], []]]]
+
+            return cat, {'filename': cat.catalogname,
+                         'zp': np.nan,
+                         'zp_sig': np.nan,
+                         'zp_nstars': 0,
+                         'zp_usedstars': 0,
+                         'obstime': cat.obstime,
+                         'match': match,
+                         'clipping_steps': clipping_steps,
+                         'zp_idx': np.nan,
+                         'success': False}
+
+    # if minstars is a fraction, use minstars*len(match[0][0])
+    if minstars_external < 1:
+        minstars = int(minstars_external*len(match[0][0]))
+    else:
+        minstars = int(minstars_external)
+
+    # max 100 minstars
+    if minstars > 100:
+        minstars = 100
+
+    # perform clipping to reject one outlier at a time
+    clipping_steps = [step + [match] for step in
+                      derive_clipping_steps(residuals, residuals_sig)]
+
+    # select best-fit zeropoint based on minimum chi2
+    idx = np.nanargmin([step[2] for step in clipping_steps])
+    # # select best-fit zeropoint based on minimum sigma
+    # idx = np.nanargmin([step[1] for step in clipping_steps])
+
+    # reduce/increase idx to increase the number of sources until
+    # minstars is met
+    if len(clipping_steps[idx][3]) < minstars:
+        while len(clipping_steps[idx][3]) < minstars and idx > 0:
+            idx -= 1
+    else:
+        while len(clipping_steps[idx][3]) < minstars and idx > 0:
+            idx += 1
+
+    zeropoint = {'filename': cat.catalogname,
+                 'zp': clipping_steps[idx][0],
+                 'zp_sig': clipping_steps[idx][1],
+                 'zp_nstars': len(clipping_steps[idx][3]),
+                 'zp_usedstars': clipping_steps[idx][3],
+                 'obstime': cat.obstime,
+                 'match': match,
+                 'clipping_steps': clipping_steps,
+                 'zp_idx': idx,
+                 'success': True}
+
+    if display:
+        print('%6.3f+-%.3f (%d/%d reference stars)' %
+              (clipping_steps[idx][0], clipping_steps[idx][1],
+               len(clipping_steps[idx][3]), len(clipping_steps[0][3])))
+
+    if conf.save_caldata and conf.save_caldata_mode == 'archive':
+        zeropoint['caldata'] = calibration_data(ref_cat, cat, match,
+                                                clipping_steps[idx][3])
+
+    cat = apply_zeropoint(ref_cat, cat, filtername, match,
+                          clipping_steps[idx][0], clipping_steps[idx][1],
+                          clipping_steps[idx][3])
+
+    return cat, zeropoint
+
+
+def solve_ensemble_zeropoints(frame_idc, star_idc, residuals, sig_instr,
+                              sig_ref, n_frames, n_stars,
+                              iterations=None, tolerance=1e-4):
+    """
+    solve for all frame zeropoints and per-star magnitude offsets at
+    once: residual (reference - instrumental magnitude) = zeropoint of
+    the frame + offset of the reference star; offsets are constrained
+    by the reference catalog uncertainties; outliers are downweighted
+    in iteratively reweighted least squares (Tukey's biweight)
+
+    input: frame and star index of each observation, residuals,
+           instrumental and reference magnitude uncertainties, number of
+           frames and stars, maximum number of reweighting iterations
+           (>= 1; default: ConfCalibrate.ensemble_iterations), convergence
+           tolerance (mag)
+    return: zeropoints (nan for frames without used stars), star
+            offsets, robust weight of each observation (0: rejected)
+    """
+    if iterations is None:
+        iterations = conf.ensemble_iterations
+    if iterations < 1:
+        raise ValueError('at least one ensemble iteration is required '
+                         '(ensemble_iterations: %s)' % str(iterations))
+    if len(residuals) == 0:
+        return np.full(n_frames, np.nan), np.zeros(n_stars), np.ones(0)
+
+    frame_idc = np.asarray(frame_idc, dtype=int)
+    star_idc = np.asarray(star_idc, dtype=int)
+    residuals = np.asarray(residuals, dtype=float)
+    weights = 1/np.asarray(sig_instr, dtype=float)**2
+    # weights of the offset priors (zero offsets)
+    prior_weights = np.ones(n_stars)
+    prior_weights[star_idc] = 1/np.asarray(sig_ref, dtype=float)**2
+
+    # sparse frame-star coupling matrix with one entry per observation
+    order = np.argsort(frame_idc, kind='stable')
+    indptr = np.concatenate([[0], np.cumsum(
+        np.bincount(frame_idc, minlength=n_frames))])
+
+    def biweight(normalized, valid):
+        """Tukey's biweight of normalized residuals"""
+        scale = 1.4826*np.median(np.abs(normalized[valid]))
+        if not scale > 0:
+            return None
+        u = normalized/(4.685*scale)
+        return np.where(np.abs(u) < 1, (1-u**2)**2, 0)
+
+    # initial weights based on the residuals from the median residual
+    # of each frame, which protects frames with few stars from outliers
+    by_frame = np.lexsort((residuals, frame_idc))
+    first, n_obs = indptr[frame_idc[by_frame]], np.diff(indptr)[
+        frame_idc[by_frame]]
+    medians = np.empty(len(residuals))
+    medians[by_frame] = (residuals[by_frame][first + (n_obs-1)//2] +
+                         residuals[by_frame][first + n_obs//2])/2
+    robust = biweight((residuals-medians) /
+                      np.sqrt(1/weights + np.asarray(sig_ref)**2),
+                      np.ones(len(residuals), dtype=bool))
+    if robust is None:
+        robust = np.ones(len(residuals))
+
+    zeropoints = np.zeros(n_frames)
+    for iteration in range(iterations):
+        w = weights*robust
+
+        # normal equations [[D_f, B], [B^T, D_s]] (zp, offsets) = (b_f, b_s)
+        # with diagonal D_f, D_s; offsets are eliminated, the reduced
+        # system for the zeropoints is solved with conjugate gradients
+        d_frames = np.bincount(frame_idc, w, minlength=n_frames)
+        d_stars = np.bincount(star_idc, w, minlength=n_stars) + prior_weights
+        b_frames = np.bincount(frame_idc, w*residuals, minlength=n_frames)
+        b_stars = np.bincount(star_idc, w*residuals, minlength=n_stars)
+        coupling = sparse.csr_matrix((w[order], star_idc[order], indptr),
+                                     shape=(n_frames, n_stars))
+
+        # frames without (used) observations are solved for zp=0
+        d_frames_solve = np.where(d_frames > 0, d_frames, 1)
+
+        def reduced(zp):
+            return (d_frames_solve*zp -
+                    coupling.dot(coupling.T.dot(zp)/d_stars))
+
+        operator = splinalg.LinearOperator((n_frames, n_frames),
+                                           matvec=reduced, dtype=float)
+        preconditioner = splinalg.LinearOperator(
+            (n_frames, n_frames), matvec=lambda x: x/d_frames_solve,
+            dtype=float)
+        rhs = b_frames - coupling.dot(b_stars/d_stars)
+        previous = zeropoints
+        # solve for corrections to the previous solution
+        for refinement in range(5):
+            correction, info = splinalg.cg(
+                operator, rhs - reduced(zeropoints), M=preconditioner,
+                maxiter=10*n_frames)
+            if info > 0:
+                logging.warning('ensemble zeropoints did not converge')
+            zeropoints = zeropoints + correction
+            if np.max(np.abs(correction), initial=0) < 1e-6:
+                break
+        offsets = (b_stars - coupling.T.dot(zeropoints))/d_stars
+
+        # reweighting based on the normalized model residuals
+        reweighted = biweight((residuals - zeropoints[frame_idc] -
+                               offsets[star_idc])*np.sqrt(weights),
+                              robust > 0)
+        if reweighted is None:
+            break
+        robust = reweighted
+
+        logging.info('ensemble zeropoints: iteration %d, %d observations '
+                     'rejected' % (iteration+1, np.sum(robust == 0)))
+        if (iteration > 0 and
+                np.max(np.abs(zeropoints-previous)) < tolerance):
+            break
+
+    used = np.bincount(frame_idc, robust > 0, minlength=n_frames) > 0
+    zeropoints = np.where(used, zeropoints, np.nan)
+
+    return zeropoints, offsets, robust
+
+
+def derive_ensemble_zeropoints(ref_cat, catalogs, filtername,
+                               display=False):
+    """derive zeropoints for all catalogs in a single fit
+    (see solve_ensemble_zeropoints); returns list of calibrated catalogs
+    and zeropoint data (see derive_zeropoints)"""
+
+    results = map_catalogs(match_reference, ref_cat,
+                           [(cat, filtername) for cat in catalogs])
+    catalogs = [cat for cat, match in results]
+    matches = [match for cat, match in results]
+
+    # observations of all frames
+    n_obs = np.array([len(match[0][0]) for match in matches], dtype=int)
+    frame_idc = np.repeat(np.arange(len(matches)), n_obs)
+    if n_obs.sum() > 0:
+        ref_idc = np.concatenate([np.array(match[0][5], dtype=int)
+                                  for match in matches])
+        residuals = np.concatenate([np.array(match[0][0]-match[1][0])
+                                    for match in matches])
+        sig_instr = np.concatenate([np.array(match[1][1])
+                                    for match in matches])
+        sig_ref = np.concatenate([np.array(match[0][1])
+                                  for match in matches])
+    else:
+        ref_idc = residuals = sig_instr = sig_ref = np.array([])
+    stars, star_idc = np.unique(ref_idc, return_inverse=True)
+
+    logging.info(('solve for %d zeropoints and %d reference star offsets '
+                  'based on %d observations') %
+                 (len(matches), len(stars), len(residuals)))
+    zeropoints, offsets, robust = solve_ensemble_zeropoints(
+        frame_idc, star_idc, residuals, sig_instr, sig_ref,
+        len(matches), len(stars))
+
+    zp_data, arguments = [], []
+    bounds = np.concatenate([[0], np.cumsum(n_obs)])
+    for i, (cat, match) in enumerate(zip(catalogs, matches)):
+        obs = slice(bounds[i], bounds[i+1])
+        usedstars = np.where(robust[obs] > 0)[0]
+        zp = zeropoints[i]
+
+        if len(usedstars) == 0:
+            logging.warning(('no reference stars for frame {:s}; report '
+                             'instrumental magnitudes').format(
+                                 cat.catalogname))
+            zp_data.append({'filename': cat.catalogname,
+                            'zp': np.nan,
+                            'zp_sig': np.nan,
+                            'zp_nstars': 0,
+                            'zp_usedstars': 0,
+                            'obstime': cat.obstime,
+                            'match': match,
+                            'clipping_steps': [[0, 0, 1e-10, [],
+                                                [[], []]]],
+                            'zp_idx': np.nan,
+                            'success': False})
+            continue
+
+        # zeropoint uncertainty as in derive_clipping_steps
+        model_residuals = (residuals[obs][usedstars] - zp -
+                           offsets[star_idc[obs][usedstars]])
+        residuals_sig = (sig_instr[obs][usedstars]**2 +
+                         sig_ref[obs][usedstars]**2)
+        weights = robust[obs][usedstars]/residuals_sig
+        chi2 = np.sum(weights*model_residuals**2)
+        sigma = np.sqrt(chi2/np.sum(weights) + np.mean(residuals_sig))
+        red_chi2 = (chi2/(len(usedstars)-2) if len(usedstars) > 2
+                    else np.nan)
+
+        zp_data.append({'filename': cat.catalogname,
+                        'zp': zp,
+                        'zp_sig': sigma,
+                        'zp_nstars': len(usedstars),
+                        'zp_usedstars': usedstars,
+                        'obstime': cat.obstime,
+                        'match': match,
+                        'clipping_steps': [[zp, sigma, red_chi2,
+                                            usedstars, match]],
+                        'zp_idx': 0,
+                        'success': True})
+        if conf.save_caldata and conf.save_caldata_mode == 'archive':
+            zp_data[-1]['caldata'] = calibration_data(ref_cat, cat, match,
+                                                      usedstars)
+        arguments.append((cat, filtername, match, zp, sigma, usedstars))
+
+        if display:
+            print('zeropoint for %s: %6.3f+-%.3f (%d/%d reference stars)' %
+                  (cat.catalogname, zp, sigma, len(usedstars),
+                   len(match[0][0])))
+
+    # write calibration data and calibrate catalogs
+    calibrated = iter(map_catalogs(apply_zeropoint, ref_cat, arguments))
+    catalogs = [next(calibrated) if zeropoint['success'] else cat
+                for cat, zeropoint in zip(catalogs, zp_data)]
+
+    return catalogs, zp_data
+
+
+def _table_bytes(table):
+    """memory footprint of the columns of `table` in bytes"""
+    return sum(np.asarray(column).nbytes for column in table.itercols())
+
+
+def _calibration_worker(args):
+    """call function(ref_cat, *arguments) for each tuple in a chunk of
+    arguments in a worker process"""
+    function, ref_cat, arguments = args
+    return [function(ref_cat, *single) for single in arguments]
+
+
+def map_catalogs(function, ref_cat, arguments, callback=None):
+    """call function(ref_cat, *args) for each tuple args in `arguments`;
+    arguments are split into one chunk per worker of the pipeline-wide
+    executor (see executor.py), each of which receives the reference
+    catalog once; callback is called with each result (in order) as
+    soon as it is available; returns list of results"""
+
+    executor = get_executor()
+    n_chunks = min(executor.n_workers, len(arguments))
+
+    collected = []
+
+    def collect(results):
+        for result in results:
+            if callback is not None:
+                callback(result)
+            collected.append(result)
+
+    if n_chunks <= 1:
+        collect(function(ref_cat, *args) for args in arguments)
+        return collected
+
+    logging.info('process %d catalogs in %d chunks' %
+                 (len(arguments), n_chunks))
+    bounds = np.linspace(0, len(arguments), n_chunks+1).astype(int)
+    chunks = [arguments[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+    ref_size = _table_bytes(ref_cat.data)
+    sizes = [conf.frame_memory_factor *
+             (ref_size + sum(_table_bytes(args[0].data) for args in chunk))
+             for chunk in chunks]
+
+    # results are collected in the order of `arguments`
+    results, next_chunk = [None]*n_chunks, 0
+    for idx, result in executor.imap_unordered(
+            _calibration_worker,
+            [(function, ref_cat, chunk) for chunk in chunks], sizes):
+        results[idx] = result
+        while next_chunk < n_chunks and results[next_chunk] is not None:
+            collect(results[next_chunk])
+            results[next_chunk] = None
+            next_chunk += 1
+    return collected
+
+
+def derive_zeropoints(ref_cat, catalogs, filtername, minstars_external,
+                      use_all_stars=False,
+                      display=False, diagnostics=False, mode=None):
+    """derive zeropoint for a number of catalogs based on a reference catalog;
+    mode 'frame' derives the zeropoint of each catalog independently,
+    mode 'ensemble' derives all zeropoints in a single fit (default:
+    ConfCalibrate.zeropoint_mode); catalogs are processed in parallel
+    processes (see map_catalogs), catalogs in list
+    `catalogs` are replaced with the calibrated catalogs"""
+
+    if mode is None:
+        mode = conf.zeropoint_mode
+
+    output = {'filtername': filtername, 'minstars': minstars_external,
+              'zeropoints': [], 'clipping_steps': []}
+
+    # add idx column to reference catalog
+    if 'idx' not in ref_cat.fields:
+        ref_cat.add_field('idx',
+                          list(range(ref_cat.shape[0])),
+                          field_type=int)
+
+    # build the spatial index of the reference catalog once; it is
+    # used for matching all catalogs
+    ref_cat.sky_index()
+
+    # calibration data of each frame are appended to the archive as
+    # soon as the frame has been calibrated
+    archive = None
+    if conf.save_caldata and conf.save_caldata_mode == 'archive':
+        archive = CalibrationArchive(conf.save_caldata_archive)
+
+    def archive_caldata(zeropoint):
+        if archive is not None and 'caldata' in zeropoint:
+            archive.append(zeropoint['filename'], zeropoint.pop('caldata'))
+
+    if mode == 'ensemble':
+        calibrated, output['zeropoints'] = derive_ensemble_zeropoints(
+            ref_cat, catalogs, filtername, display=display)
+        for zeropoint in output['zeropoints']:
+            archive_caldata(zeropoint)
+    else:
+        results = map_catalogs(derive_zeropoint, ref_cat,
+                               [(cat, filtername, minstars_external, display)
+                                for cat in catalogs],
+                               callback=lambda result:
+                               archive_caldata(result[1]))
+        calibrated = [cat for cat, zeropoint in results]
+        output['zeropoints'] = [zeropoint for cat, zeropoint in results]
+    catalogs[:] = calibrated
 
     output['catalogs'] = catalogs
     output['ref_cat'] = ref_cat
@@ -492,9 +1182,10 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
               obsparam, maxflag=3,
               magzp=None, solar=False,
               use_all_stars=False,
-              display=False, diagnostics=False):
+              display=False, diagnostics=False, zeropoint_mode=None):
     """
-    wrapper for photometric calibration
+    wrapper for photometric calibration; zeropoint_mode: see
+    derive_zeropoints
     """
 
     # read in ldac data into catalogs
@@ -528,13 +1219,15 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
             print(cat.read_ldac(ldac_filename, filename, maxflag=maxflag,
                                 object_keyword=obsparam['object'],
                                 exptime_keyword=obsparam['exptime'],
-                                time_keyword='MIDTIMJD'),
+                                time_keyword='MIDTIMJD',
+                                fits_header=hdulist[0].header),
                   '(sources, columns) read from', filename)
         else:
             cat.read_ldac(ldac_filename, filename, maxflag=maxflag,
                           object_keyword=obsparam['object'],
                           exptime_keyword=obsparam['exptime'],
-                          time_keyword='MIDTIMJD')
+                          time_keyword='MIDTIMJD',
+                          fits_header=hdulist[0].header)
 
         if cat.shape[0] > 0:
             catalogs.append(cat)
@@ -578,7 +1271,8 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
                                            filtername, preferred_catalogs,
                                            max_sources=2e4, solar=solar,
                                            use_all_stars=use_all_stars,
-                                           display=display)
+                                           display=display,
+                                           prefetch=conf.prefetch_catalogs)
 
     if ref_cat == None:
         if magzp == None:
@@ -608,7 +1302,7 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
         if display:
             print('write calibrated data into database files')
         for cat in catalogs:
-            cat.write_database(cat.catalogname+'.db')
+            cat.write_photometry(cat.catalogname, conf.database_format)
 
         logging.info('Done! ------------------------------------------------')
 
@@ -660,7 +1354,8 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
                                 minstars,
                                 use_all_stars=use_all_stars,
                                 display=display,
-                                diagnostics=diagnostics)
+                                diagnostics=diagnostics,
+                                mode=zeropoint_mode)
 
     # zp_data content
     #
@@ -676,7 +1371,7 @@ def calibrate(filenames, minstars, manfilter, manualcatalog,
     if display:
         print('write calibrated data into database files')
     for cat in catalogs:
-        cat.write_database(cat.catalogname+'.db')
+        cat.write_photometry(cat.catalogname, conf.database_format)
 
     logging.info('Done! -----------------------------------------------------')
 
@@ -708,6 +1403,10 @@ if __name__ == '__main__':
     parser.add_argument('-use_all_stars',
                         help='ignore all quality checks and use all stars',
                         action="store_true", default=False)
+    parser.add_argument('-ensemble',
+                        help='derive zeropoints of all images in a '
+                             'single fit',
+                        action="store_true", default=False)
     parser.add_argument('images', help='images to process', nargs='+')
     args = parser.parse_args()
     minstars = float(args.minstars)
@@ -718,6 +1417,7 @@ if __name__ == '__main__':
     man_magzp = args.magzp
     solar = args.solar
     use_all_stars = args.use_all_stars
+    zeropoint_mode = 'ensemble' if args.ensemble else None
     filenames = args.images
 
     # manfilter: None: instrumental magnitudes, False: no manfilter provided
@@ -750,4 +1450,5 @@ if __name__ == '__main__':
                             manualcatalog, obsparam, maxflag=maxflag,
                             magzp=man_magzp, solar=solar,
                             use_all_stars=use_all_stars,
-                            display=True, diagnostics=conf.diagnostics)
+                            display=True, diagnostics=conf.diagnostics,
+                            zeropoint_mode=zeropoint_mode)
@@ -31,14 +31,14 @@ import logging
 import subprocess
 import argparse
 import shlex
-import time
 from astropy.io import fits
 from past.utils import old_div
-from astroquery.jplhorizons import Horizons
 
 # pipeline-specific modules
 import _pp_conf
+import ephemeris
 import toolbox
+from executor import get_executor, frame_memory
 
 # create a portable DEVNULL
 # necessary to prevent subprocess.PIPE and STDOUT from clogging if
@@ -60,6 +60,34 @@ logging.basicConfig(filename=_pp_conf.log_filename,
                     datefmt=_pp_conf.log_datefmt)
 
 
+def shift_frame(data):
+    """
+    write a copy of an image with CRVALi keywords shifted into the
+    moving frame of the target
+    input: (filename, movingfilename, offset_ra, offset_dec) with
+           offsets in deg
+    """
+    filename, movingfilename, offset_ra, offset_dec = data
+
+    hdulist = fits.open(filename)
+    header = hdulist[0].header
+    crval1 = float(header['CRVAL1'])
+    crval2 = float(header['CRVAL2'])
+
+    # write new CRVALi keywords in different file
+    new_hdu = fits.PrimaryHDU(hdulist[0].data)
+    new_hdu.header = header
+    new_hdu.header['CRVAL1'] = (crval1-offset_ra,
+                                'updated in the moving frame of the object')
+    new_hdu.header['CRVAL2'] = (crval2-offset_dec,
+                                'updated in the moving frame of the object')
+    new_hdu.writeto(movingfilename, overwrite=True,
+                    output_verify='silentfix')
+    hdulist.close()
+
+    return movingfilename
+
+
 def combine(filenames, obsparam, comoving, targetname,
             manual_rates, combine_method, keep_files,
             backsub=False, display=True, diagnostics=True):
@@ -118,7 +146,7 @@ def combine(filenames, obsparam, comoving, targetname,
 
     # modify individual frames if comoving == True
     if comoving:
-        movingfilenames = []
+        shifts = []
 
         # sort filenames by MIDTIMJD
         mjds = []
@@ -127,7 +155,16 @@ def combine(filenames, obsparam, comoving, targetname,
             mjds.append(float(hdulist[0].header['MIDTIMJD']))
         filenames = [filenames[i] for i in numpy.argsort(mjds)]
 
-        for filename in filenames:
+        # pull target coordinates for all frames from Horizons
+        if manual_rates is None:
+            eph = ephemeris.ephemerides(targetname.replace('_', ' '),
+                                        numpy.sort(mjds),
+                                        str(obsparam['observatory_code']))
+            if eph is None:
+                print('Target (%s) not an asteroid' % targetname)
+                logging.warning('Target (%s) not an asteroid' % targetname)
+
+        for idx, filename in enumerate(filenames):
             movingfilename = filename[:filename.find('.fits')]+'_moving.fits'
             print('shifting %s -> %s' % (filename, movingfilename))
             logging.info('shifting %s -> %s' % (filename, movingfilename))
@@ -136,34 +173,20 @@ def combine(filenames, obsparam, comoving, targetname,
             hdulist = fits.open(filename)
             header = hdulist[0].header
             date = hdulist[0].header['MIDTIMJD']
-            data = hdulist[0].data
             hdulist.close()
 
             # use ephemerides from Horizons if no manual rates are provided
             if manual_rates is None:
-                # call HORIZONS to get target coordinates
-                obj = Horizons(targetname.replace('_', ' '), epochs=date,
-                               location=str(obsparam['observatory_code']))
-                try:
-                    eph = obj.ephemerides()
-                    n = len(eph)
-                except ValueError:
-                    print('Target (%s) not an asteroid' % targetname)
-                    logging.warning('Target (%s) not an asteroid' % targetname)
-                    n = None
-                    time.sleep(0.5)
-                if n is None or n == 0:
+                # target coordinates at MIDTIMJD of this frame
+                if eph is None or numpy.isnan(eph['RA'][idx]):
                     logging.warning('WARNING: No position from Horizons!' +
                                     'Name (%s) correct?' % targetname)
-                    logging.warning('HORIZONS call: %s' % eph.url)
-                    raise(ValueError, 'no Horizons ephemerides available')
+                    raise ValueError('no Horizons ephemerides available')
                 else:
                     logging.info('ephemerides for %s pulled from Horizons' %
                                  targetname)
-                    logging.info('Horizons call: %s' %
-                                 obj.uri)
 
-                    target_ra, target_dec = eph[0]['RA'], eph[0]['DEC']
+                    target_ra, target_dec = eph['RA'][idx], eph['DEC'][idx]
 
                 # get image pointing from header
                 if obsparam['radec_separator'] == 'XXX':
@@ -203,19 +226,12 @@ def combine(filenames, obsparam, comoving, targetname,
             logging.info('offsets in RA and Dec: %f, %f arcsec' %
                          (offset_ra*3600, offset_dec*3600))
 
-            crval1 = float(header['CRVAL1'])
-            crval2 = float(header['CRVAL2'])
-
-            # write new CRVALi keywords in different file
-            new_hdu = fits.PrimaryHDU(data)
-            new_hdu.header = header
-            new_hdu.header['CRVAL1'] = (crval1-offset_ra,
-                                        'updated in the moving frame of the object')
-            new_hdu.header['CRVAL2'] = (crval2-offset_dec,
-                                        'updated in the moving frame of the object')
-            movingfilenames.append(movingfilename)
-            new_hdu.writeto(movingfilename, overwrite=True,
-                            output_verify='silentfix')
+            shifts.append((filename, movingfilename, offset_ra, offset_dec))
+
+        # write shifted frames in parallel
+        movingfilenames = get_executor().map(
+            shift_frame, shifts,
+            sizes=[frame_memory(shift[0]) for shift in shifts])
 
     if comoving:
         outfile_name = 'comove.fits'
@@ -28,7 +28,6 @@ import sys
 import logging
 import argparse
 import sqlite3
-from astroquery.jplhorizons import Horizons
 from astropy.io import ascii
 
 try:
@@ -46,6 +45,7 @@ if sys.version_info > (3, 0):
 
 # pipeline-specific modules
 import _pp_conf
+import ephemeris
 from pp_setup import confdistill as conf
 from catalog import *
 from toolbox import *
@@ -189,16 +189,11 @@ def moving_primary_target(catalogs, man_targetname, offset, is_asteroid=None,
         if man_targetname is not None:
             targetname = man_targetname.replace('_', ' ')
         for smallbody in [True, False]:
-            obj = Horizons(targetname.replace('_', ' '),
-                           id_type={True: 'smallbody',
-                                    False: 'majorbody'}[smallbody],
-                           epochs=cat.obstime[0],
-                           location=obsparam['observatory_code'])
-            n = 0
-            try:
-                eph = obj.ephemerides()
-                n = len(eph)
-            except ValueError:
+            eph = ephemeris.ephemerides(
+                targetname, [cat.obstime[0]],
+                obsparam['observatory_code'],
+                id_type={True: 'smallbody', False: 'majorbody'}[smallbody])
+            if eph is None or np.isnan(eph['RA'][0]):
                 if display and smallbody is True:
                     print("'%s' is not a small body" % targetname)
                     logging.warning("'%s' is not a small body" %
@@ -207,8 +202,7 @@ def moving_primary_target(catalogs, man_targetname, offset, is_asteroid=None,
                     print("'%s' is not a Solar System object" % targetname)
                     logging.warning("'%s' is not a Solar System object" %
                                     targetname)
-                pass
-            if n > 0:
+            else:
                 is_asteroid = smallbody
                 break
 
@@ -218,52 +212,43 @@ def moving_primary_target(catalogs, man_targetname, offset, is_asteroid=None,
 
     message_shown = False
 
-    # query information for each image
-    for cat_idx, cat in enumerate(catalogs):
+    # query information for all images at once
+    targetnames = []
+    for cat in catalogs:
         targetname = cat.obj.replace('_', ' ')
         if man_targetname is not None:
             targetname = man_targetname.replace('_', ' ')
             cat.obj = targetname
-        obj = Horizons(targetname.replace('_', ' '),
-                       id_type={True: 'smallbody',
-                                False: 'majorbody'}[is_asteroid],
-                       epochs=cat.obstime[0],
-                       location=obsparam['observatory_code'])
-        try:
-            eph = obj.ephemerides()
-            n = len(eph)
-        except ValueError:
-            # if is_asteroid:
-            #     if display and not message_shown:
-            #         print 'is \'%s\' an asteroid?' % targetname
-            #     logging.warning('Target (%s) is not an asteroid' % targetname)
-
-            # else:
-            #     if display and not message_shown:
-            #         print ('is \'%s\' a different Solar System object?' %
-            #                )targetname
-            #     logging.warning('Target (%s) is not a Solar System object' %
-            #                     targetname)
-            #     n = None
-            pass
-
-        if n is None or n == 0:
+        targetnames.append(targetname)
+    positions = {}
+    for targetname in set(targetnames):
+        cat_idc = [cat_idx for cat_idx in range(len(catalogs))
+                   if targetnames[cat_idx] == targetname]
+        eph = ephemeris.ephemerides(
+            targetname, [catalogs[cat_idx].obstime[0] for cat_idx in cat_idc],
+            obsparam['observatory_code'],
+            id_type={True: 'smallbody', False: 'majorbody'}[is_asteroid])
+        for i, cat_idx in enumerate(cat_idc):
+            if eph is not None and not np.isnan(eph['RA'][i]):
+                positions[cat_idx] = eph[i]
+
+    for cat_idx, cat in enumerate(catalogs):
+        if cat_idx not in positions:
             logging.warning('WARNING: No position from Horizons! ' +
                             'Name (%s) correct?' % cat.obj.replace('_', ' '))
-            logging.warning('HORIZONS call: %s' % obj.uri)
             if display and not message_shown:
                 print('  no Horizons data for %s ' % cat.obj.replace('_', ' '))
                 message_shown = True
 
         else:
-            objects.append({'ident': eph[0]['targetname'].replace(" ", "_"),
+            eph = positions[cat_idx]
+            objects.append({'ident': eph['targetname'].replace(" ", "_"),
                             'obsdate.jd': cat.obstime[0],
                             'cat_idx': cat_idx,
-                            'ra_deg': eph[0]['RA']-offset[0]/3600,
-                            'dec_deg': eph[0]['DEC']-offset[1]/3600})
+                            'ra_deg': eph['RA']-offset[0]/3600,
+                            'dec_deg': eph['DEC']-offset[1]/3600})
             logging.info('Successfully grabbed Horizons position for %s ' %
                          cat.obj.replace('_', ' '))
-            logging.info('HORIZONS call: %s' % obj.uri)
             if display and not message_shown:
                 print(cat.obj.replace('_', ' '), "identified")
                 message_shown = True
@@ -466,10 +451,10 @@ def distill(catalogs, man_targetname, offset, fixed_targets_file, posfile,
         filenames = catalogs[:]
         catalogs = []
         for filename in filenames:
-            filename = filename[:filename.find('.fit')]+'.ldac.db'
+            filename = filename[:filename.find('.fit')]+'.ldac'
             cat = catalog(filename)
             try:
-                cat.read_database(filename)
+                cat.read_photometry(filename, conf.database_format)
             except IOError:
                 logging.error('Cannot find database', filename)
                 print('Cannot find database', filename)
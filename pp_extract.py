@@ -31,7 +31,10 @@ import subprocess
 import logging
 import argparse
 import shlex
-from multiprocessing import Pool
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import fits
 
 # only import if Python3 is used
@@ -55,6 +58,10 @@ except ImportError:
 import _pp_conf
 from catalog import *
 from toolbox import *
+from cache import ExtractionCache
+from executor import get_executor, frame_memory
+import detection
+from pp_setup import confextract as conf
 
 # setup logging
 logging.basicConfig(filename=_pp_conf.log_filename,
@@ -76,28 +83,329 @@ for cmd in ['sex', 'sextractor']:
     except OSError:
         continue
 else:
-    raise FileNotFoundError('Source Extractor command not found.')
+    # Source Extractor is not required for the numpy backend
+    cmd = None
 sextractor_cmd = cmd
 del cmd
 
 # extractor class definition
 
 
+def frame_midtime(header, obsparam):
+    """
+    derive observation midtime (JD) from image header
+    """
+    if obsparam['obsmidtime_jd'] in header:
+        midtimjd = header[obsparam['obsmidtime_jd']]
+    else:
+        if obsparam['date_keyword'].find('|') == -1:
+            midtimjd = dateobs_to_jd(
+                header[obsparam['date_keyword']]) + \
+                float(header[obsparam['exptime']])/2./86400.
+        else:
+            datetime = header[
+                obsparam['date_keyword'].split('|')[0]] + \
+                'T'+header[
+                obsparam['date_keyword'].split('|')[1]]
+            midtimjd = dateobs_to_jd(datetime) + \
+                float(header[
+                    obsparam['exptime']])/2./86400.
+    return midtimjd
+
+
+# image coordinate columns that refer to positions and have to be
+# shifted when merging tile catalogs
+TILE_X_COLUMNS = ['X_IMAGE', 'XWIN_IMAGE', 'XPEAK_IMAGE', 'XMIN_IMAGE',
+                  'XMAX_IMAGE', 'X_IMAGE_DBL', 'XPSF_IMAGE', 'XMODEL_IMAGE']
+TILE_Y_COLUMNS = [col.replace('X', 'Y', 1) for col in TILE_X_COLUMNS]
+
+
+def run_sextractor(param, filename, ldacname, optionstring):
+    """
+    run Source Extractor on one image and wait for it to finish
+    return: True if successful, False otherwise
+    """
+    if sextractor_cmd is None:
+        raise FileNotFoundError('Source Extractor command not found.')
+    commandline = '%s -c %s %s -CATALOG_NAME %s %s' % \
+                  (sextractor_cmd,
+                   param['obsparam']['sex-config-file'],
+                   optionstring, ldacname, filename)
+    logging.info('call Source Extractor as: %s' % commandline)
+
+    try:
+        sex = subprocess.Popen(shlex.split(commandline),
+                               stdout=DEVNULL,
+                               stderr=DEVNULL,
+                               close_fds=True)
+        # do not direct stdout to subprocess.PIPE:
+        # for large FITS files, PIPE will clog, stalling
+        # subprocess.Popen
+    except Exception as e:
+        print('Source Extractor call:', (e))
+        logging.error('Source Extractor call: %s' % str(e))
+        return False
+
+    sex.wait()
+    return True
+
+
+def frame_tiles(header, obsparam):
+    """
+    derive the tiling of a frame for tiled extraction based on the
+    'extraction_tiles' (tile size, overlap) telescope parameter
+    return: list of (core, tile) tuples, each one being a (y0, y1, x0,
+            x1) pixel range; None if the frame is not to be tiled
+    """
+    if 'extraction_tiles' not in obsparam or not conf.extraction_tiling:
+        return None
+    tile_size, overlap = obsparam['extraction_tiles']
+    ny, nx = header['NAXIS2'], header['NAXIS1']
+    if nx <= tile_size+overlap and ny <= tile_size+overlap:
+        return None
+
+    # split each axis into cores of (nearly) equal size
+    yedges = numpy.linspace(0, ny, int(numpy.ceil(ny/tile_size))+1)
+    xedges = numpy.linspace(0, nx, int(numpy.ceil(nx/tile_size))+1)
+    yedges = yedges.round().astype(int)
+    xedges = xedges.round().astype(int)
+
+    tiles = []
+    for y0, y1 in zip(yedges[:-1], yedges[1:]):
+        for x0, x1 in zip(xedges[:-1], xedges[1:]):
+            tiles.append(((y0, y1, x0, x1),
+                          (max(0, y0-overlap), min(ny, y1+overlap),
+                           max(0, x0-overlap), min(nx, x1+overlap))))
+    return tiles
+
+
+def tile_workers(n_frame_workers):
+    """
+    derive the number of tiles of a frame that are extracted at the
+    same time, such that `n_frame_workers` frames extracted in parallel
+    share the available cpus; 'extraction_tile_workers' caps this
+    number further
+    return: number of tile threads per frame (at least 1)
+    """
+    n_workers = max(1, (os.cpu_count() or 1)//max(1, n_frame_workers))
+    if conf.extraction_tile_workers:
+        n_workers = min(n_workers, conf.extraction_tile_workers)
+    return n_workers
+
+
+def extraction_memory(filename, param, n_tile_workers):
+    """
+    estimate the memory footprint (bytes) of extracting a frame: the
+    frame itself (see executor.frame_memory) and, for tiled frames, the
+    full mask plus the tile (and mask tile) copies of all tiles that
+    are extracted at the same time
+    """
+    size = frame_memory(filename)
+    header = fits.getheader(filename, ignore_missing_end=True)
+    tiles = frame_tiles(header, param['obsparam'])
+    if tiles is None:
+        return size
+
+    pixel_bytes = abs(header.get('BITPIX', 32))//8
+    if 'mask_file' in param:
+        mask_file = os.path.expandvars(param['mask_file'])
+        mask_bytes = abs(fits.getheader(mask_file).get('BITPIX', 32))//8
+        size += header['NAXIS1']*header['NAXIS2']*mask_bytes
+        pixel_bytes += mask_bytes
+    tile_pixels = max([(y1-y0)*(x1-x0) for core, (y0, y1, x0, x1)
+                       in tiles])
+    return size + int(n_tile_workers*tile_pixels*pixel_bytes *
+                      conf.frame_memory_factor)
+
+
+def extract_tiled(param, filename, ldacname, optionstring, backend, tiles,
+                  n_workers=1):
+    """
+    extract sources from overlapping tiles of a frame concurrently
+    using `n_workers` threads (see tile_workers) and merge the tile
+    catalogs into a single LDAC file; sources are only kept from the
+    tile that contains their position in its core region, which
+    removes duplicates from the overlap zones
+    return: LDAC HDUList, FITS header; (None, None) if the extraction
+            failed
+    """
+    hdulist = fits.open(filename, ignore_missing_end=True)
+    header = hdulist[0].header
+    data = hdulist[0].data
+    mask = None
+    if 'mask_file' in param:
+        mask = fits.getdata(os.path.expandvars(param['mask_file']))
+
+    tiledir = tempfile.mkdtemp(prefix='.tiles_',
+                               dir=os.path.dirname(os.path.abspath(filename)))
+
+    def extract_tile(idx):
+        """write tile `idx` to disk and run the extraction on it"""
+        y0, y1, x0, x1 = tiles[idx][1]
+        tilename = os.path.join(tiledir, 'tile%03d.fits' % idx)
+        tileldac = os.path.join(tiledir, 'tile%03d.ldac' % idx)
+        tileheader = header.copy()
+        for key, offset in [('CRPIX1', x0), ('CRPIX2', y0)]:
+            if key in tileheader:
+                tileheader[key] -= offset
+        fits.writeto(tilename, data[y0:y1, x0:x1], tileheader,
+                     overwrite=True)
+
+        tileparam = dict(param)
+        tileoptions = optionstring
+        if mask is not None:
+            tileparam['mask_file'] = os.path.join(tiledir,
+                                                  'tile%03d.weight.fits' %
+                                                  idx)
+            fits.writeto(tileparam['mask_file'], mask[y0:y1, x0:x1],
+                         overwrite=True)
+            tileoptions = optionstring.replace(param['mask_file'],
+                                               tileparam['mask_file'])
+
+        if backend == 'numpy':
+            return detection.extract(tilename, tileparam, tileldac)[0]
+        if not run_sextractor(tileparam, tilename, tileldac, tileoptions):
+            return None
+        return fits.open(tileldac)
+
+    logging.info('extract %d tiles of frame %s using %d threads' %
+                 (len(tiles), filename, n_workers))
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            tile_ldacs = list(pool.map(extract_tile, range(len(tiles))))
+
+        if any([ldac is None for ldac in tile_ldacs]):
+            logging.error('tiled extraction failed for frame %s' % filename)
+            return None, None
+
+        # select sources from tile cores and shift to frame coordinates
+        columns = tile_ldacs[0]['LDAC_OBJECTS'].columns
+        xcol = 'XWIN_IMAGE' if 'XWIN_IMAGE' in columns.names else 'X_IMAGE'
+        ycol = xcol.replace('X', 'Y', 1)
+        ny, nx = data.shape
+        selected = []
+        for (core, tile), ldac in zip(tiles, tile_ldacs):
+            objects = ldac['LDAC_OBJECTS'].data
+            if objects is None or len(objects) == 0:
+                continue
+            x = objects[xcol] + tile[2]
+            y = objects[ycol] + tile[0]
+            # core boundaries in FITS pixel coordinates; positions
+            # beyond the frame edges belong to the outermost tiles
+            xmin = core[2]+0.5 if core[2] > 0 else -numpy.inf
+            xmax = core[3]+0.5 if core[3] < nx else numpy.inf
+            ymin = core[0]+0.5 if core[0] > 0 else -numpy.inf
+            ymax = core[1]+0.5 if core[1] < ny else numpy.inf
+            keep = (x >= xmin) & (x < xmax) & (y >= ymin) & (y < ymax)
+            selected.append((objects[keep], tile))
+
+        nrows = sum([len(objects) for objects, tile in selected])
+        objhdu = fits.BinTableHDU.from_columns(columns, nrows=nrows,
+                                               fill=True)
+        for name in columns.names:
+            if len(selected) == 0:
+                break
+            merged = []
+            for objects, tile in selected:
+                values = numpy.array(objects[name])
+                if name in TILE_X_COLUMNS:
+                    values = values + tile[2]
+                elif name in TILE_Y_COLUMNS:
+                    values = values + tile[0]
+                merged.append(values)
+            objhdu.data[name][:] = numpy.concatenate(merged)
+        if 'NUMBER' in columns.names:
+            objhdu.data['NUMBER'][:] = numpy.arange(1, nrows+1)
+        objhdu.header['EXTNAME'] = 'LDAC_OBJECTS'
+
+        ldac = fits.HDUList([fits.PrimaryHDU(),
+                             detection.ldac_imhead(header), objhdu])
+        ldac.writeto(ldacname, overwrite=True)
+        for tile_ldac in tile_ldacs:
+            tile_ldac.close()
+    finally:
+        shutil.rmtree(tiledir, ignore_errors=True)
+        hdulist.close()
+
+    logging.info('%d sources merged from %d tiles of frame %s' %
+                 (nrows, len(tiles), filename))
+
+    return ldac, header
+
+
+class ExtractionResult(dict):
+    """
+    extraction result properties of one frame (see extract_multiframe);
+    catalog data and image header are not part of the result that is
+    passed from the worker processes, but are read from disk when they
+    are first accessed
+    """
+
+    lazy_keys = ('catalog_data', 'fits_header')
+
+    def __missing__(self, key):
+        if key == 'catalog_data':
+            value = catalog(self['ldac_filename'])
+            hdulist = fits.open(self['ldac_filename'],
+                                ignore_missing_end=True, memmap=True)
+            if value.read_ldac(self['ldac_filename'], maxflag=None,
+                               hdulist=hdulist) is None:
+                raise KeyError(key)
+        elif key == 'fits_header':
+            value = fits.getheader(self['fits_filename'],
+                                   ignore_missing_end=True)
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.lazy_keys or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+def ldac_shape(ldac_filename, hdulist=None):
+    """
+    determine the number of sources and columns in an LDAC file from
+    its headers, without reading the catalog data
+    return: (number of sources, number of columns); None if the file
+            does not contain a catalog
+    """
+    close = hdulist is None
+    if hdulist is None:
+        hdulist = fits.open(ldac_filename, ignore_missing_end=True,
+                            memmap=True)
+    try:
+        if len(hdulist) < 3:
+            return None
+        return (hdulist[2].header['NAXIS2'], hdulist[2].header['TFIELDS'])
+    finally:
+        if close:
+            hdulist.close()
+
+
 def extract_singleframe(data):
     """
     call Source Extractor using multiprocessing
+    return: ExtractionResult without parameters; None if the
+            extraction failed
     """
 
     param = data[0]
     filename = data[1]
+    n_tile_workers = data[2]
 
-    out = {}
+    out = ExtractionResult()
 
     # process this frame
     ldacname = filename[:filename.find('.fit')]+'.ldac'
     out['fits_filename'] = filename
     out['ldac_filename'] = ldacname
-    out['parameters'] = param
 
     # prepare running SEXTRACTOR
     os.remove(ldacname) if os.path.exists(ldacname) else None
@@ -114,7 +422,6 @@ def extract_singleframe(data):
     optionstring += ' -DETECT_MINAREA %f ' % param['source_minarea']
     optionstring += ' -DETECT_THRESH %f -ANALYSIS_THRESH %f ' % \
                     (param['sex_snr'], param['sex_snr'])
-    optionstring += ' -CATALOG_NAME %s ' % ldacname
 
     if 'mask_file' in param:
         optionstring += ' -WEIGHT_TYPE MAP_WEIGHT'
@@ -131,101 +438,113 @@ def extract_singleframe(data):
     if 'nodeblending' in param and param['nodeblending']:
         optionstring += ' -DEBLEND_MINCONT 1 '
 
-    commandline = '%s -c %s %s %s' % \
-                  (sextractor_cmd,
-                   param['obsparam']['sex-config-file'],
-                   optionstring, filename)
-    logging.info('call Source Extractor as: %s' % commandline)
-
-    # run SEXTRACTOR and wait for it to finish
-    try:
-        sex = subprocess.Popen(shlex.split(commandline),
-                               stdout=DEVNULL,
-                               stderr=DEVNULL,
-                               close_fds=True)
-        # do not direct stdout to subprocess.PIPE:
-        # for large FITS files, PIPE will clog, stalling
-        # subprocess.Popen
-    except Exception as e:
-        print('Source Extractor call:', (e))
-        logging.error('Source Extractor call:', (e))
+    # determine whether this frame is extracted in tiles
+    tiles = frame_tiles(fits.getheader(filename, ignore_missing_end=True),
+                        param['obsparam'])
+    cacheoptions = optionstring
+    if tiles is not None:
+        cacheoptions += ' -TILES %d,%d' % \
+            tuple(param['obsparam']['extraction_tiles'])
+
+    # check extraction cache; the cache key covers the image, mask,
+    # configuration and parameter files, as well as all options
+    backend = param.get('backend', conf.extraction_backend)
+    ldac_hdulist, header = None, None
+    cache, cachekey, cached = None, None, False
+    if conf.extraction_cache and not param.get('nocache', False):
+        try:
+            cache = ExtractionCache(conf.extraction_cache_dir,
+                                    conf.extraction_cache_size)
+            cachekey = cache.key(filename,
+                                 param['obsparam']['sex-config-file'],
+                                 cacheoptions,
+                                 mask_file=param.get('mask_file'),
+                                 paramfile=param.get('paramfile'),
+                                 backend=backend)
+            cached = cache.retrieve(cachekey, ldacname)
+        except (IOError, OSError, sqlite3.Error) as e:
+            logging.warning('extraction cache not available: %s' % str(e))
+            cache = None
+
+    if cached:
+        logging.info('use cached Source Extractor output for %s (%s)' %
+                     (filename, cachekey))
+    elif tiles is not None:
+        # tiled extraction; returns merged LDAC and header from memory
+        try:
+            ldac_hdulist, header = extract_tiled(param, filename, ldacname,
+                                                 optionstring, backend,
+                                                 tiles, n_tile_workers)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            print('tiled source extraction:', (e))
+            logging.error('tiled source extraction: %s' % str(e))
+            return None
+        if ldac_hdulist is None:
+            return None
+    elif backend == 'numpy':
+        # in-process extraction; returns LDAC and header from memory
+        try:
+            ldac_hdulist, header = detection.extract(filename, param,
+                                                     ldacname)
+        except Exception as e:
+            print('numpy source extraction:', (e))
+            logging.error('numpy source extraction: %s' % str(e))
+            return None
+    elif not run_sextractor(param, filename, ldacname, optionstring):
         return None
 
-    sex.wait()
-
-    # read in LDAC file
-    ldac_filename = filename[:filename.find('.fit')]+'.ldac'
-    ldac_data = catalog(ldac_filename)
+    # check LDAC file
+    ldac_filename = ldacname
 
     if not os.path.exists(ldac_filename):
         print('No Source Extractor output for frame', filename)
         logging.error('No Source Extractor output')
         return None
 
-    # make sure ldac file contains data
-    if ldac_data.read_ldac(ldac_filename, maxflag=None) is None:
+    # make sure ldac file contains data; only its headers are read
+    shape = ldac_shape(ldac_filename, hdulist=ldac_hdulist)
+    if shape is None:
         print('LDAC file empty', filename, end=' ')
-        logging.error('LDAC file empty: ' + sex_output)
+        logging.error('LDAC file empty: %s' % ldac_filename)
         return None
 
-    out['catalog_data'] = ldac_data
+    out['n_sources'], out['n_columns'] = shape
 
-    # update image header with aperture radius and other information
-    hdu = fits.open(filename, mode='update', ignore_missing_end=True)
-    obsparam = param['obsparam']
-    # observation midtime
-    if obsparam['obsmidtime_jd'] in hdu[0].header:
-        midtimjd = hdu[0].header[obsparam['obsmidtime_jd']]
-    else:
-        if obsparam['date_keyword'].find('|') == -1:
-            midtimjd = dateobs_to_jd(
-                hdu[0].header[obsparam['date_keyword']]) + \
-                float(hdu[0].header[obsparam['exptime']])/2./86400.
-        else:
-            datetime = hdu[0].header[
-                obsparam['date_keyword'].split('|')[0]] + \
-                'T'+hdu[0].header[
-                obsparam['date_keyword'].split('|')[1]]
-            midtimjd = dateobs_to_jd(datetime) + \
-                float(hdu[0].header[
-                    obsparam['exptime']])/2./86400.
-    out['time'] = midtimjd
-
-    # hdu[0].header['APRAD'] = \
-    #     (",".join([str(aprad) for aprad in self.param['aprad']]), \
-    #      'aperture phot radius (px)')
-    # hdu[0].header['SEXSNR'] = \
-    #     (self.param['sex_snr'],
-    #      'Sextractor detection SNR threshold')
-    # hdu[0].header['SEXAREA'] = \
-    #     (self.param['source_minarea'],
-    #      'Sextractor source area threshold (px)')
-    out['fits_header'] = hdu[0].header
-
-    hdu.flush()
-    hdu.close()
+    # store Source Extractor output in extraction cache
+    if cache is not None and not cached:
+        try:
+            cache.put(cachekey, ldac_filename,
+                      description=os.path.basename(filename))
+        except (IOError, OSError, sqlite3.Error) as e:
+            logging.warning('could not write to extraction cache: %s' %
+                            str(e))
+
+    # read image header, unless it is already available; only the
+    # observation midtime is returned
+    if header is None:
+        header = fits.getheader(filename, ignore_missing_end=True)
+
+    out['time'] = frame_midtime(header, param['obsparam'])
 
     logging.info("%d sources extracted from frame %s" %
-                 (len(ldac_data.data), filename))
+                 (out['n_sources'], filename))
     if not param['quiet']:
         print("%d sources extracted from frame %s" %
-              (len(ldac_data.data), filename))
+              (out['n_sources'], filename))
 
     return out
 
 
-def extract_multiframe(filenames, parameters):
+def prepare_extraction(filenames, parameters):
     """
-    wrapper to run multi-threaded source extraction
-    input: FITS filenames, parameters dictionary: telescope, obsparam, aprad,
-                                                  quiet, sex_snr, source_minarea
-    output: result properties
+    complete extraction parameters based on the first frame: telescope,
+    obsparam, aperture diameters and mask file
+    input: FITS filenames, parameters dictionary (see extract_multiframe)
+    output: True if successful, False otherwise
     """
 
-    logging.info('extract sources from %d files using Source Extractor' %
-                 len(filenames))
-    logging.info('extraction parameters: %s' % repr(parameters))
-
     # obtain telescope information from image header or override manually
     hdu = fits.open(filenames[0], ignore_missing_end=True, verify='silentfix')
 
@@ -237,14 +556,15 @@ def extract_multiframe(filenames, parameters):
                              filenames[0])
             print('ERROR: TEL_KEYW not in image header;' +
                   'has this image run through register?')
-            return {}
+            return False
     try:
         parameters['obsparam'] = _pp_conf.telescope_parameters[
             parameters['telescope']]
     except KeyError:
-        print("ERROR: telescope '%s' is unknown." % telescope)
-        logging.critical('ERROR: telescope \'%s\' is unknown.' % telescope)
-        return {}
+        print("ERROR: telescope '%s' is unknown." % parameters['telescope'])
+        logging.critical('ERROR: telescope \'%s\' is unknown.' %
+                         parameters['telescope'])
+        return False
 
     # set aperture photometry DIAMETER as string
     if _pp_conf.photmode == 'APER':
@@ -272,15 +592,55 @@ def extract_multiframe(filenames, parameters):
 
     hdu.close()
 
-    # thread and queue handling
+    return True
+
+
+def extract_unordered(filenames, parameters):
+    """
+    submit frames to the pipeline executor; the number of frames that
+    are processed at the same time is limited by their size, including
+    the tiles of tiled frames that are extracted at the same time
+    input: FITS filenames, completed parameters dictionary
+    output: generator of (index into filenames, result) tuples in the
+            order in which frames finish; result is None if the
+            extraction failed
+    """
+    executor = get_executor()
+    n_tile_workers = tile_workers(executor.n_workers)
+    data = [(parameters, filename, n_tile_workers) for filename in filenames]
+    for idx, frame in executor.imap_unordered(
+            extract_singleframe, data,
+            sizes=[extraction_memory(filename, parameters, n_tile_workers)
+                   for filename in filenames]):
+        if frame is None:
+            logging.error('extraction failed for frame %s' % filenames[idx])
+        else:
+            frame['parameters'] = parameters
+        yield idx, frame
+
 
-    pool = Pool()
-    data = [(parameters, filename) for filename in filenames]
-    output = pool.map(extract_singleframe, data)
+def extract_multiframe(filenames, parameters):
+    """
+    wrapper to run multi-threaded source extraction
+    input: FITS filenames, parameters dictionary: telescope, obsparam, aprad,
+                                                  quiet, sex_snr, source_minarea,
+                                                  nocache, backend (optional)
+    output: result properties
+    """
+
+    logging.info('extract sources from %d files using Source Extractor' %
+                 len(filenames))
+    logging.info('extraction parameters: %s' % repr(parameters))
+
+    if not prepare_extraction(filenames, parameters):
+        return {}
+
+    output = [None]*len(filenames)
+    for idx, frame in extract_unordered(filenames, parameters):
+        output[idx] = frame
 
     # check if extraction was successful
-    if any(['catalog_data' not in list(output[i].keys())
-            for i in range(len(output))]):
+    if any([frame is None for frame in output]):
         return None
 
     # output content
@@ -288,15 +648,66 @@ def extract_multiframe(filenames, parameters):
     # { 'fits_filename': fits filename,
     #   'ldac_filename': LDAC filename,
     #   'parameters'   : source extractor input parameters,
-    #   'catalog_data' : full LDAC catalog data,
+    #   'n_sources'    : number of sources in LDAC file,
+    #   'n_columns'    : number of columns in LDAC file,
     #   'time'         : observation midtime (JD),
-    #   'fits_header'  : complete fits header
+    #   'catalog_data' : full LDAC catalog data (read on first access),
+    #   'fits_header'  : complete fits header (read on first access)
     # }
     ###
 
     return output
 
 
+def extract_multiframe_iter(filenames, parameters):
+    """
+    generator variant of extract_multiframe: results for individual
+    frames are yielded as soon as they are available, in arbitrary
+    order; frames for which the extraction failed are skipped
+    input: see extract_multiframe
+    output: result properties (see extract_multiframe) for each frame
+    """
+
+    logging.info('extract sources from %d files using Source Extractor' %
+                 len(filenames))
+    logging.info('extraction parameters: %s' % repr(parameters))
+
+    if not prepare_extraction(filenames, parameters):
+        return
+
+    for idx, frame in extract_unordered(filenames, parameters):
+        if frame is not None:
+            yield frame
+
+
+def extract_multiframe_consume(filenames, parameters, consumer):
+    """
+    run source extraction and apply `consumer` to the result of each
+    frame as soon as it is available; frames are processed by the
+    consumer while other frames are still being extracted, and only the
+    consumer's return values are kept in memory
+    input: FITS filenames, parameters dictionary (see extract_multiframe),
+           consumer function taking the result properties of one frame
+    output: list of consumer return values in the order of filenames;
+            None for frames where the extraction failed; None if the
+            extraction could not be set up
+    """
+
+    logging.info('extract sources from %d files using Source Extractor' %
+                 len(filenames))
+    logging.info('extraction parameters: %s' % repr(parameters))
+
+    if not prepare_extraction(filenames, parameters):
+        return None
+
+    output = [None]*len(filenames)
+    for idx, frame in extract_unordered(filenames, parameters):
+        if frame is not None:
+            output[idx] = consumer(frame)
+
+    return output
+
+
 # MAIN
 
 if __name__ == '__main__':
@@ -322,6 +733,12 @@ if __name__ == '__main__':
                         action="store_true")
     parser.add_argument('-quiet', help='no logging',
                         action="store_true")
+    parser.add_argument('-backend',
+                        help='source extraction backend',
+                        choices=['sex', 'numpy'], default=None)
+    parser.add_argument('-nocache',
+                        help='do not use the extraction cache',
+                        action="store_true")
     parser.add_argument('images', help='images to process', nargs='+')
 
     args = parser.parse_args()
@@ -333,16 +750,21 @@ if __name__ == '__main__':
     ignore_saturation = args.ignore_saturation
     nodeblending = args.nodeblending
     quiet = args.quiet
+    nocache = args.nocache
+    backend = args.backend
     filenames = args.images
 
     # prepare parameter dictionary
     parameters = {'sex_snr': sex_snr, 'source_minarea': source_minarea,
                   'aprad': aprad, 'telescope': telescope,
                   'ignore_saturation': ignore_saturation,
-                  'nodeblending': nodeblending, 'quiet': quiet}
+                  'nodeblending': nodeblending, 'quiet': quiet,
+                  'nocache': nocache}
 
     if paramfile is not None:
         parameters['paramfile'] = paramfile
+    if backend is not None:
+        parameters['backend'] = backend
 
     # call extraction wrapper
     extraction = extract_multiframe(filenames, parameters)
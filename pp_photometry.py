@@ -31,7 +31,6 @@ import argparse
 from astropy.io import fits
 import matplotlib
 matplotlib.use('Agg')
-from astroquery.jplhorizons import Horizons
 
 # only import if Python3 is used
 if sys.version_info > (3, 0):
@@ -40,8 +39,11 @@ if sys.version_info > (3, 0):
 
 # pipeline-specific modules
 import _pp_conf
+import ephemeris
 import pp_extract
 from catalog import *
+from executor import get_executor
+from pp_setup import confphotometry as conf
 from toolbox import *
 from diagnostics import photometry as diag
 
@@ -52,6 +54,121 @@ logging.basicConfig(filename=_pp_conf.log_filename,
                     datefmt=_pp_conf.log_datefmt)
 
 
+def update_header(data):
+    """
+    add header cards to image header
+    input: (filename, dictionary of header cards)
+    """
+    filename, cards = data
+    hdu = fits.open(filename, mode='update', ignore_missing_end=True)
+    for key, card in cards.items():
+        hdu[0].header[key] = card
+    hdu.flush()
+    hdu.close()
+
+
+def slice_apertures(data):
+    """
+    turn the multi-aperture LDAC file of a frame into a single-aperture
+    LDAC file by picking aperture index `idx` from all vector columns;
+    the multi-aperture LDAC file is kept with suffix `_cog.ldac`
+    input: (filename, idx)
+    output: True if successful, False otherwise
+    """
+    filename, idx = data
+    ldac_filename = filename[:filename.find('.fit')]+'.ldac'
+    cog_filename = filename[:filename.find('.fit')]+'_cog.ldac'
+
+    if not os.path.exists(ldac_filename):
+        return False
+
+    hdulist = fits.open(ldac_filename)
+    if (len(hdulist) < 3 or 'FLUX_APER' not in hdulist[2].columns.names or
+            hdulist[2].data['FLUX_APER'].ndim != 2 or
+            hdulist[2].data['FLUX_APER'].shape[1] <= idx):
+        hdulist.close()
+        return False
+
+    columns = []
+    for col in hdulist[2].columns:
+        array = hdulist[2].data[col.name]
+        fmt = col.format
+        if array.ndim == 2:
+            array = array[:, idx]
+            fmt = str(col.format).lstrip('0123456789')
+        columns.append(fits.Column(name=col.name, format=fmt,
+                                   unit=col.unit, disp=col.disp,
+                                   array=array))
+    objects = fits.BinTableHDU.from_columns(columns)
+    objects.header['EXTNAME'] = 'LDAC_OBJECTS'
+    ldac = fits.HDUList([fits.PrimaryHDU(header=hdulist[0].header),
+                         hdulist[1].copy(), objects])
+    ldac.writeto(ldac_filename+'.tmp', overwrite=True)
+    hdulist.close()
+
+    os.replace(ldac_filename, cog_filename)
+    os.replace(ldac_filename+'.tmp', ldac_filename)
+
+    return True
+
+
+def target_positions(filenames, parameters):
+    """
+    query the primary target positions for all frames at once (see
+    ephemeris.ephemerides)
+    input: filenames, photometry parameters
+    return: dictionary {filename: (targetname, ra, dec)}; ra and dec
+            are None if no position is available
+    """
+    obsparam = parameters['obsparam']
+
+    frames = {}
+    for filename in filenames:
+        header = fits.getheader(filename, ignore_missing_end=True)
+
+        targetname = header[obsparam['object']]
+        if parameters['manobjectname'] is not None:
+            targetname = parameters['manobjectname'].translate(
+                _pp_conf.target2filename)
+
+        # derive MIDTIMJD, if not yet in the FITS header
+        if not 'MIDTIMJD' in header:
+            exptime = float(header[obsparam['exptime']])
+            if obsparam['date_keyword'].find('|') == -1:
+                date = header[obsparam['date_keyword']]
+                date = dateobs_to_jd(date) + exptime/2./86400.
+            else:
+                date_key = obsparam['date_keyword'].split('|')[0]
+                time_key = obsparam['date_keyword'].split('|')[1]
+                date = header[date_key]+'T' + header[time_key]
+                date = dateobs_to_jd(date) + exptime/2./86400.
+        else:
+            date = header['MIDTIMJD']
+
+        frames[filename] = (targetname, date)
+
+    # one ephemerides query for all frames of each target
+    positions = {}
+    for targetname in set(target for target, date in frames.values()):
+        target_frames = [filename for filename in frames
+                         if frames[filename][0] == targetname]
+        eph = ephemeris.ephemerides(
+            targetname.replace('_', ' '),
+            [frames[filename][1] for filename in target_frames],
+            str(obsparam['observatory_code']))
+        if eph is None:
+            print('Target (%s) not a small body' % targetname)
+            logging.warning('Target (%s) not a small body' % targetname)
+        for i, filename in enumerate(target_frames):
+            if eph is None or numpy.isnan(eph['RA'][i]):
+                positions[filename] = (targetname, None, None)
+            else:
+                positions[filename] = (targetname, eph['RA'][i],
+                                       eph['DEC'][i])
+
+    return positions
+
+
 def curve_of_growth_analysis(filenames, parameters,
                              nodeblending=False, display=False,
                              diagnostics=False):
@@ -82,9 +199,6 @@ def curve_of_growth_analysis(filenames, parameters,
                          'nodeblending': nodeblending,
                          'quiet': False}
 
-    extraction = pp_extract.extract_multiframe(filenames, extractparameters)
-    extraction = [e for e in extraction if len(e) > 0]
-
     # curve-of-growth analysis
 
     # arrays for accumulating source information as a function of aprad
@@ -93,66 +207,46 @@ def curve_of_growth_analysis(filenames, parameters,
     background_snr = []  # numpy.zeros(len(aprads))
     target_snr = []  # numpy.zeros(len(aprads))
 
-    for filename in filenames:
+    # pull target coordinates for all frames from Horizons; frames are
+    # processed in the order their extraction finishes, hence fall back
+    # to background sources before processing any of them
+    if not parameters['background_only']:
+        positions = target_positions(filenames, parameters)
+        for filename in filenames:
+            targetname, target_ra, target_dec = positions[filename]
+            if target_ra is None:
+                logging.warning('WARNING: No position from Horizons!' +
+                                'Name (%s) correct?' % targetname)
+                logging.info('proceeding with background sources analysis')
+                parameters['background_only'] = True
+                break
+        else:
+            logging.info('ephemerides for %s pulled from Horizons' %
+                         ', '.join(sorted(set(
+                             position[0] for position in positions.values()))))
+
+    # process frames as soon as their extraction is finished
+    extraction = []
+    for frame in pp_extract.extract_multiframe_iter(filenames,
+                                                    extractparameters):
+
+        extraction.append(frame)
+        filename = frame['fits_filename']
 
         if display:
             print('processing curve-of-growth for frame %s' % filename)
 
         if not parameters['background_only']:
-
-            hdu = fits.open(filename, ignore_missing_end=True)
-
-            # pull target coordinates from Horizons
-            targetname = hdu[0].header[obsparam['object']]
-            if parameters['manobjectname'] is not None:
-                targetname = parameters['manobjectname'].translate(
-                    _pp_conf.target2filename)
-
-            image = hdu[0].data
-
-            # derive MIDTIMJD, if not yet in the FITS header
-            obsparam = parameters['obsparam']
-            if not 'MIDTIMJD' in hdu[0].header:
-                exptime = float(hdu[0].header[obsparam['exptime']])
-                if obsparam['date_keyword'].find('|') == -1:
-                    date = hdu[0].header[obsparam['date_keyword']]
-                    date = dateobs_to_jd(date) + exptime/2./86400.
-                else:
-                    date_key = obsparam['date_keyword'].split('|')[0]
-                    time_key = obsparam['date_keyword'].split('|')[1]
-                    date = hdu[0].header[date_key]+'T' +\
-                        hdu[0].header[time_key]
-                    date = dateobs_to_jd(date) + exptime/2./86400.
-            else:
-                date = hdu[0].header['MIDTIMJD']
-
-            # call HORIZONS to get target coordinates
-            obj = Horizons(targetname.replace('_', ' '),
-                           epochs=date,
-                           location=str(obsparam['observatory_code']))
-            try:
-                eph = obj.ephemerides()
-                n = len(eph)
-            except ValueError:
-                print('Target (%s) not a small body' % targetname)
-                logging.warning('Target (%s) not a small body' % targetname)
-                n = None
-
-            if n is None or n == 0:
-                logging.warning('WARNING: No position from Horizons!' +
-                                'Name (%s) correct?' % targetname)
-                logging.warning('HORIZONS call: %s' % obj.uri)
-                logging.info('proceeding with background sources analysis')
-                parameters['background_only'] = True
-            else:
-                logging.info('ephemerides for %s pulled from Horizons' %
-                             targetname)
-                target_ra, target_dec = eph[0]['RA'], eph[0]['DEC']
+            # target coordinates (see target_positions)
+            targetname, target_ra, target_dec = positions[filename]
 
         # pull data from LDAC file
         ldac_filename = filename[:filename.find('.fit')]+'.ldac'
         data = catalog('Sextractor_LDAC')
-        data.read_ldac(ldac_filename, maxflag=3)
+        data.read_ldac(ldac_filename, maxflag=3,
+                       columns=['XWIN_WORLD', 'YWIN_WORLD', 'FLAGS',
+                                'FLUX_'+_pp_conf.photmode,
+                                'FLUXERR_'+_pp_conf.photmode])
 
         if data.shape[0] == 0:
             continue
@@ -160,16 +254,15 @@ def curve_of_growth_analysis(filenames, parameters,
         # identify target and extract its curve-of-growth
         n_target_identified = 0
         if not parameters['background_only']:
-            residuals = numpy.sqrt((data['ra_deg']-target_ra)**2 +
-                                   (data['dec_deg']-target_dec)**2)
-
-            target_idx = numpy.argmin(residuals)
-            if residuals[target_idx] > _pp_conf.pos_epsilon/3600:
+            residual, target_idx = data.sky_index().query(target_ra,
+                                                          target_dec)
+            residual, target_idx = residual[0], target_idx[0]
+            if residual > _pp_conf.pos_epsilon/3600:
                 logging.warning(('WARNING: frame %s, large residual to ' +
                                  'HORIZONS position of %s: %f arcsec; ' +
                                  'ignore this frame') %
                                 (filename, targetname,
-                                 residuals[numpy.argmin(residuals)]*3600.))
+                                 residual*3600.))
             else:
                 target_flux.append(data[target_idx]['FLUX_'+_pp_conf.photmode] /
                                    max(data[target_idx][
@@ -200,6 +293,10 @@ def curve_of_growth_analysis(filenames, parameters,
                                       max(src['FLUX_'+_pp_conf.photmode] /
                                           src['FLUXERR_'+_pp_conf.photmode]))
 
+    # restore frame order
+    frame_order = {filename: idx for idx, filename in enumerate(filenames)}
+    extraction.sort(key=lambda frame: frame_order[frame['fits_filename']])
+
     # investigate curve-of-growth
 
     logging.info('investigate curve-of-growth based on %d frames' %
@@ -265,6 +362,7 @@ def curve_of_growth_analysis(filenames, parameters,
 
     output['aprad_strategy'] = aprad_strategy
     output['optimum_aprad'] = optimum_aprad
+    output['optimum_aprad_idx'] = optimum_aprad_idx
     output['pos_epsilon'] = _pp_conf.pos_epsilon
     output['fluxlimit_aprad'] = _pp_conf.fluxlimit_aprad
     output['fluxmargin_aprad'] = _pp_conf.fluxmargin_aprad
@@ -300,6 +398,7 @@ def curve_of_growth_analysis(filenames, parameters,
     #
     # { 'aprad_strategy'  : optimum aperture finding strategy,
     #   'optimum_aprad'   : optimum aperature radius,
+    #   'optimum_aprad_idx': index of optimum aperture radius,
     #   'pos_epsilon'     : required positional uncertainty ("),
     #   'fluxlimit_aprad' : min flux for both target and background,
     #   'fluxmargin_aprad': max flux difference between target and background,
@@ -321,12 +420,13 @@ def curve_of_growth_analysis(filenames, parameters,
         diag.add_photometry(output, extraction)
 
     # update image headers
-    for filename in filenames:
-        hdu = fits.open(filename, mode='update', ignore_missing_end=True)
-        hdu[0].header['APRAD'] = (optimum_aprad, 'aperture phot radius (px)')
-        hdu[0].header['APIDX'] = (optimum_aprad_idx, 'optimum aprad index')
-        hdu.flush()
-        hdu.close()
+    get_executor().map(update_header,
+                       [(filename,
+                         {'APRAD': (optimum_aprad,
+                                    'aperture phot radius (px)'),
+                          'APIDX': (optimum_aprad_idx,
+                                    'optimum aprad index')})
+                        for filename in filenames])
 
     # display results
     if display:
@@ -360,13 +460,13 @@ def photometry(filenames, sex_snr, source_minarea, aprad,
                'quiet': not display}
 
     # do curve-of-growth analysis if aprad not provided
-    for filename in filenames:
-        hdu = fits.open(filename, mode='update',
-                        ignore_missing_end=True)
-        hdu[0].header['PHOTMODE'] = (_pp_conf.photmode,
-                                     'PP photometry mode')
-        hdu.flush()
-        hdu.close()
+    get_executor().map(update_header,
+                       [(filename, {'PHOTMODE': (_pp_conf.photmode,
+                                                 'PP photometry mode')})
+                        for filename in filenames])
+
+    # curve-of-growth analysis results (only if aprad is not provided)
+    cog = None
 
     if _pp_conf.photmode == 'APER':
         if aprad is None:
@@ -382,13 +482,11 @@ def photometry(filenames, sex_snr, source_minarea, aprad,
             aprad = cog['optimum_aprad']
         else:
             # add manually selected aprad to image headers
-            for filename in filenames:
-                hdu = fits.open(filename, mode='update',
-                                ignore_missing_end=True)
-                hdu[0].header['APRAD'] = (aprad,
-                                          'manual aperture phot radius (px)')
-                hdu.flush()
-                hdu.close()
+            get_executor().map(update_header,
+                               [(filename,
+                                 {'APRAD': (aprad, 'manual aperture '
+                                            'phot radius (px)')})
+                                for filename in filenames])
 
         # run extract using (optimum) aprad
         photpar['aprad'] = round(aprad, 2)
@@ -416,14 +514,25 @@ def photometry(filenames, sex_snr, source_minarea, aprad,
 
     photpar['photmode'] = _pp_conf.photmode
 
-    pp_extract.extract_multiframe(filenames, photpar)
+    # reuse curve-of-growth extraction, if requested; frames that cannot
+    # be reused are extracted again
+    if (conf.reuse_cog_extraction and cog is not None and
+            cog['optimum_aprad_idx'] is not None):
+        logging.info('build single-aperture catalogs from curve-of-growth '
+                     'extraction (aperture index %d)' %
+                     cog['optimum_aprad_idx'])
+        sliced = get_executor().map(slice_apertures,
+                                    [(filename, cog['optimum_aprad_idx'])
+                                     for filename in filenames])
+        filenames = [filename for idx, filename in enumerate(filenames)
+                     if not sliced[idx]]
+
+    if len(filenames) > 0:
+        pp_extract.extract_multiframe(filenames, photpar)
 
     logging.info('Done! -----------------------------------------------------')
 
-    if 'cog' in list(locals().keys()):
-        return cog
-    else:
-        return None
+    return cog
 
 
 # MAIN
@@ -39,6 +39,7 @@ import _pp_conf
 from catalog import *
 import pp_extract
 import toolbox
+from executor import get_executor
 from diagnostics import registration as diag
 
 # only import if Python3 is used
@@ -52,6 +53,53 @@ logging.basicConfig(filename=_pp_conf.log_filename,
                     datefmt=_pp_conf.log_datefmt)
 
 
+def update_wcs_header(data):
+    """
+    update the image header with the SCAMP WCS solution
+    input: (filename, telescope, refcat, cleanup); if cleanup is True,
+           the SCAMP .head file is removed
+    """
+
+    filename, telescope, refcat, cleanup = data
+
+    # remove fake wcs header keys
+    fake_wcs_keys = ['RADECSYS', 'CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2',
+                     'CRPIX1', 'CRPIX2', 'CD1_1', 'CD1_2', 'CD2_1',
+                     'CD2_2', 'RADESYS']
+    hdu = fits.open(filename, mode='update', verify='silentfix',
+                    ignore_missing_end=True)
+    for fake_key in fake_wcs_keys:
+        hdu[0].header[fake_key] = ''
+
+    # read new header files
+    newhead = open(filename[:filename.find(
+        '.fit')]+'.head', 'r').readlines()
+
+    for line in newhead:
+        key = line[:8].strip()
+        try:
+            value = float(line[10:30].replace('\'', ' ').strip())
+        except ValueError:
+            value = line[10:30].replace('\'', ' ').strip()
+        comment = line[30:].strip()
+        if key.find('END') > -1:
+            break
+        # print key, '|',  value, '|',  comment
+        hdu[0].header[key] = (str(value), comment)
+
+    # other header keywords
+    hdu[0].header['RADECSYS'] = (hdu[0].header['RADESYS'],
+                                 'copied from RADESYS')
+    hdu[0].header['TEL_KEYW'] = (telescope, 'pipeline telescope keyword')
+    hdu[0].header['REGCAT'] = (refcat, 'catalog used in WCS registration')
+    hdu.flush(output_verify='silentfix')
+    hdu.close()
+
+    # cleaning up (in case the registration succeeded)
+    if cleanup:
+        os.remove(filename[:filename.find('.fit')]+'.head')
+
+
 def register(filenames, telescope, sex_snr, source_minarea, aprad,
              mancat, obsparam, source_tolerance, nodeblending,
              display=False, diagnostics=False):
@@ -104,28 +152,42 @@ def register(filenames, telescope, sex_snr, source_minarea, aprad,
                              'nodeblending': nodeblending,
                              'quiet': False}
 
-        extraction = pp_extract.extract_multiframe(filenames,
-                                                   extractparameters)
-
-        if extraction is None:
+        def read_frame(frame):
+            """read catalog of a frame as soon as its extraction is
+            finished; only frames with enough sources are considered"""
+            record = {key: frame[key] for key in
+                      ['fits_filename', 'ldac_filename', 'parameters',
+                       'time']}
+            if frame['n_sources'] <= 10:
+                return record, None
+            cat = catalog(frame['ldac_filename'])
+            cat.read_ldac(frame['ldac_filename'],
+                          frame['fits_filename'],
+                          object_keyword=obsparam['object'],
+                          exptime_keyword=obsparam['exptime'],
+                          maxflag=0,
+                          columns=['XWIN_WORLD', 'YWIN_WORLD', 'FLAGS'])
+            return record, cat
+
+        frames = pp_extract.extract_multiframe_consume(filenames,
+                                                       extractparameters,
+                                                       read_frame)
+
+        if frames is None or any([frame is None for frame in frames]):
             if display:
                 print('ERROR: extraction was not successful')
             logging.error('extraction was not successful')
             return None
 
+        # extraction results without catalog data and image headers
+        extraction = [frame[0] for frame in frames]
+
         # check if enough sources have been detected in images
-        ldac_files = []
-        ldac_catalogs = []
-        for frame in extraction:
-            if frame['catalog_data'].shape[0] > 10:
-                ldac_files.append(frame['ldac_filename'])
-                cat = catalog(frame['ldac_filename'])
-                cat.read_ldac(frame['ldac_filename'],
-                              frame['fits_filename'],
-                              object_keyword=obsparam['object'],
-                              exptime_keyword=obsparam['exptime'],
-                              maxflag=0)
-                ldac_catalogs.append(cat)
+        ldac_files = [frame[0]['ldac_filename'] for frame in frames
+                      if frame[1] is not None]
+        ldac_catalogs = [frame[1] for frame in frames
+                         if frame[1] is not None]
+        del(frames)
 
         if len(ldac_files) == 0:
             if display:
@@ -329,43 +391,10 @@ def register(filenames, telescope, sex_snr, source_minarea, aprad,
     # was successful
     logging.info('update image headers with WCS solutions ')
 
-    for filename in goodfits:
-        # remove fake wcs header keys
-        fake_wcs_keys = ['RADECSYS', 'CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2',
-                         'CRPIX1', 'CRPIX2', 'CD1_1', 'CD1_2', 'CD2_1',
-                         'CD2_2', 'RADESYS']
-        hdu = fits.open(filename, mode='update', verify='silentfix',
-                        ignore_missing_end=True)
-        for fake_key in fake_wcs_keys:
-            hdu[0].header[fake_key] = ''
-
-        # read new header files
-        newhead = open(filename[:filename.find(
-            '.fit')]+'.head', 'r').readlines()
-
-        for line in newhead:
-            key = line[:8].strip()
-            try:
-                value = float(line[10:30].replace('\'', ' ').strip())
-            except ValueError:
-                value = line[10:30].replace('\'', ' ').strip()
-            comment = line[30:].strip()
-            if key.find('END') > -1:
-                break
-            # print key, '|',  value, '|',  comment
-            hdu[0].header[key] = (str(value), comment)
-
-        # other header keywords
-        hdu[0].header['RADECSYS'] = (hdu[0].header['RADESYS'],
-                                     'copied from RADESYS')
-        hdu[0].header['TEL_KEYW'] = (telescope, 'pipeline telescope keyword')
-        hdu[0].header['REGCAT'] = (refcat, 'catalog used in WCS registration')
-        hdu.flush(output_verify='silentfix')
-        hdu.close()
-
-        # cleaning up (in case the registration succeeded)
-        if len(goodfits) == len(filenames):
-            os.remove(filename[:filename.find('.fit')]+'.head')
+    get_executor().map(update_wcs_header,
+                       [(filename, telescope, refcat,
+                         len(goodfits) == len(filenames))
+                        for filename in goodfits])
 
     if len(badfits) == len(filenames):
         if display:
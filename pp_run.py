@@ -53,6 +53,7 @@ import pp_register
 import pp_photometry
 import pp_calibrate
 import pp_distill
+from executor import shutdown_after
 from diagnostics import registration as diag
 
 # setup logging
@@ -62,11 +63,13 @@ logging.basicConfig(filename=_pp_conf.log_filename,
                     datefmt=_pp_conf.log_datefmt)
 
 
+@shutdown_after
 def run_the_pipeline(filenames, man_targetname, man_filtername,
                      fixed_aprad, source_tolerance, solar,
                      rerun_registration, asteroids, keep_wcs):
     """
-    wrapper to run the photometry pipeline
+    wrapper to run the photometry pipeline; worker processes used by
+    all pipeline tasks are shut down once this function returns
     """
 
     # increment pp process idx
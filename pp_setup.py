@@ -34,12 +34,79 @@ class Conf():
 
     diagnostics = True  # produce diagnostic files and website?
 
+    # parallel processing
+    n_workers = None  # number of worker processes (None: number of cpus)
+    worker_memory_fraction = 0.5  # fraction of available memory to use
+    frame_memory_factor = 4  # memory use per task in units of frame size
+
+    # photometry database format written by pp_calibrate and read by
+    # pp_distill: 'sqlite' (.db files) or 'fits' (.fdb files; columnar
+    # FITS binary tables with memory-mapped column access)
+    database_format = 'sqlite'
+
+
+class ConfCatalog(Conf):
+    """configuration setup for reference catalog queries (catalog.py)"""
+
+    # cache reference catalog queries in HEALPix tiles; repeated
+    # queries of the same sky area do not require Vizier
+    catalog_cache = True  # use catalog cache?
+    catalog_cache_dir = '~/.pp_cache/catalogs'  # cache directory
+    catalog_cache_size = 20*1024**3  # cache size budget in bytes
+    catalog_cache_order = 8  # HEALPix order of tiles (~0.23 deg)
+    catalog_cache_fetch_limit = 1000000  # row limit for tile queries
+    catalog_offline = False  # never query Vizier; use cached tiles only
+
+    # split cone queries with large radii into sub-cones that are
+    # fetched concurrently
+    catalog_shard_threshold = 2.0  # shard cones larger than this (deg)
+    catalog_shard_radius = 1.0  # sub-cone radius (deg)
+    catalog_shard_workers = 4  # number of concurrent sub-cone queries
+    catalog_query_retries = 3  # retries of failed Vizier queries
+
+
+class ConfEphemeris(Conf):
+    """configuration setup for ephemeris queries (ephemeris.py)"""
+
+    # Horizons ephemerides are queried for all epochs of a target at
+    # once and stored in an sqlite cache
+    ephemeris_cache = True  # use ephemeris cache?
+    ephemeris_cache_file = '~/.pp_cache/ephemerides.db'  # cache file
+    # cached positions are queried again after this time (d; None: never)
+    # to pick up updated orbit solutions, e.g., of newly discovered NEOs
+    ephemeris_cache_expiry = 1
+    ephemeris_batch_size = 50  # max number of epochs per query
+    # epochs that are not cached are interpolated linearly between
+    # cached epochs that are less than this apart (d)
+    ephemeris_interpolation_gap = 10/1440.
+
 
 class ConfPrepare(Conf):
     """configuration setup for pp_prepare"""
     pass
 
 
+class ConfExtract(Conf):
+    """configuration setup for pp_extract"""
+
+    # source extraction backend: 'sex' runs Source Extractor, 'numpy'
+    # uses the in-process implementation in detection.py
+    extraction_backend = 'sex'
+
+    # cache Source Extractor output; repeated runs on identical frames
+    # with identical parameters will use the cached LDAC file
+    extraction_cache = True  # use extraction cache?
+    extraction_cache_dir = '~/.pp_cache/extraction'  # cache directory
+    extraction_cache_size = 10*1024**3  # cache size budget in bytes
+
+    # split large frames into overlapping tiles that are extracted
+    # concurrently; tile size and overlap are defined in the telescope
+    # setup ('extraction_tiles')
+    extraction_tiling = True  # use tiled extraction where defined?
+    # concurrent tiles per frame (None: cpus per executor worker)
+    extraction_tile_workers = None
+
+
 class ConfRegister(Conf):
     """configuration setup for pp_register"""
     pass
@@ -47,7 +114,12 @@ class ConfRegister(Conf):
 
 class ConfPhotometry(Conf):
     """configuration setup for pp_photometry"""
-    pass
+
+    # build final single-aperture catalogs from the multi-aperture
+    # catalogs of the curve-of-growth analysis instead of running the
+    # source extraction again; note that these catalogs lack the
+    # AUTO and FLUX_GROWTH columns (see setup/twentyapertures.sexparam)
+    reuse_cog_extraction = False
 
 
 class ConfCalibrate(Conf):
@@ -55,6 +127,10 @@ class ConfCalibrate(Conf):
 
     # write photometric calibration raw data into file
     save_caldata = True  # save data on calibration process
+    # 'archive': all frames in a single FITS archive (rows are appended
+    # as frames are calibrated), 'frame': one file per frame
+    save_caldata_mode = 'archive'
+    save_caldata_archive = 'calibration.fits'  # archive filename
     save_caldata_format = 'ascii.basic'  # Table.write formats (ascii, csv...)
     save_caldata_suffix = '_cal.dat'  # file suffix ('.fits' will be clipped)
     save_caldata_usedonly = False  # only output stars used in calibration?
@@ -62,6 +138,18 @@ class ConfCalibrate(Conf):
     # add photometric calibration raw data to frame database
     caldata_in_db = True  # add calibration data to database file?
 
+    # download all preferred photometric catalogs concurrently; the
+    # first catalog (in order of preference) that provides enough
+    # sources is used; catalogs that are not used are downloaded anyway
+    prefetch_catalogs = False  # download catalogs concurrently?
+    prefetch_workers = None  # concurrent downloads (default: all)
+
+    # zeropoint derivation: 'frame' derives zeropoints independently for
+    # each frame (iterative clipping), 'ensemble' fits all frame
+    # zeropoints and reference star offsets at once (robust reweighting)
+    zeropoint_mode = 'frame'
+    ensemble_iterations = 10  # max number of reweighting iterations
+
 
 class ConfDistill(Conf):
     """configuration setup for pp_distill"""
@@ -135,7 +223,12 @@ class ConfMPCReport(Conf):
     pass
 
 
+conf = Conf()
+confcatalog = ConfCatalog()
+confephemeris = ConfEphemeris()
 confprepare = ConfPrepare()
+confextract = ConfExtract()
+confphotometry = ConfPhotometry()
 confcalibrate = ConfCalibrate()
 confdistill = ConfDistill()
 confdiagnostics = ConfDiagnostics()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+""" PPTOOL_CACHE - inspect and purge pipeline caches
+    v1.0: 2026-10-18
+"""
+from __future__ import print_function
+
+# Photometry Pipeline
+# Copyright (C) 2016-2018  Michael Mommert, mommermiscience@gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import time
+import logging
+import argparse
+
+# pipeline-specific modules
+import _pp_conf
+from cache import ExtractionCache, CatalogCache
+from pp_setup import confextract, confcatalog
+
+# setup logging
+logging.basicConfig(filename=_pp_conf.log_filename,
+                    level=_pp_conf.log_level,
+                    format=_pp_conf.log_formatline,
+                    datefmt=_pp_conf.log_datefmt)
+
+
+def get_caches():
+    """return dictionary of all available caches"""
+    return {'extraction': ExtractionCache(confextract.extraction_cache_dir,
+                                          confextract.extraction_cache_size),
+            'catalog': CatalogCache(confcatalog.catalog_cache_dir,
+                                    confcatalog.catalog_cache_size,
+                                    order=confcatalog.catalog_cache_order)}
+
+
+def cache_info(cache):
+    """print summary of `cache`"""
+    print('%s: %d entries, %.1f of %.1f MB used' %
+          (cache.directory, len(cache.entries()),
+           cache.size()/1024.**2, cache.max_size/1024.**2))
+
+
+def cache_list(cache):
+    """print all entries of `cache`, most recently used first"""
+    cache_info(cache)
+    for key, size, created, accessed, description in cache.entries():
+        print('%s %10.1f kB  %s  %s' %
+              (key, size/1024.,
+               time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(accessed)),
+               description))
+
+
+if __name__ == '__main__':
+
+    # define command line arguments
+    parser = argparse.ArgumentParser(description='inspect and purge '
+                                     'pipeline caches')
+    parser.add_argument('action', help='action to perform',
+                        choices=['info', 'list', 'purge'])
+    parser.add_argument('-cache', help='cache to use (default: all)',
+                        choices=['extraction', 'catalog'], default=None)
+    parser.add_argument('-older_than',
+                        help='only purge entries that have not been '
+                        'used for this number of days', default=None)
+    args = parser.parse_args()
+
+    caches = get_caches()
+    if args.cache is not None:
+        caches = {args.cache: caches[args.cache]}
+
+    for name, cache in sorted(caches.items()):
+        if args.action == 'info':
+            cache_info(cache)
+        elif args.action == 'list':
+            cache_list(cache)
+        elif args.action == 'purge':
+            older_than = None
+            if args.older_than is not None:
+                older_than = float(args.older_than)*86400
+            n = cache.purge(older_than=older_than)
+            print('%d entries removed from %s cache' % (n, name))
@@ -1693,6 +1693,8 @@ kpno4mos3_param = {
     'aprad_default': 5,  # default aperture radius in px
     'aprad_range': [3, 15],  # [minimum, maximum] aperture radius (px)
     'sex-config-file': rootpath + '/setup/kpno4mos1.sex',
+    'extraction_tiles': (2048, 64),  # tile size and overlap (px)
+    #                        for tiled source extraction
     'mask_file': {},
     #                        mask files as a function of x,y binning
 
@@ -3947,6 +3949,8 @@ ztfmosaic_param = {
     'aprad_default': 5,  # default aperture radius in px
     'aprad_range': [2, 10],  # [minimum, maximum] aperture radius (px)
     'sex-config-file': rootpath + '/setup/ztfmosaic.sex',
+    'extraction_tiles': (2048, 64),  # tile size and overlap (px)
+    #                        for tiled source extraction
     'mask_file': {},
     #                        mask files as a function of x,y binning
 
@@ -4004,6 +4008,8 @@ intwfc_param = {
     'aprad_default': 5,  # default aperture radius in px
     'aprad_range': [2, 12],  # [minimum, maximum] aperture radius (px)
     'sex-config-file': rootpath+'/setup/intwfc.sex',
+    'extraction_tiles': (2048, 64),  # tile size and overlap (px)
+    #                        for tiled source extraction
     'mask_file': {},
     #                        mask files as a function of x,y binning
 
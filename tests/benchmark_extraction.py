@@ -0,0 +1,79 @@
+""" benchmark source extraction backends
+
+compares the Source Extractor backend and the numpy backend
+(detection.py) in terms of run time, number of sources, positions and
+aperture magnitudes
+
+usage: python benchmark_extraction.py [images]
+(default: all frames in example_data/vatt4k)
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import _pp_conf
+import pp_extract
+from executor import shutdown_executor
+
+
+def run_backend(filenames, backend):
+    """run extraction for all frames; return run time and results"""
+    parameters = {'sex_snr': 3, 'source_minarea': 12, 'aprad': 5.,
+                  'telescope': None, 'quiet': True, 'nocache': True,
+                  'backend': backend}
+    start = time.time()
+    extraction = pp_extract.extract_multiframe(filenames, parameters)
+    return time.time()-start, extraction
+
+
+def compare(sex_frame, numpy_frame, tolerance=1.0):
+    """compare catalogs of one frame; tolerance in pixels"""
+    sex_cat = sex_frame['catalog_data']
+    np_cat = numpy_frame['catalog_data']
+    tree = cKDTree(np.vstack([sex_cat['XWIN_IMAGE'],
+                              sex_cat['YWIN_IMAGE']]).T)
+    dist, idx = tree.query(np.vstack([np_cat['XWIN_IMAGE'],
+                                      np_cat['YWIN_IMAGE']]).T)
+    match = dist < tolerance
+    dmag = (np_cat['MAG_APER'][match] - sex_cat['MAG_APER'][idx[match]])
+    good = (np.abs(dmag) < 10)
+    print(('  %s: %d/%d sources (numpy/sex), %d matched, '
+           'median offset %.3f px, median dmag %+.3f mag') %
+          (os.path.basename(sex_frame['fits_filename']),
+           len(np_cat.data), len(sex_cat.data), match.sum(),
+           np.median(dist[match]) if match.sum() > 0 else np.nan,
+           np.median(dmag[good]) if good.sum() > 0 else np.nan))
+
+
+if __name__ == '__main__':
+
+    filenames = sys.argv[1:]
+    if len(filenames) == 0:
+        filenames = sorted(glob.glob(os.path.join(
+            _pp_conf.rootpath, 'example_data', 'vatt4k', '*.fits')))
+    if len(filenames) == 0:
+        print('no frames available for benchmark')
+        sys.exit()
+
+    results = {}
+    for backend in ['numpy', 'sex']:
+        if backend == 'sex' and pp_extract.sextractor_cmd is None:
+            print('Source Extractor not available; skip sex backend')
+            continue
+        dt, extraction = run_backend(filenames, backend)
+        print('%5s backend: %d frames in %.2f s (%.3f s per frame)' %
+              (backend, len(filenames), dt, dt/len(filenames)))
+        results[backend] = extraction
+
+    if 'sex' in results and 'numpy' in results:
+        for sex_frame, numpy_frame in zip(results['sex'], results['numpy']):
+            compare(sex_frame, numpy_frame)
+
+    shutdown_executor()
@@ -0,0 +1,108 @@
+""" benchmark catalog.match_with
+
+compares the run time of catalog.match_with against the previous
+list-based implementation for catalogs of 1k, 10k and 100k sources and
+reports the fraction of matched pairs both implementations agree on
+(the previous implementation treats RA and Dec as planar coordinates)
+
+usage: python benchmark_match.py [sizes]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import numpy as np
+from scipy import spatial
+from astropy.table import Table
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from catalog import catalog
+
+
+def match_with_lists(this, other,
+                     match_keys_this_catalog=['ra_deg', 'dec_deg'],
+                     match_keys_other_catalog=['ra_deg', 'dec_deg'],
+                     extract_this_catalog=['ra_deg', 'dec_deg'],
+                     extract_other_catalog=['ra_deg', 'dec_deg'],
+                     tolerance=0.5/3600):
+    """previous implementation of catalog.match_with for reference"""
+    this_tree = spatial.KDTree(
+        list(zip(this[match_keys_this_catalog[0]].data,
+                 this[match_keys_this_catalog[1]].data)))
+
+    other_tree = spatial.KDTree(
+        list(zip(other[match_keys_other_catalog[0]].data,
+                 other[match_keys_other_catalog[1]].data)))
+    match = this_tree.query_ball_tree(other_tree, tolerance)
+    indices_this_catalog = [x for x in range(
+        len(match)) if len(match[x]) == 1]
+    indices_other_catalog = [x[0] for x in list(
+        filter((lambda x: len(x) == 1), match))]
+
+    indices = list(zip(indices_this_catalog, indices_other_catalog))
+
+    def check_not_nan(x): return not np.isnan(x) if \
+        (type(x) is np.float_) else True
+
+    indices = [i for i in indices
+               if all([check_not_nan(this[i[0]][key])
+                       for key in extract_this_catalog] +
+                      [check_not_nan(other[i[1]][key])
+                       for key in extract_other_catalog])]
+    output_this_catalog = [this[key][[i[0] for i in indices]]
+                           for key in extract_this_catalog]
+    output_other_catalog = [other[key][[i[1] for i in indices]]
+                            for key in extract_other_catalog]
+
+    return [output_this_catalog, output_other_catalog]
+
+
+def synthetic_catalogs(n, seed=0):
+    """two catalogs of `n` sources each with positional scatter and a
+    few missing magnitudes"""
+    rng = np.random.RandomState(seed)
+    # source density of ~10 sources per square arcmin
+    size = np.sqrt(n/10.)/60
+    ra = 120 + rng.uniform(0, size, n)
+    dec = 20 + rng.uniform(0, size, n)
+    mag = rng.uniform(12, 20, n)
+    mag[rng.uniform(size=n) < 0.01] = np.nan
+
+    this, other = catalog('this'), catalog('other')
+    this.data = Table([ra, dec, mag], names=['ra_deg', 'dec_deg', 'mag'])
+    other.data = Table([ra + rng.normal(0, 0.1/3600, n),
+                        dec + rng.normal(0, 0.1/3600, n),
+                        mag + rng.normal(0, 0.05, n)],
+                       names=['ra_deg', 'dec_deg', 'mag'])
+    return this, other
+
+
+if __name__ == '__main__':
+
+    sizes = [int(n) for n in sys.argv[1:]]
+    if len(sizes) == 0:
+        sizes = [1000, 10000, 100000]
+
+    kwargs = {'extract_this_catalog': ['ra_deg', 'dec_deg', 'mag'],
+              'extract_other_catalog': ['ra_deg', 'dec_deg', 'mag'],
+              'tolerance': 1./3600}
+
+    for n in sizes:
+        this, other = synthetic_catalogs(n)
+
+        start = time.time()
+        new = this.match_with(other, **kwargs)
+        dt_new = time.time()-start
+
+        start = time.time()
+        old = match_with_lists(this, other, **kwargs)
+        dt_old = time.time()-start
+
+        pairs_new = set(zip(np.array(new[0][0]), np.array(new[1][0])))
+        pairs_old = set(zip(np.array(old[0][0]), np.array(old[1][0])))
+        agree = len(pairs_new & pairs_old)/max(len(pairs_old), 1)
+        print(('%6d sources: %6d matches, list-based %8.3f s, '
+               'vectorized %7.3f s, speedup %6.1fx, agreement %.4f') %
+              (n, len(new[0][0]), dt_old, dt_new, dt_old/dt_new, agree))
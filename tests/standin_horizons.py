@@ -0,0 +1,45 @@
+""" stand-in ephemeris backend that serves synthetic targets
+
+tests replace ephemeris.backend with StandInHorizons; targets move
+linearly in RA and Dec; queries for unknown targets raise ValueError
+like astroquery's Horizons
+"""
+from __future__ import print_function
+
+import numpy as np
+from astropy.table import Table
+
+
+class StandInHorizons(object):
+    """replaces ephemeris.HorizonsBackend"""
+
+    def __init__(self):
+        self.targets = {}  # target -> (epoch, ra, dec, ra_rate, dec_rate)
+        self.queries = []  # (target, epochs, location, id_type)
+
+    def register(self, target, epoch, ra, dec, ra_rate, dec_rate,
+                 id_type='smallbody', valid=(-np.inf, np.inf)):
+        """register target with position (deg) at `epoch`, rates
+        (deg/d), Horizons id_type, and range of valid epochs"""
+        self.targets[target] = (epoch, ra, dec, ra_rate, dec_rate,
+                                id_type, valid)
+
+    def position(self, target, epochs):
+        """true position of `target` at `epochs`"""
+        epoch, ra, dec, ra_rate, dec_rate = self.targets[target][:5]
+        dt = np.asarray(epochs, dtype=float) - epoch
+        return (ra + ra_rate*dt) % 360, dec + dec_rate*dt
+
+    def ephemerides(self, target, epochs, location, id_type=None):
+        self.queries.append((target, list(epochs), location, id_type))
+        if (target not in self.targets or
+                id_type not in (None, self.targets[target][5])):
+            raise ValueError('Unknown target (%s)' % target)
+        valid = self.targets[target][6]
+        epochs = np.array([epoch for epoch in epochs
+                           if valid[0] <= epoch <= valid[1]])
+        ra, dec = self.position(target, epochs)
+        # Horizons returns epochs with limited precision
+        return Table([np.round(epochs, 9),
+                      ['%s (synthetic)' % target]*len(epochs), ra, dec],
+                     names=['datetime_jd', 'targetname', 'RA', 'DEC'])
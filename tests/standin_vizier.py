@@ -0,0 +1,103 @@
+""" stand-in for astroquery's Vizier that serves synthetic catalogs
+
+tests replace catalog.Vizier with StandInVizier; cone queries are
+answered from the tables registered in StandInVizier.tables (Vizier
+catalog identifier -> astropy Table); column filters are ignored
+"""
+from __future__ import print_function
+
+import time
+import threading
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+
+from cache import angular_distance
+
+
+class StandInVizier(object):
+    """replaces astroquery.vizier.Vizier"""
+
+    tables = {}  # Vizier catalog identifier -> Table
+    radec = {}  # Vizier catalog identifier -> coordinate column names
+    delay = 0  # response time of each query (s)
+    queries = []  # (catalog, ra, dec, radius) of all queries
+    lock = threading.Lock()
+
+    def __init__(self, columns=None, column_filters=None, row_limit=50,
+                 timeout=60):
+        self.columns = columns
+        self.column_filters = column_filters
+        self.ROW_LIMIT = row_limit
+        self.TIMEOUT = timeout
+
+    @classmethod
+    def reset(cls, delay=0):
+        cls.tables, cls.radec, cls.queries = {}, {}, []
+        cls.delay = delay
+
+    @classmethod
+    def register(cls, catalog, table, radec):
+        cls.tables[catalog] = table
+        cls.radec[catalog] = radec
+
+    def query_region(self, field, radius, catalog, cache):
+        with self.lock:
+            self.queries.append((catalog, field.ra.deg, field.dec.deg,
+                                 radius.to(u.deg).value))
+        time.sleep(self.delay)
+        if catalog not in self.tables:
+            return []
+        table = self.tables[catalog]
+        ra, dec = self.radec[catalog]
+        dist = angular_distance(table[ra], table[dec],
+                                field.ra.deg, field.dec.deg)
+        data = table[dist <= radius.to(u.deg).value]
+        if self.ROW_LIMIT > 0:
+            data = data[:int(self.ROW_LIMIT)]
+        return [data]
+
+
+class NoNetwork(StandInVizier):
+    """fails on any query"""
+
+    def query_region(self, *args, **kwargs):
+        raise RuntimeError('network access in offline mode')
+
+
+def synthetic_gaia(ra0, dec0, n, size=2, seed=42):
+    """synthetic Gaia catalog (I/345/gaia2) with `n` sources in a box
+    of +-`size` degrees around ra0, dec0"""
+    rng = np.random.RandomState(seed)
+    table = Table()
+    table['Source'] = np.arange(n, dtype=np.int64)
+    table['RA_ICRS'] = ra0 + rng.uniform(-size, size, n)
+    table['DE_ICRS'] = dec0 + rng.uniform(-size, size, n)
+    table['e_RA_ICRS'] = rng.uniform(0.1, 1, n)*u.mas
+    table['e_DE_ICRS'] = rng.uniform(0.1, 1, n)*u.mas
+    table['pmRA'] = np.zeros(n)*u.mas/u.yr
+    table['pmDE'] = np.zeros(n)*u.mas/u.yr
+    table['Epoch'] = np.ones(n)*2015.5
+    table['Gmag'] = rng.uniform(10, 20, n)*u.mag
+    table['BPmag'] = table['Gmag'] + rng.uniform(0.2, 0.6, n)*u.mag
+    table['RPmag'] = table['Gmag'] - rng.uniform(0.2, 0.6, n)*u.mag
+    table['e_Gmag'] = np.ones(n)*0.01*u.mag
+    table['e_BPmag'] = np.ones(n)*0.01*u.mag
+    table['eRPmag'] = np.ones(n)*0.01*u.mag
+    return table
+
+
+def synthetic_panstarrs(ra0, dec0, n, size=2, seed=43):
+    """synthetic Pan-STARRS catalog (II/349/ps1) with `n` sources in a
+    box of +-`size` degrees around ra0, dec0"""
+    rng = np.random.RandomState(seed)
+    table = Table()
+    table['objID'] = np.arange(n, dtype=np.int64)
+    table['RAJ2000'] = ra0 + rng.uniform(-size, size, n)
+    table['DEJ2000'] = dec0 + rng.uniform(-size, size, n)
+    table['e_RAJ2000'] = rng.uniform(0.01, 0.1, n)*u.arcsec
+    table['e_DEJ2000'] = rng.uniform(0.01, 0.1, n)*u.arcsec
+    for band in 'grizy':
+        table[band+'mag'] = rng.uniform(14, 20, n)*u.mag
+        table['e_'+band+'mag'] = np.ones(n)*0.01*u.mag
+    return table
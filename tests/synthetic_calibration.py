@@ -0,0 +1,87 @@
+""" synthetic reference catalogs and frame catalogs for calibration tests
+
+synthetic_frames builds a GAIA reference catalog and frame catalogs
+with known zeropoints; save_config and restore_config reset pipeline
+configurations and module attributes that tests change
+"""
+from __future__ import print_function
+
+import numpy as np
+from astropy.table import Table
+
+from catalog import catalog
+
+
+def synthetic_frames(n_frames, n_sources=300, size=0.1, mags=(12, 19),
+                     ref_sigma=0.02, instr_sigma=0.02, position_sigma=0,
+                     coverage=1, n_sparse=0, outliers=0, masked=0,
+                     ident=None, seed=0):
+    """
+    reference catalog (G band) and frame catalogs with zeropoints 25+-0.5
+    input: number of frames, number of reference stars, field size
+           (deg), range of magnitudes, reference catalog uncertainties
+           (mag), instrumental uncertainties (mag), positional scatter
+           in frames (arcsec), fraction of stars in each frame, number
+           of frames (the last ones) that contain only 4 stars,
+           fraction of outliers (0.3-1 mag too faint), fraction of
+           masked reference magnitudes, format of reference star
+           identifiers (None: integers), random seed
+    return: reference catalog, list of frame catalogs, zeropoints
+    """
+    rng = np.random.RandomState(seed)
+    ra = 120 + rng.uniform(0, size, n_sources)
+    dec = 30 + rng.uniform(0, size, n_sources)
+    mag = rng.uniform(mags[0], mags[1], n_sources)
+
+    idents = np.arange(n_sources)
+    if ident is not None:
+        idents = [ident % i for i in idents]
+    ref_cat = catalog('GAIA')
+    ref_cat.data = Table([idents, ra, dec,
+                          mag + rng.normal(0, ref_sigma, n_sources),
+                          np.ones(n_sources)*ref_sigma],
+                         names=['ident', 'ra_deg', 'dec_deg', 'Gmag',
+                                'e_Gmag'], masked=masked > 0)
+    if masked > 0:
+        ref_cat.data['Gmag'].mask = rng.uniform(size=n_sources) < masked
+
+    frames, zeropoints = [], 25 + rng.uniform(-0.5, 0.5, n_frames)
+    for i, zp in enumerate(zeropoints):
+        sources = np.where(rng.uniform(size=n_sources) < coverage)[0]
+        if i >= n_frames-n_sparse:
+            sources = rng.choice(n_sources, 4, replace=False)
+        n = len(sources)
+        instr = mag[sources] - zp + rng.normal(0, instr_sigma, n)
+        # outliers (variable stars, blends)
+        faint = rng.uniform(size=n) < outliers
+        instr[faint] += rng.uniform(0.3, 1, np.sum(faint))
+        cat = catalog('frame%04d.fits' % i)
+        cat.obstime = [2458000.5+i/1440., 60]
+        cat.data = Table([ra[sources] +
+                          rng.normal(0, position_sigma/3600., n),
+                          dec[sources] +
+                          rng.normal(0, position_sigma/3600., n),
+                          instr, np.ones(n)*instr_sigma],
+                         names=['ra_deg', 'dec_deg', 'MAG_APER',
+                                'MAGERR_APER'])
+        frames.append(cat)
+    return ref_cat, frames, zeropoints
+
+
+def save_config(conf, *names):
+    """record attributes `names` of `conf` (a configuration or a
+    module)"""
+    return conf, dict((name, conf.__dict__[name]) for name in names
+                      if name in conf.__dict__), names
+
+
+def restore_config(saved):
+    """restore configuration attributes recorded with save_config;
+    attributes that were not set on the instance fall back to the
+    class definition"""
+    conf, values, names = saved
+    for name in names:
+        if name in values:
+            setattr(conf, name, values[name])
+        elif name in conf.__dict__:
+            delattr(conf, name)
@@ -0,0 +1,155 @@
+""" test the calibration data archive of pp_calibrate
+
+synthetic frames are calibrated with per-frame calibration data files
+and with a single calibration archive; the archive has to contain the
+same data for each frame, has to remain a valid FITS file as rows are
+appended, has to return the latest data of frames that have been
+calibrated repeatedly, and has to keep all rows if data with
+different columns are added
+
+usage: python test_calibration_archive.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pp_calibrate
+import synthetic_calibration as calibration
+from pp_setup import confcalibrate
+
+
+def synthetic_frames(n_frames, seed=0):
+    """frames that cover 70% of the reference stars; 2% of the
+    reference magnitudes are masked"""
+    return calibration.synthetic_frames(n_frames, coverage=0.7,
+                                        masked=0.02, ident='Gaia %d',
+                                        seed=seed)[:2]
+
+
+def calibrate(n_frames, mode, seed=0, zeropoint_mode='frame'):
+    ref_cat, frames = synthetic_frames(n_frames, seed=seed)
+    confcalibrate.save_caldata_mode = mode
+    start = time.time()
+    output = pp_calibrate.derive_zeropoints(ref_cat, frames, 'G', 0.5,
+                                            mode=zeropoint_mode)
+    return output, time.time()-start
+
+
+workdir = tempfile.mkdtemp()
+cwd = os.getcwd()
+os.chdir(workdir)
+config = calibration.save_config(confcalibrate, 'save_caldata_mode')
+archive = pp_calibrate.CalibrationArchive(confcalibrate.save_caldata_archive)
+try:
+    n_frames = 40
+    output, dt_frame = calibrate(n_frames, 'frame')
+    output, dt_archive = calibrate(n_frames, 'archive')
+    print('%d frames: %.2f s with per-frame files, %.2f s with archive' %
+          (n_frames, dt_frame, dt_archive))
+    assert all('caldata' not in zeropoint
+               for zeropoint in output['zeropoints'])
+
+    # archive is a valid FITS file with one table
+    with fits.open(archive.filename) as hdulist:
+        hdulist.verify('exception')
+        assert len(hdulist) == 2
+        assert hdulist['CALDATA'].header['NAXIS2'] == sum(
+            len(zeropoint['match'][0][0])
+            for zeropoint in output['zeropoints'])
+
+    # archive data are identical to per-frame files
+    index = archive.index()
+    assert list(index.keys()) == ['frame%04d.fits' % i
+                                  for i in range(n_frames)]
+    for zeropoint in output['zeropoints']:
+        frame = zeropoint['filename']
+        caldata = Table.read(frame[:-5]+confcalibrate.save_caldata_suffix,
+                             format=confcalibrate.save_caldata_format)
+        data = archive.read(frame)
+        assert len(data) == len(caldata) == len(zeropoint['match'][0][0])
+        assert np.all(np.where(data['fit'] == 1)[0] ==
+                      zeropoint['zp_usedstars'])
+        for name in caldata.columns:
+            # masked values are NaN in the archive
+            a = caldata[name]
+            if hasattr(a, 'mask') and a.dtype.kind == 'f':
+                a = a.filled(np.nan)
+            a, b = np.array(a), np.array(data[name])
+            if a.dtype.kind == 'f':
+                assert np.allclose(a, b, rtol=1e-12, equal_nan=True)
+            else:
+                assert np.all(a == b)
+
+    # query by reference star
+    star = archive.read(ident='Gaia 7')
+    assert len(star) > 0 and np.all(star['ident'] == 'Gaia 7')
+    assert len(star) == sum(np.sum(archive.read(frame)['ident'] == 'Gaia 7')
+                            for frame in index)
+    assert len(archive.read('frame9999.fits')) == 0
+
+    # calibrating a subset of frames again appends their data; the
+    # latest data replace the earlier data
+    n_rows = len(Table.read(archive.filename, hdu='CALDATA'))
+    output, dt = calibrate(5, 'archive', seed=1, zeropoint_mode='ensemble')
+    with fits.open(archive.filename) as hdulist:
+        hdulist.verify('exception')
+        assert hdulist['CALDATA'].header['NAXIS2'] == n_rows + sum(
+            len(zeropoint['match'][0][0])
+            for zeropoint in output['zeropoints'])
+    index = archive.index()
+    assert len(index) == n_frames
+    for zeropoint in output['zeropoints']:
+        data = archive.read(zeropoint['filename'])
+        assert len(data) == len(zeropoint['match'][0][0])
+        assert np.all(np.where(data['fit'] == 1)[0] ==
+                      zeropoint['zp_usedstars'])
+
+    # additional columns and longer strings are added to the archive;
+    # all earlier rows are kept
+    n_rows = len(Table.read(archive.filename, hdu='CALDATA'))
+    ref_cat, frames = synthetic_frames(2)
+    ref_cat.data.rename_column('e_Gmag', 'e_Gmag_ref')
+    ref_cat.add_field('e_Gmag', np.ones(ref_cat.shape[0])*0.03)
+    ref_cat.data['ident'] = ['Gaia DR2 %d' % i
+                            for i in range(ref_cat.shape[0])]
+    frames[1].catalogname = 'a_long_frame_name_' + 'x'*57 + '.fits'
+    confcalibrate.save_caldata_mode = 'archive'
+    output = pp_calibrate.derive_zeropoints(ref_cat, frames, 'G', 0.5)
+    with fits.open(archive.filename) as hdulist:
+        hdulist.verify('exception')
+        assert hdulist['CALDATA'].header['NAXIS2'] == n_rows + sum(
+            len(zeropoint['match'][0][0])
+            for zeropoint in output['zeropoints'])
+    index = archive.index()
+    assert list(index.keys())[-1] == frames[1].catalogname
+    assert len(index) == n_frames+1
+    data = archive.read(frames[1].catalogname)
+    assert np.all(np.isfinite(data['e_Gmag_ref']))
+    assert np.all(archive.read('frame0010.fits')['ident'] != '')
+    assert np.all(np.isnan(archive.read('frame0010.fits')['e_Gmag_ref']))
+
+    # incompatible columns are not written
+    data = archive.read('frame0000.fits')
+    data.remove_columns(['frame', 'block'])
+    data.replace_column('e_Gmag', ['bad']*len(data))
+    try:
+        archive.append('frame0000.fits', data)
+        raise AssertionError('incompatible columns have been written')
+    except ValueError:
+        pass
+    assert len(archive.index()) == n_frames+1
+
+    print('calibration archive tests passed')
+finally:
+    calibration.restore_config(config)
+    os.chdir(cwd)
+    shutil.rmtree(workdir)
@@ -0,0 +1,75 @@
+""" test process-parallel zeropoint derivation
+
+synthetic frames with known zeropoints are calibrated against a
+synthetic reference catalog in a single process and in worker
+processes; zeropoints, used stars, and calibrated catalogs have to be
+identical
+
+usage: python test_calibration_workers.py [number of frames]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pp_calibrate
+from executor import shutdown_executor
+from pp_setup import conf
+from synthetic_calibration import (synthetic_frames, save_config,
+                                   restore_config)
+
+
+def run(n_frames, workers):
+    ref_cat, frames, zeropoints = synthetic_frames(
+        n_frames, n_sources=2000, size=0.2, position_sigma=0.1)
+    shutdown_executor()
+    conf.n_workers = workers
+    start = time.time()
+    output = pp_calibrate.derive_zeropoints(ref_cat, frames, 'G', 0.5)
+    return output, frames, zeropoints, time.time()-start
+
+
+def test_calibration_workers(n_frames=16):
+    """zeropoints derived in one and in four worker processes"""
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    config = save_config(conf, 'n_workers')
+    try:
+        serial, serial_frames, zeropoints, dt_serial = run(n_frames, 1)
+        parallel, parallel_frames, _, dt_parallel = run(n_frames, 4)
+        print('%d frames: %.2f s in one process, %.2f s in 4 processes' %
+              (n_frames, dt_serial, dt_parallel))
+
+        assert len(parallel['zeropoints']) == n_frames
+        assert parallel['catalogs'] is parallel_frames
+        for zp, a, b in zip(zeropoints, serial['zeropoints'],
+                            parallel['zeropoints']):
+            # zeropoints are derived from clipped subsets of the stars
+            assert abs(a['zp'] - zp) < a['zp_sig']
+            assert a['filename'] == b['filename']
+            assert a['zp'] == b['zp'] and a['zp_sig'] == b['zp_sig']
+            assert np.all(a['zp_usedstars'] == b['zp_usedstars'])
+            assert len(a['clipping_steps']) == len(b['clipping_steps'])
+        for a, b in zip(serial_frames, parallel_frames):
+            assert a.catalogname == b.catalogname
+            assert list(a.fields) == list(b.fields)
+            assert np.all(np.array(a['_Gmag']) == np.array(b['_Gmag']))
+            assert np.all(np.array(a['ident']) == np.array(b['ident']))
+    finally:
+        shutdown_executor()
+        restore_config(config)
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    test_calibration_workers(int(sys.argv[1]) if len(sys.argv) > 1
+                             else 16)
+    print('parallel calibration tests passed')
@@ -0,0 +1,151 @@
+""" test the HEALPix-tiled reference catalog cache without network access
+
+a stand-in for astroquery's Vizier provides a synthetic GAIA catalog;
+the first query fills the cache, the second query is served in offline
+mode from the cached tiles
+
+usage: python test_catalog_cache.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import astropy.units as u
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import catalog
+from cache import (healpix_ang2pix, healpix_pix2ang, angular_distance,
+                   healpix_max_radius, CatalogCache)
+from pp_setup import confcatalog
+from standin_vizier import StandInVizier, NoNetwork, synthetic_gaia
+from synthetic_calibration import save_config, restore_config
+
+# synthetic GAIA catalog around the field center
+ra0, dec0 = 329.50922672, -2.33703204
+
+
+def test_healpix():
+    """healpix consistency, maximum pixel radius and tiles overlapping
+    a cone (compared to all pixel centers)"""
+    for order in [0, 3, 7]:
+        pix = np.arange(12*4**order)
+        assert np.all(healpix_ang2pix(order, *healpix_pix2ang(order, pix))
+                      == pix)
+
+    rng = np.random.RandomState(0)
+    ra, dec = rng.uniform(0, 360, 100000), np.degrees(np.arcsin(
+        rng.uniform(-1, 1, 100000)))
+    for order in [3, 8]:
+        center = healpix_pix2ang(order, healpix_ang2pix(order, ra, dec))
+        assert np.max(angular_distance(ra, dec, *center)) <= \
+            healpix_max_radius(order)
+    tilecache = CatalogCache(tempfile.mkdtemp(), 0, order=6)
+    allpix = np.arange(12*4**6)
+    try:
+        for cone_ra, cone_dec, cone_rad in [(0, 89.9, 0.5), (359.9, -2, 0.1),
+                                            (120, 30, 2), (45, 41.8, 0.01)]:
+            dist = angular_distance(*healpix_pix2ang(6, allpix),
+                                    ra2=cone_ra, dec2=cone_dec)
+            assert np.all(tilecache.cone_tiles(cone_ra, cone_dec, cone_rad)
+                          == allpix[dist <= cone_rad+healpix_max_radius(6)])
+    finally:
+        shutil.rmtree(tilecache.directory)
+
+
+def test_catalog_cache():
+    """queries through the tile cache, online and offline"""
+    synthetic = synthetic_gaia(ra0, dec0, 20000)
+    StandInVizier.reset()
+    StandInVizier.register('I/345/gaia2', synthetic, ('RA_ICRS', 'DE_ICRS'))
+    queries = StandInVizier.queries
+
+    cachedir = tempfile.mkdtemp()
+    config = save_config(confcatalog, 'catalog_cache', 'catalog_cache_dir',
+                         'catalog_offline', 'catalog_cache_fetch_limit')
+    vizier = save_config(catalog, 'Vizier')
+    confcatalog.catalog_cache = True
+    confcatalog.catalog_cache_dir = cachedir
+    try:
+        # fill the cache
+        catalog.Vizier = StandInVizier
+        cat = catalog.catalog('GAIA')
+        n_online = cat.download_catalog(ra0, dec0, 0.3, 10000)
+        online = np.sort(np.array(cat['ident']))
+        print(n_online, 'sources retrieved,', len(queries), 'Vizier query')
+
+        # the same field, offline
+        catalog.Vizier = NoNetwork
+        confcatalog.catalog_offline = True
+        cat = catalog.catalog('GAIA')
+        n_offline = cat.download_catalog(ra0, dec0, 0.3, 10000)
+        offline = np.sort(np.array(cat['ident']))
+        print(n_offline, 'sources retrieved from cached tiles')
+
+        # reference: all sources in the cone
+        dist = angular_distance(synthetic['RA_ICRS'], synthetic['DE_ICRS'],
+                                ra0, dec0)
+        reference = np.sort(np.array(synthetic['Source'][dist <= 0.3]))
+
+        assert len(queries) == 1
+        assert np.all(online == reference)
+        assert np.all(offline == reference)
+        assert cat['e_ra_deg'].unit == u.deg
+
+        # a smaller cone within the cached area and a row limit
+        cat = catalog.catalog('GAIA')
+        assert cat.download_catalog(ra0+0.1, dec0, 0.1, 20) == 20
+        assert np.max(angular_distance(cat['ra_deg'], cat['dec_deg'],
+                                       ra0+0.1, dec0)) <= 0.1
+
+        # only tiles that are not cached are fetched; the fetched cones
+        # cover little more than these tiles
+        cache = CatalogCache(cachedir, confcatalog.catalog_cache_size,
+                             order=confcatalog.catalog_cache_order)
+
+        def cached_tiles():
+            return set(int(entry[4].split()[-1])
+                       for entry in cache.entries())
+
+        catalog.Vizier = StandInVizier
+        confcatalog.catalog_offline = False
+        for ra in [ra0+0.3, ra0+0.4]:
+            before = cached_tiles()
+            del queries[:]
+            cat = catalog.catalog('GAIA')
+            cat.download_catalog(ra, dec0, 0.1, 10000)
+            tiles = set(cache.cone_tiles(ra, dec0, 0.1))
+            assert cached_tiles() - before == tiles - before
+            assert len(queries) <= len(tiles - before)
+            tile_radius = healpix_max_radius(confcatalog.catalog_cache_order)
+            assert all(query[3] < 0.1 + 2*tile_radius for query in queries)
+        assert len(queries) == 1
+
+        # tile queries that reach the row limit are not cached; the cone
+        # itself is queried with the row limit of the request
+        confcatalog.catalog_cache_fetch_limit = 100
+        del queries[:]
+        cat = catalog.catalog('GAIA')
+        assert cat.download_catalog(ra0-1, dec0, 0.3, 50) == 50
+        assert queries[-1][1:] == (ra0-1, dec0, 0.3)
+        confcatalog.catalog_offline = True
+        catalog.Vizier = NoNetwork
+        cat = catalog.catalog('GAIA')
+        assert cat.download_catalog(ra0-1, dec0, 0.3, 50) == 0
+
+        # a field that is not cached
+        cat = catalog.catalog('GAIA')
+        assert cat.download_catalog(ra0+10, dec0, 0.3, 10000) == 0
+    finally:
+        restore_config(vizier)
+        restore_config(config)
+        shutil.rmtree(cachedir)
+
+
+if __name__ == '__main__':
+    test_healpix()
+    test_catalog_cache()
+    print('catalog cache tests passed')
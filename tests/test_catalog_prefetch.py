@@ -0,0 +1,86 @@
+""" test concurrent downloads of photometric catalogs without network
+access
+
+a stand-in for astroquery's Vizier with a fixed response time provides
+a sparse Pan-STARRS and a dense GAIA catalog; create_photometrycatalog
+has to pick the first catalog in order of preference that provides
+enough sources, with and without prefetching
+
+usage: python test_catalog_prefetch.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import threading
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import catalog
+import pp_calibrate
+from pp_setup import confcatalog
+from standin_vizier import (StandInVizier, synthetic_gaia,
+                            synthetic_panstarrs)
+from synthetic_calibration import save_config, restore_config
+
+ra0, dec0, rad = 329.50922672, -2.33703204, 0.2
+delay = 0.5
+
+
+def run(n_panstarrs, prefetch):
+    """return selected catalog name and run time"""
+    StandInVizier.reset(delay=delay)
+    StandInVizier.register('II/349/ps1',
+                           synthetic_panstarrs(ra0, dec0, n_panstarrs),
+                           ('RAJ2000', 'DEJ2000'))
+    StandInVizier.register('I/345/gaia2',
+                           synthetic_gaia(ra0, dec0, 20000),
+                           ('RA_ICRS', 'DE_ICRS'))
+    threads = threading.active_count()
+    start = time.time()
+    cat = pp_calibrate.create_photometrycatalog(
+        ra0, dec0, rad, 'V', ['PANSTARRS', 'GAIA'], min_sources=20,
+        prefetch=prefetch)
+    # no download threads are left
+    assert threading.active_count() == threads
+    return cat.catalogname, time.time()-start
+
+
+def test_catalog_prefetch():
+    """catalog selection with and without prefetching"""
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    # catalog queries are not cached in this test
+    config = save_config(confcatalog, 'catalog_cache')
+    vizier = save_config(catalog, 'Vizier')
+    confcatalog.catalog_cache = False
+    catalog.Vizier = StandInVizier
+    try:
+        # sparse Pan-STARRS field: GAIA is used
+        name, dt_serial = run(100, False)
+        assert name.startswith('GAIA')
+        name, dt_prefetch = run(100, True)
+        assert name.startswith('GAIA')
+        print(('sparse field: %.2f s sequential, %.2f s with prefetch '
+               '(%d queries)') % (dt_serial, dt_prefetch,
+                                  len(StandInVizier.queries)))
+        assert dt_prefetch < dt_serial - 0.5*delay
+
+        # dense Pan-STARRS field: Pan-STARRS is preferred
+        name, dt_prefetch = run(20000, True)
+        assert name.startswith('PANSTARRS')
+        print('dense field: %s used (%.2f s)' % (name, dt_prefetch))
+    finally:
+        restore_config(vizier)
+        restore_config(config)
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    test_catalog_prefetch()
+    print('catalog prefetch tests passed')
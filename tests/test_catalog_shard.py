@@ -0,0 +1,97 @@
+""" test sharded cone queries without network access
+
+a stand-in for astroquery's Vizier provides a synthetic GAIA catalog
+covering a wide field; a cone query beyond the sharding threshold is
+split into sub-cones, some of which fail once or hit the row limit; the
+merged result has to be complete and free of duplicates
+
+usage: python test_catalog_shard.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import catalog
+from cache import angular_distance
+from pp_setup import confcatalog
+from standin_vizier import StandInVizier, synthetic_gaia
+from synthetic_calibration import save_config, restore_config
+
+
+class UnreliableVizier(StandInVizier):
+    """every seventh query fails"""
+
+    def query_region(self, *args, **kwargs):
+        with self.lock:
+            fail = len(self.queries) % 7 == 6
+        if fail:
+            with self.lock:
+                self.queries.append(None)
+            raise RuntimeError('service unavailable')
+        return StandInVizier.query_region(self, *args, **kwargs)
+
+
+ra0, dec0, rad = 120.5, 60.2, 2.5
+
+
+def test_cone_shards():
+    """sub-cones cover the cone"""
+    shard_ra, shard_dec = catalog.cone_shards(ra0, dec0, rad, 1.0)
+    test_ra = ra0 + np.random.RandomState(1).uniform(-6, 6, 20000)
+    test_dec = dec0 + np.random.RandomState(2).uniform(-3, 3, 20000)
+    inside = angular_distance(test_ra, test_dec, ra0, dec0) <= rad
+    covered = np.zeros(len(test_ra), dtype=bool)
+    for ra, dec in zip(shard_ra, shard_dec):
+        covered |= angular_distance(test_ra, test_dec, ra, dec) <= 1.0
+    assert np.all(covered[inside])
+    assert len(catalog.cone_shards(ra0, dec0, 0.5, 1.0)[0]) == 1
+
+
+def test_sharded_query():
+    """sharded queries with failing sub-cone queries"""
+    synthetic = synthetic_gaia(ra0, dec0, 40000, size=6)
+    StandInVizier.reset()
+    StandInVizier.register('I/345/gaia2', synthetic, ('RA_ICRS', 'DE_ICRS'))
+
+    config = save_config(confcatalog, 'catalog_cache',
+                         'catalog_cache_fetch_limit')
+    vizier = save_config(catalog, 'Vizier')
+    confcatalog.catalog_cache = False
+    # small sub-cone row limit to enforce subdivision
+    confcatalog.catalog_cache_fetch_limit = 1000
+    catalog.Vizier = UnreliableVizier
+    try:
+        cat = catalog.catalog('GAIA')
+        n = cat.download_catalog(ra0, dec0, rad, 100000)
+
+        dist = angular_distance(synthetic['RA_ICRS'], synthetic['DE_ICRS'],
+                                ra0, dec0)
+        reference = np.sort(np.array(synthetic['Source'][dist <= rad]))
+        idents = np.sort(np.array(cat['ident']))
+        n_failed = StandInVizier.queries.count(None)
+        print(('%d sources retrieved with %d sub-cone queries (%d failed), '
+               '%d expected') % (n, len(StandInVizier.queries)-n_failed,
+                                 n_failed, len(reference)))
+        assert n_failed > 0
+        assert len(idents) == len(np.unique(idents))
+        assert np.all(idents == reference)
+
+        # row limit: nearest sources first
+        cat = catalog.catalog('GAIA')
+        assert cat.download_catalog(ra0, dec0, rad, 500) == 500
+        assert np.all(np.sort(np.array(cat['ident'])) ==
+                      np.sort(np.array(synthetic['Source'][
+                          np.argsort(dist)[:500]])))
+    finally:
+        restore_config(vizier)
+        restore_config(config)
+
+
+if __name__ == '__main__':
+    test_cone_shards()
+    test_sharded_query()
+    print('sharded catalog query tests passed')
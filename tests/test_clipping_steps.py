@@ -0,0 +1,88 @@
+""" regression test for pp_calibrate.derive_clipping_steps
+
+compares the closed-form clipping against the previous implementation
+(one-parameter chi2 minimization with Nelder-Mead and rejection of one
+outlier at a time) for synthetic zeropoint residuals with outliers;
+both have to reject the same stars in the same order and agree on the
+zeropoints, uncertainties, and reduced chi2 values
+
+the reference uses a tight optimizer tolerance: with the default
+tolerance (~1e-4 mag), stars that are almost equally distant from the
+zeropoint may be rejected in a different order
+
+usage: python test_clipping_steps.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import numpy as np
+from scipy.optimize import minimize
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pp_calibrate import derive_clipping_steps
+
+
+def clipping_steps_minimize(residuals, residuals_sig, tolerance=1e-12):
+    """previous implementation of the clipping in derive_zeropoints"""
+    m_idc = list(range(len(residuals)))
+    clipping_steps = []
+    zeropoint = 25  # initialize zeropoint
+    while len(residuals) >= 3:
+        def fchi2(zp): return np.sum([(zp-residuals)**2/residuals_sig])
+
+        minchi2 = minimize(fchi2, zeropoint, method='Nelder-Mead',
+                           options={'xatol': tolerance,
+                                    'fatol': tolerance})
+        red_chi2 = minchi2.fun/(len(residuals)-2)
+        zeropoint = minchi2.x[0]
+
+        var = np.average((residuals-zeropoint)**2,
+                         weights=1/residuals_sig)
+        sigma = np.sqrt(var + np.mean(residuals_sig))
+
+        clipping_steps.append([zeropoint, sigma, red_chi2, m_idc])
+
+        for repeat in range(max([1, int(len(residuals)/50)])):
+            popidx = np.argmax(np.absolute(residuals
+                                           - zeropoint))
+            residuals = np.delete(residuals, popidx)
+            residuals_sig = np.delete(residuals_sig, popidx)
+            m_idc = np.delete(m_idc, popidx)
+
+    return clipping_steps
+
+
+def synthetic_residuals(n, seed):
+    """residuals around a zeropoint of ~25 mag with 10% outliers"""
+    rng = np.random.RandomState(seed)
+    sig = rng.uniform(0.01, 0.1, n)
+    residuals = 25.3 + rng.normal(0, sig)
+    outliers = rng.uniform(size=n) < 0.1
+    residuals[outliers] += rng.normal(0, 0.5, np.sum(outliers))
+    return residuals, sig**2 + 0.01**2
+
+
+for n, seed in [(3, 0), (10, 1), (57, 2), (120, 3), (400, 4), (1500, 5)]:
+    residuals, residuals_sig = synthetic_residuals(n, seed)
+
+    start = time.time()
+    reference = clipping_steps_minimize(residuals, residuals_sig)
+    dt_reference = time.time()-start
+    start = time.time()
+    steps = derive_clipping_steps(residuals, residuals_sig)
+    dt = time.time()-start
+
+    assert len(steps) == len(reference)
+    for step, ref in zip(steps, reference):
+        assert np.all(np.array(step[3]) == np.array(ref[3]))
+        assert abs(step[0]-ref[0]) < 1e-7
+        assert np.isclose(step[1], ref[1], rtol=1e-7)
+        assert np.isclose(step[2], ref[2], rtol=1e-6, atol=1e-12)
+
+    print('%5d stars, %3d clipping steps: %7.3f s -> %.4f s' %
+          (n, len(steps), dt_reference, dt))
+
+print('clipping steps regression tests passed')
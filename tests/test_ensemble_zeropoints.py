@@ -0,0 +1,94 @@
+""" test the ensemble zeropoint solver of pp_calibrate
+
+synthetic frames with known zeropoints are calibrated against a
+synthetic reference catalog with errors and outliers; some frames
+contain only a few reference stars; ensemble zeropoints have to be
+accurate, including those of the sparse frames; the solver has to
+handle 5000 frames x 10000 stars within seconds
+
+usage: python test_ensemble_zeropoints.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pp_calibrate
+from synthetic_calibration import synthetic_frames
+
+
+workdir = tempfile.mkdtemp()
+cwd = os.getcwd()
+os.chdir(workdir)
+try:
+    errors = {}
+    for mode in ['frame', 'ensemble']:
+        ref_cat, frames, zeropoints = synthetic_frames(
+            30, n_sources=500, mags=(12, 17), ref_sigma=0.03,
+            instr_sigma=0.01, n_sparse=10, outliers=0.03)
+        output = pp_calibrate.derive_zeropoints(ref_cat, frames, 'G', 0.5,
+                                                mode=mode)
+        assert len(output['zeropoints']) == len(frames)
+        zp = np.array([frame['zp'] for frame in output['zeropoints']])
+        errors[mode] = zp - zeropoints
+        print('%8s: rms error %.4f mag (dense frames), %.4f mag (sparse '
+              'frames)' % (mode, np.std(errors[mode][:20]),
+                           np.std(errors[mode][20:])))
+
+    # output structure used by diagnostics.add_calibration
+    for frame, cat in zip(output['zeropoints'], output['catalogs']):
+        step = frame['clipping_steps'][frame['zp_idx']]
+        assert step[0] == frame['zp'] and step[1] == frame['zp_sig']
+        assert len(frame['zp_usedstars']) == frame['zp_nstars']
+        assert np.allclose(cat['_Gmag'], cat['MAG_APER'] + frame['zp'])
+
+    # sparse frames benefit from the stars shared with other frames
+    assert np.std(errors['ensemble'][:20]) < 0.01
+    assert (np.std(errors['ensemble'][20:]) <
+            np.std(errors['frame'][20:]))
+
+    # scaling
+    rng = np.random.RandomState(1)
+    n_frames, n_stars, n_per_frame = 5000, 10000, 300
+    frame_idc = np.repeat(np.arange(n_frames), n_per_frame)
+    star_idc = np.concatenate([rng.choice(n_stars, n_per_frame,
+                                          replace=False)
+                               for i in range(n_frames)])
+    zeropoints = 25 + rng.uniform(-0.5, 0.5, n_frames)
+    sig_instr = rng.uniform(0.005, 0.05, len(frame_idc))
+    residuals = (zeropoints[frame_idc] +
+                 rng.normal(0, 0.02, n_stars)[star_idc] +
+                 rng.normal(0, sig_instr))
+    start = time.time()
+    zp, offsets, robust = pp_calibrate.solve_ensemble_zeropoints(
+        frame_idc, star_idc, residuals, sig_instr,
+        np.ones(len(frame_idc))*0.02, n_frames, n_stars)
+    dt = time.time()-start
+    print('%d frames x %d stars (%d observations): %.2f s' %
+          (n_frames, n_stars, len(residuals), dt))
+    assert np.std(zp - zeropoints) < 0.005
+
+    # a single iteration provides a solution; zero iterations are
+    # rejected
+    zp, offsets, robust = pp_calibrate.solve_ensemble_zeropoints(
+        frame_idc, star_idc, residuals, sig_instr,
+        np.ones(len(frame_idc))*0.02, n_frames, n_stars, iterations=1)
+    assert np.std(zp - zeropoints) < 0.005
+    try:
+        pp_calibrate.solve_ensemble_zeropoints(
+            frame_idc, star_idc, residuals, sig_instr,
+            np.ones(len(frame_idc))*0.02, n_frames, n_stars, iterations=0)
+        raise AssertionError('zero iterations accepted')
+    except ValueError:
+        pass
+
+    print('ensemble zeropoint tests passed')
+finally:
+    os.chdir(cwd)
+    shutil.rmtree(workdir)
@@ -0,0 +1,137 @@
+""" test batched and cached ephemerides without network access
+
+a stand-in backend provides synthetic targets on linear tracks; a
+300-frame sequence has to be served with one batched query per target
+(split into batches of ConfEphemeris.ephemeris_batch_size epochs),
+repeated requests have to be served from the cache unless entries
+have expired, and epochs between cached epochs have to be interpolated
+
+usage: python test_ephemeris.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ephemeris
+import pp_distill
+from catalog import catalog
+from pp_setup import confephemeris
+from standin_horizons import StandInHorizons
+
+tmpdir = tempfile.mkdtemp()
+confephemeris.ephemeris_cache_file = os.path.join(tmpdir, 'ephem.db')
+confephemeris.ephemeris_cache = True
+
+backend = StandInHorizons()
+backend.register('2001 AB', 2458000.5, 359.99, 10, 0.5, -0.2)
+backend.register('Jupiter', 2458000.5, 120, 20, 0.1, 0.05,
+                 id_type='majorbody')
+backend.register('2002 CD', 2458000.5, 10, 5, 0.01, 0.01,
+                 valid=(2458000.5, 2458000.6))
+ephemeris.backend = backend
+
+try:
+    # 300 frames: a single batched query
+    epochs = 2458000.5 + np.arange(300)*60/86400.
+    eph = ephemeris.ephemerides('2001 AB', epochs, 'G37')
+    ra, dec = backend.position('2001 AB', epochs)
+    assert np.allclose(eph['RA'], ra, atol=1e-9)
+    assert np.allclose(eph['DEC'], dec, atol=1e-9)
+    assert np.all(eph['targetname'] == '2001 AB (synthetic)')
+    n_batches = int(np.ceil(300/confephemeris.ephemeris_batch_size))
+    assert len(backend.queries) == n_batches
+    print('300 epochs: %d queries' % len(backend.queries))
+
+    # cached
+    eph = ephemeris.ephemerides('2001 AB', epochs[::-1], 'G37')
+    assert len(backend.queries) == n_batches
+    assert np.allclose(eph['RA'], ra[::-1], atol=1e-9)
+
+    # interpolation between cached epochs (across RA = 0)
+    between = epochs[:-1] + 17/86400.
+    eph = ephemeris.ephemerides('2001 AB', between, 'G37')
+    assert len(backend.queries) == n_batches
+    ra, dec = backend.position('2001 AB', between)
+    dra = (eph['RA'] - ra + 180) % 360 - 180
+    assert np.max(np.abs(dra)) < 1e-8
+    assert np.allclose(eph['DEC'], dec, atol=1e-8)
+
+    # epochs beyond the cached range and different observatories are
+    # queried
+    eph = ephemeris.ephemerides('2001 AB', [epochs[-1]+0.5], 'G37')
+    assert len(backend.queries) == n_batches+1
+    eph = ephemeris.ephemerides('2001 AB', epochs[:3], '568')
+    assert len(backend.queries) == n_batches+2
+    assert backend.queries[-1][2] == '568'
+
+    # positions outside the valid range are not available
+    eph = ephemeris.ephemerides('2002 CD', [2458000.55, 2458001.5], 'G37')
+    assert not np.isnan(eph['RA'][0]) and np.isnan(eph['RA'][1])
+
+    # unknown targets
+    assert ephemeris.ephemerides('no such target', epochs, 'G37') is None
+
+    # expired entries and refresh queries are queried again
+    n_queries = len(backend.queries)
+    cache = ephemeris.default_cache()
+    with cache._connect() as db:
+        db.execute('UPDATE ephemerides SET queried=queried-2*86400 '
+                   'WHERE location=?', ('568',))
+    eph = ephemeris.ephemerides('2001 AB', epochs[:3], '568')
+    assert len(backend.queries) == n_queries+1
+    eph = ephemeris.ephemerides('2001 AB', epochs[:3], '568')
+    assert len(backend.queries) == n_queries+1
+    eph = ephemeris.ephemerides('2001 AB', epochs[:3], '568', refresh=True)
+    assert len(backend.queries) == n_queries+2
+    assert np.allclose(eph['RA'], backend.position('2001 AB',
+                                                   epochs[:3])[0])
+    confephemeris.ephemeris_cache_expiry = None
+    with cache._connect() as db:
+        db.execute('UPDATE ephemerides SET queried=queried-2*86400 '
+                   'WHERE location=?', ('568',))
+    eph = ephemeris.ephemerides('2001 AB', epochs[:3], '568')
+    assert len(backend.queries) == n_queries+2
+    confephemeris.ephemeris_cache_expiry = 1
+    assert cache.purge('2001 AB', older_than=86400) == 3
+
+    # no cache
+    confephemeris.ephemeris_cache = False
+    n_queries = len(backend.queries)
+    eph = ephemeris.ephemerides('2001 AB', epochs[:10], 'G37')
+    assert len(backend.queries) == n_queries+1
+    confephemeris.ephemeris_cache = True
+
+    # pp_distill: one query per target for all catalogs
+    catalogs = []
+    for i, epoch in enumerate(epochs[:40]):
+        cat = catalog('frame%04d.fits' % i)
+        cat.obj = 'Jupiter'
+        cat.obstime = [epoch, 60]
+        cat.origin = 'DCTLMI;'
+        catalogs.append(cat)
+    n_queries = len(backend.queries)
+    objects = pp_distill.moving_primary_target(catalogs, None, (0, 0),
+                                               display=False)
+    # target nature: smallbody (fails), majorbody, then all frames
+    assert len(backend.queries) == n_queries+3
+    assert [obj['cat_idx'] for obj in objects] == list(range(40))
+    ra, dec = backend.position('Jupiter', epochs[:40])
+    assert np.allclose([obj['ra_deg'] for obj in objects], ra)
+    assert objects[0]['ident'] == 'Jupiter_(synthetic)'
+
+    # cached for subsequent pipeline stages
+    objects = pp_distill.moving_primary_target(catalogs, None, (0, 0),
+                                               is_asteroid=False,
+                                               display=False)
+    assert len(backend.queries) == n_queries+3
+    assert len(objects) == 40
+
+    print('ephemeris tests passed')
+finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,132 @@
+""" regression test of the SDSS to BVRI filter transformation
+
+the declarative transformation (catalog.filter_transformations) is
+compared with the transformation chain of earlier pipeline versions
+on a synthetic SDSS catalog: transformed magnitudes and uncertainties
+have to be identical; the selection differs only by the outlier
+rejection, which earlier versions applied to the wrong sources (the
+residuals of the pre-selected sources were indexed against the full
+catalog) and which now rejects sources more than 3 sigma from the
+fitted color-color relation
+
+usage: python test_filter_transformations.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import numpy as np
+from astropy.table import Table
+from scipy import optimize as optimization
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from catalog import catalog
+
+
+def synthetic_sdss(n_sources=1000, seed=0):
+    """SDSS catalog of stars on the r-i/g-r stellar locus with a 0.03 mag
+    scatter and 2% of sources far off the locus"""
+    rng = np.random.RandomState(seed)
+    r = rng.uniform(14, 20, n_sources)
+    ri = rng.uniform(0, 0.6, n_sources)
+    gr = 2*ri + 0.25 + rng.normal(0, 0.03, n_sources)
+    off = rng.uniform(size=n_sources) < 0.02
+    gr[off] += rng.choice([-1, 1], off.sum())*rng.uniform(0.2, 0.4,
+                                                          off.sum())
+    names = ['umag', 'gmag', 'rmag', 'imag']
+    mags = [r+gr+1.2, r+gr, r, r-ri]
+    data = Table([['SDSS %d' % i for i in range(n_sources)]] + mags +
+                 [rng.uniform(0.01, 0.05, n_sources) for _ in names],
+                 names=['ident'] + names + ['e_'+name for name in names])
+    return data, np.where(off)[0]
+
+
+def previous_chain(data, targetfilter, outliers=True):
+    """SDSS to BVRI transformation of earlier pipeline versions; returns
+    the indices of transformed sources and their magnitudes and
+    uncertainties; `outliers=False` skips the outlier rejection"""
+    mags = np.array([data['gmag'], data['rmag'], data['imag'],
+                     data['e_gmag'], data['e_rmag'], data['e_imag']])
+    keep_idc = ((mags[1]-mags[2] > 0.08) & (mags[1]-mags[2] < 0.5) &
+                (mags[0]-mags[1] > 0.2) & (mags[0]-mags[1] < 1.4) &
+                (mags[0] >= 14.5) & (mags[0] < 19.5) &
+                (mags[1] >= 14.5) & (mags[1] < 19.5) &
+                (mags[2] >= 14.5) & (mags[2] < 19.5))
+    filtered_mags = np.array([mags[i][keep_idc] for i in range(len(mags))])
+    ri = filtered_mags[1] - filtered_mags[2]
+    gr = filtered_mags[0] - filtered_mags[1]
+    param = optimization.curve_fit(lambda x, a, b: a*x+b, ri, gr,
+                                   [1, 0])[0]
+    resid = np.sqrt(((ri+param[0]*gr-param[0]*param[1]) /
+                     (param[0]**2+1))**2 +
+                    (param[0]*(ri+param[0]*gr-param[0]*param[1]) /
+                     (param[0]**2+1)+param[1]-gr)**2)
+    remove = np.where(np.array(resid) > 3.*np.std(resid))[0]
+    if not outliers:
+        remove = []
+    keep = [idx for idx in np.arange(len(keep_idc))[keep_idc]
+            if idx not in set(remove)]
+
+    if targetfilter == 'B':
+        mag = mags[0] + 0.327*(mags[0] - mags[1]) + 0.216
+        err = np.sqrt(((1+0.327)*mags[3])**2 + (0.327*mags[4])**2 +
+                      ((mags[0]-mags[1])*0.047)**2 + 0.027**2)
+    elif targetfilter == 'V':
+        mag = mags[0] - 0.587*(mags[0] - mags[1]) - 0.011
+        err = np.sqrt(((1+0.587)*mags[3])**2 + (0.587*mags[4])**2 +
+                      ((mags[0]-mags[1])*0.022)**2 + 0.011**2)
+    elif targetfilter == 'R':
+        mag = mags[1] - 0.272*(mags[1] - mags[2]) - 0.159
+        err = np.sqrt(((1-0.272)*mags[4])**2 + (0.272*mags[5])**2 +
+                      ((mags[1]-mags[2])*0.092)**2 + 0.022**2)
+    elif targetfilter == 'I':
+        mag = mags[2] - 0.337*(mags[1] - mags[2]) - 0.370
+        err = np.sqrt(((1+0.337)*mags[5])**2 + (0.337*mags[4])**2 +
+                      ((mags[1]-mags[2])*0.191)**2 + 0.041**2)
+    return np.array(keep), mag[keep], err[keep]
+
+
+data, off_locus = synthetic_sdss()
+for targetfilter in ['B', 'V', 'R', 'I']:
+    cat = catalog('SDSS-R9')
+    cat.data = data.copy()
+    n = cat.transform_filters(targetfilter)
+    idx = np.array([int(ident.split()[1]) for ident in cat['ident']])
+
+    old, old_mag, old_err = previous_chain(data, targetfilter)
+    presel, presel_mag, presel_err = previous_chain(data, targetfilter,
+                                                    outliers=False)
+
+    # transformed magnitudes and uncertainties are unchanged
+    assert set(idx) <= set(presel)
+    lookup = dict(zip(presel, range(len(presel))))
+    rows = [lookup[i] for i in idx]
+    assert np.allclose(cat['_'+targetfilter+'mag'], presel_mag[rows],
+                       rtol=0, atol=1e-12)
+    assert np.allclose(cat['_e_'+targetfilter+'mag'], presel_err[rows],
+                       rtol=0, atol=1e-12)
+
+    # rejected sources are those off the fitted color-color relation
+    ri = data['rmag'][presel] - data['imag'][presel]
+    gr = data['gmag'][presel] - data['rmag'][presel]
+    a, b = np.polyfit(ri, gr, 1)
+    dist = (gr - (a*ri + b))/np.sqrt(1 + a**2)
+    rejected = sorted(set(presel) - set(idx))
+    assert np.all(presel[np.abs(dist) > 3*np.std(dist)] == rejected)
+
+    # the outlier rejection removes the sources off the locus and
+    # only a few percent of the pre-selected sources
+    assert set(off_locus) & set(presel) <= set(rejected)
+    assert len(rejected) < 0.05*len(presel)
+    print(('{:s}: {:d} pre-selected, {:d} transformed ({:d} with '
+           'earlier versions)').format(targetfilter, len(presel), n,
+                                       len(old)))
+
+    # use_all_stars skips the selection
+    cat = catalog('SDSS-R9')
+    cat.data = data.copy()
+    assert cat.transform_filters(targetfilter, use_all_stars=True) == \
+        len(data)
+
+print('filter transformation tests passed')
@@ -0,0 +1,92 @@
+""" test the photometry database formats of pp_calibrate
+
+a catalog with masked integer and float columns (as produced by the
+left join of reference catalog data) is written to and read from
+SQLite (.db) and columnar FITS (.fdb) databases; both formats have to
+return the same values and the same missing values
+
+usage: python test_photometry_database.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from astropy.table import Table, MaskedColumn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from catalog import catalog
+
+
+def synthetic_photometry(n_sources=200, seed=0):
+    """calibrated frame catalog; reference star identifiers and
+    magnitudes are missing for sources without a reference star"""
+    rng = np.random.RandomState(seed)
+    unmatched = rng.uniform(size=n_sources) < 0.3
+    cat = catalog('frame0001.fits')
+    cat.origin = 'test'
+    cat.obstime = [2458000.5, 60.]
+    cat.filtername = 'V'
+    cat.data = Table([['src %d' % i for i in range(n_sources)],
+                      rng.uniform(120, 121, n_sources),
+                      rng.uniform(30, 31, n_sources),
+                      np.arange(n_sources, dtype=np.int64),
+                      MaskedColumn(rng.randint(0, 10**9, n_sources),
+                                   mask=unmatched, dtype=np.int64),
+                      MaskedColumn(rng.uniform(12, 18, n_sources),
+                                   mask=unmatched),
+                      np.where(unmatched, np.nan, 0.02),
+                      rng.uniform(12, 18, n_sources),
+                      np.ones(n_sources)*0.01],
+                     names=['ident', 'ra_deg', 'dec_deg', 'source_id',
+                            'ref_id', 'ref_Vmag', 'e_ref_Vmag',
+                            'Vmag', 'e_Vmag'], masked=True)
+    return cat, unmatched
+
+
+def missing(column):
+    """missing values of a column: masked or NaN"""
+    values = np.ma.getdata(column)
+    missing = np.ma.getmaskarray(column)
+    if values.dtype.kind == 'f':
+        missing = missing | np.isnan(values)
+    return missing
+
+
+def test_database_formats():
+    """masked columns agree between SQLite and columnar FITS files"""
+    cat, unmatched = synthetic_photometry()
+    workdir = tempfile.mkdtemp()
+    try:
+        read = {}
+        for format in ['sqlite', 'fits']:
+            root = os.path.join(workdir, 'frame0001')
+            assert cat.write_photometry(root, format=format) == len(unmatched)
+            read[format] = catalog('')
+            assert read[format].read_photometry(root, format=format) == \
+                len(unmatched)
+
+        sqlite, columnar = read['sqlite'], read['fits']
+        for attr in ['catalogname', 'origin', 'obstime', 'filtername']:
+            assert getattr(sqlite, attr) == getattr(columnar, attr)
+        assert sqlite.data.colnames == cat.data.colnames
+        assert columnar.data.colnames == cat.data.colnames
+
+        assert list(sqlite['ident']) == list(columnar['ident'])
+        for name in cat.data.colnames[1:]:
+            expected = missing(cat[name])
+            assert np.all(missing(sqlite[name]) == expected), name
+            assert np.all(missing(columnar[name]) == expected), name
+            assert np.all(np.array(sqlite[name])[~expected] ==
+                          np.ma.getdata(columnar[name])[~expected]), name
+        assert np.sum(missing(columnar['ref_id'])) == np.sum(unmatched)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    test_database_formats()
+    print('photometry database tests passed')
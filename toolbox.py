@@ -197,20 +197,21 @@ def get_binning(header, obsparam):
 
 
 def skycenter(catalogs, ra_key='ra_deg', dec_key='dec_deg'):
-    """derive center position and radius from catalogs"""
+    """derive center position and radius from catalogs (list of catalog
+    objects or MultiFrameCatalog)"""
     from astropy.coordinates import SkyCoord
     from astropy import units as u
+    from catalog import MultiFrameCatalog
+
+    if not isinstance(catalogs, MultiFrameCatalog):
+        catalogs = MultiFrameCatalog(catalogs, fields=[ra_key, dec_key])
 
     # using percentiles instead of min/max to get better handle
-    # on outliers
-    min_ra = min([np.percentile(cat[ra_key], 1)
-                  for cat in catalogs])
-    max_ra = max([np.percentile(cat[ra_key], 99)
-                  for cat in catalogs])
-    min_dec = min([np.percentile(cat[dec_key], 1)
-                   for cat in catalogs])
-    max_dec = max([np.percentile(cat[dec_key], 99)
-                   for cat in catalogs])
+    # on outliers; frames without sources are ignored
+    min_ra = np.nanmin(catalogs.group_percentile(ra_key, 1))
+    max_ra = np.nanmax(catalogs.group_percentile(ra_key, 99))
+    min_dec = np.nanmin(catalogs.group_percentile(dec_key, 1))
+    max_dec = np.nanmax(catalogs.group_percentile(dec_key, 99))
 
     ra, dec = (np.rad2deg(np.angle(np.exp(1j*np.deg2rad(min_ra)) +
                                    np.exp(1j*np.deg2rad(max_ra)))),